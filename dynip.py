@@ -4,10 +4,33 @@ DynIPD - Dynamic static IP configuration
 '''
 
 import sys
+import asyncio
 import argparse
 import configparser
+from socket import AF_INET, AF_INET6
+from dynipd.agent import NodeAgent, RESERVATION_LIFETIME
+from dynipd.allocation_management import AllocationManagement
+from dynipd.announcer import AddressAnnouncer
 from dynipd.config_parser import ConfigurationParser
-from dynipd.mysql_datastore import MySQLDataStore
+from dynipd.interface import NetworkInterfaceConfig
+from dynipd.node_state import NodeState, NodeStateFile
+from dynipd.policy import StandbyPolicy, StandbyPoolManager
+from dynipd.prober import ConnectivityProber
+from dynipd.protocol.client import AsyncDynIPClient
+from dynipd.reconciler import IPReconciler
+from dynipd.utilization import UtilizationScanner
+
+async def run_agent(agent, interval):
+    '''Steps the agent every interval seconds, until cancelled'''
+    while True:
+        try:
+            await agent.step()
+        except Exception as error: # pylint: disable=broad-except
+            # Most likely the state file. NodeAgent copes with the server and the interface
+            # itself; whatever this was, it's tried again next time rather than taking the
+            # node's IPs down with us
+            sys.stderr.write("Agent step failed: %r\n" % error)
+        await asyncio.sleep(interval)
 
 def main():
     '''Starts by loading our configuration and reporting settings'''
@@ -21,20 +44,82 @@ def main():
                         dest='filename',
                         help="Configuration file for dynipd",
                         metavar="FILE", default="/etc/dynipd.ini")
+    parser.add_argument("-s", "--state-file",
+                        dest='state_file',
+                        help="Where what this node owns is kept between restarts",
+                        metavar="FILE", default="/var/lib/dynipd/state.json")
     args = parser.parse_args()
 
     cfg_file = None
+    node_cfg = None
+    prober_cfg = None
     try:
         cfg_file = ConfigurationParser(args.filename)
+        node_cfg = cfg_file.get_node_configuration()
+        prober_cfg = cfg_file.get_prober_configuration()
     except FileNotFoundError:
         sys.stderr.write(("Configuration file %s not found. Bailing out!\n") % args.filename)
         sys.exit(-1)
     except configparser.MissingSectionHeaderError:
         sys.stderr.write("Configuration stanza is missing. Bailing out!\n")
         sys.exit(-1)
+    except ValueError as error:
+        sys.stderr.write("Invalid configuration: %s. Bailing out!\n" % error)
+        sys.exit(-1)
+
+    # Pick up where we left off if we can. Without a usable state file, we start out owning
+    # nothing, and the first step reconciles the interface against that
+    state_file = NodeStateFile(args.state_file)
+    node_state = state_file.load(node_cfg['machine_name'])
+    if node_state is None:
+        node_state = NodeState(node_cfg['machine_name'])
+
+    # How many standby IPs to hold is worked out from recent demand; see StandbyPolicy
+    policy = StandbyPolicy(node_cfg['low_watermark'], node_cfg['high_watermark'],
+                           node_cfg['demand_window'], node_cfg['forecast_horizon'],
+                           node_cfg['reserve_batch'], node_cfg['release_interval'])
+    allocation_management = AllocationManagement(node_cfg['location'], policy)
+    print('Standby policy: {}'.format(allocation_management.get_policy_information()))
+
+    # Everything goes through dynipd; nodes never talk to the database themselves
+    host, port = node_cfg['server']
+    client = AsyncDynIPClient(host, port, keepalive_interval=node_cfg['keepalive'])
+    interface_cfg = NetworkInterfaceConfig(node_cfg['interface'], cached=True)
+
+    # New IPs are announced so neighbours drop stale ARP/ND entries for them. That needs
+    # CAP_NET_RAW; without it we carry on, and the neighbours catch up in their own time
+    announcer = None
+    try:
+        announcer = AddressAnnouncer(node_cfg['interface'])
+    except OSError as error:
+        sys.stderr.write("Not announcing new IPs: %s\n" % error)
+    reconciler = IPReconciler(interface_cfg, node_cfg['networks'] or None, announcer)
+
+    # New IPs are only counted as standby once they've round tripped through the echo
+    # service for our family. With none configured, they're trusted as soon as they're up
+    prober = None
+    endpoint_key = {AF_INET: 'v4_endpoint', AF_INET6: 'v6_endpoint'}[node_cfg['family']]
+    if prober_cfg[endpoint_key]:
+        prober = ConnectivityProber(prober_cfg['v4_endpoint'], prober_cfg['v6_endpoint'],
+                                    prober_cfg['timeout'], prober_cfg['concurrency'])
+    pool_manager = StandbyPoolManager(policy, client, node_state, node_cfg['location'],
+                                      node_cfg['family'], RESERVATION_LIFETIME)
+    scanner = UtilizationScanner()
+    agent = NodeAgent(client, node_state, state_file, reconciler, node_cfg['interface'],
+                      node_cfg['networks'], pool_manager, scanner, prober=prober)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run_agent(agent, node_cfg['interval']))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(client.close())
+        scanner.close()
+        if announcer:
+            announcer.close()
+        interface_cfg.close()
+        loop.close()
 
-    # Establish connection to the datastore
-    data_store = MySQLDataStore(cfg_file.get_database_configuration())
-#    import pprint
-#    pprint.pprint(cfg_file.get_database_configuration())
 main()
@@ -9,8 +9,16 @@ import asyncio
 import argparse
 import sys
 import configparser
+import signal
 import socket
 from dynipd.server.asyncio_handler import AsyncServerHandler
+from dynipd.server.event_bus import EventBus
+from dynipd.server.executor import DatastoreExecutor
+from dynipd.server.metrics import ServerMetrics, start_metrics_server
+from dynipd.server.handoff import HandoffServer, HandoffError, take_over_listening_sockets, \
+    complete_takeover
+from dynipd.server.reload import ConfigurationReloader, ReloadError
+from dynipd.server.server_state import ServerState
 from dynipd.config_parser import ConfigurationParser
 from dynipd.mysql_datastore import MySQLDataStore
 
@@ -51,14 +59,76 @@ from dynipd.mysql_datastore import MySQLDataStore
 # giant hack to me. If anyone can provide any insight on the "right way" to do this, I'm all ears.
 
 
-def async_initializer(datastore):
-    '''Wrapper function for asnycio.start_server to grab the datastore object. See above'''
-    def begin_async_server(reader, writer):
+def async_initializer(server_state):
+    '''Wrapper function for asnycio.start_server to grab the shared server state. See above'''
+    async def begin_async_server(reader, writer):
         '''Initialize the server handler, and away we go'''
-        ash = AsyncServerHandler(reader, writer, datastore)
-        yield from ash.handle_inbound_connection()
+        ash = AsyncServerHandler(reader, writer, server_state)
+        await ash.handle_inbound_connection()
     return begin_async_server
 
+async def expire_reservations_periodically(loop, server_state, interval=30.0):
+    '''Periodically returns timed out reservations to the pool
+
+    Expiring reservations publishes RESERVATION_EXPIRED events, so subscribed clients hear
+    about it without polling'''
+    while True:
+        await asyncio.sleep(interval)
+        await loop.run_in_executor(server_state.executor,
+                                   server_state.datastore.expire_reservations)
+
+async def reload_configuration(reloader):
+    '''Handles SIGHUP; applies whatever changed in the configuration file'''
+    try:
+        changes = await reloader.reload()
+    except ReloadError as error:
+        sys.stderr.write("Configuration not reloaded: %s\n" % error)
+        return
+
+    for key, (old_value, new_value) in changes['settings'].items():
+        print('Reloaded {}: {} -> {}'.format(key, old_value, new_value))
+    for key, (old_value, new_value) in changes['restart_required'].items():
+        sys.stderr.write("Not reloaded {}: {} -> {} needs a restart to take effect\n".format(
+            key, old_value, new_value))
+    for change, networks in sorted(changes['topology'].items()):
+        if networks:
+            print('Topology {}: {}'.format(change, ', '.join(networks)))
+
+def bind_listening_sockets():
+    '''Opens the v4 and v6 listening sockets'''
+
+    # For those not familiar with Python Socket programming, let me explain why we're
+    # opening two sockets here. Under the defaults of *most* systems, opening an AF_INET6
+    # socket will open both a v4 and v6 connection. This behavior is controlled by
+    # IPV6_V6ONLY.
+    #
+    # However, the default setting for IPV6_V6ONLY is system defined, and not all operating
+    # systems set it, and the default can also be overridden. To prevent having to debug
+    # this later, we explicitly open two sockets, and enable IPV6_V6ONLY to prevent
+    # a double bind on the v4 address.
+
+    socket_v4 = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_IP)
+    socket_v4.bind(('', 8888))
+
+    socket_v6 = socket.socket(socket.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_IP)
+    socket_v6.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, True)
+    socket_v6.bind(('', 8888))
+
+    return [socket_v4, socket_v6]
+
+async def drain_and_stop(loop, servers, server_state, drain_timeout):
+    '''Called once a new dynipd has our listening sockets. Finishes up and exits
+
+    The new process shares the same kernel sockets, so closing ours doesn't refuse anything;
+    pending connections just get accepted over there instead.'''
+    for server in servers:
+        server.close()
+
+    server_state.begin_drain()
+    if not await server_state.wait_for_drain(drain_timeout):
+        sys.stderr.write("Gave up waiting for clients to disconnect after handoff\n")
+    loop.stop()
+
 def main():
     '''Starts dynipd server, and forks to background'''
 
@@ -71,54 +141,120 @@ def main():
                         dest='filename',
                         help="Configuration file for dynipd",
                         metavar="FILE", default="/etc/dynipd.ini")
+    parser.add_argument("--handoff-socket",
+                        dest='handoff_socket',
+                        help="Unix socket to hand our listening sockets to a new dynipd over",
+                        metavar="PATH", default=None)
+    parser.add_argument("--takeover",
+                        action='store_true',
+                        help="Take over the listening sockets of the dynipd on --handoff-socket")
     args = parser.parse_args()
 
+    if args.takeover and not args.handoff_socket:
+        parser.error("--takeover requires --handoff-socket")
+
     # Make sure our config file is kosher
     cfg_file = None
+    server_cfg = None
     try:
         cfg_file = ConfigurationParser(args.filename)
+        server_cfg = cfg_file.get_server_configuration()
     except FileNotFoundError:
         sys.stderr.write(("Configuration file %s not found. Bailing out!\n") % args.filename)
         sys.exit(-1)
     except configparser.MissingSectionHeaderError:
         sys.stderr.write("Configuration stanza is missing. Bailing out!\n")
         sys.exit(-1)
+    except ValueError as error:
+        sys.stderr.write("Invalid server configuration: %s. Bailing out!\n" % error)
+        sys.exit(-1)
 
     # Initialize our data store; on initialization, it will pull
     # configuration settings like network topology
-    datastore = MySQLDataStore(cfg_file.get_database_configuration())
+    # The executor and the connection pool are sized together; see DatastoreExecutor
+    event_bus = EventBus()
+    metrics = ServerMetrics()
+    database_cfg = cfg_file.get_database_configuration()
+    datastore = MySQLDataStore(dict(database_cfg), event_bus,
+                               pool_size=server_cfg['pool_size'],
+                               checkout_timeout=server_cfg['checkout_timeout'],
+                               metrics=metrics)
+    executor = DatastoreExecutor(server_cfg['pool_size'])
+    server_state = ServerState(datastore, event_bus, executor, server_cfg['read_freshness'],
+                               server_cfg['idle_timeout'], server_cfg['max_queued_requests'],
+                               metrics)
 
-    loop = asyncio.get_event_loop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
     # Each client connection will create a new protocol instance
 
-    # For those not familiar with Python Socket programming, let me explain why we're
-    # opening two sockets here. Under the defaults of *most* systems, opening an AF_INET6
-    # socket will open both a v4 and v6 connection. This behavior is controlled by
-    # IPV6_V6ONLY.
-    #
-    # However, the default setting for IPV6_V6ONLY is system defined, and not all operating
-    # systems set it, and the default can also be overridden. To prevent having to debug
-    # this later, we explicitly open two sockets, and enable IPV6_V6ONLY to prevent
-    # a double bind on the v4 address.
-
-    socket_v4 = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_IP)
-    socket_v4.bind(('', 8888))
+    # On a graceful reload, the listening sockets come from the dynipd we're replacing so
+    # clients never see a refused connection. Otherwise, bind our own
+    handoff_control = None
+    if args.takeover:
+        try:
+            (socket_v4, socket_v6), handoff_control = take_over_listening_sockets(
+                args.handoff_socket)
+        except (HandoffError, ValueError) as error:
+            sys.stderr.write("Takeover failed: %s. Bailing out!\n" % error)
+            sys.exit(-1)
+    else:
+        socket_v4, socket_v6 = bind_listening_sockets()
 
-    socket_v6 = socket.socket(socket.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_IP)
-    socket_v6.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, True)
-    socket_v6.bind(('', 8888))
-
-    # Both sockets are set, run two server loops, one for v4 and another for v6
-    coro_v4 = asyncio.start_server(async_initializer(datastore), None, None,
-                                   loop=loop, sock=socket_v4)
-    coro_v6 = asyncio.start_server(async_initializer(datastore), None, None,
-                                   loop=loop, sock=socket_v6)
+    # Both sockets are set, run two server loops, one for v4 and another for v6. asyncio's
+    # default backlog of 100 overflows when a row of machines boots at once, and anything
+    # that falls off it stalls for seconds in SYN retransmits
+    coro_v4 = asyncio.start_server(async_initializer(server_state), None, None,
+                                   sock=socket_v4, backlog=server_cfg['listen_backlog'])
+    coro_v6 = asyncio.start_server(async_initializer(server_state), None, None,
+                                   sock=socket_v6, backlog=server_cfg['listen_backlog'])
     server_v4 = loop.run_until_complete(coro_v4)
     server_v6 = loop.run_until_complete(coro_v6)
 
+    # We're accepting now, so the old process can stop
+    if handoff_control:
+        try:
+            complete_takeover(handoff_control)
+        except HandoffError as error:
+            # Both of us are serving, which is harmless, but the old one needs a human
+            sys.stderr.write("Takeover did not complete cleanly: %s\n" % error)
+
+    expiry_task = loop.create_task(expire_reservations_periodically(loop, server_state))
+
+    # Metrics get their own port, so scrapes never queue behind clients. During a handoff
+    # both of us hold it until the old process exits
+    metrics_server = None
+    loop_lag_task = None
+    if server_cfg['metrics_port']:
+        try:
+            metrics_server = loop.run_until_complete(start_metrics_server(
+                metrics, server_cfg['metrics_host'], server_cfg['metrics_port'],
+                reuse_port=True))
+            loop_lag_task = loop.create_task(metrics.watch_event_loop())
+        except OSError as error:
+            sys.stderr.write("Not serving metrics: %s\n" % error)
+
+    # SIGHUP re-reads the configuration file and applies it without dropping anyone
+    reloader = ConfigurationReloader(args.filename, server_state, server_cfg, database_cfg,
+                                     [socket_v4, socket_v6])
+    loop.add_signal_handler(signal.SIGHUP,
+                            lambda: loop.create_task(reload_configuration(reloader)))
+
+    handoff_task = None
+    if args.handoff_socket:
+        def on_handoff():
+            '''A new dynipd has our sockets; get out of its way'''
+            loop.create_task(drain_and_stop(loop, [server_v4, server_v6], server_state,
+                                            server_cfg['drain_timeout']))
+
+        handoff_server = HandoffServer(args.handoff_socket, [socket_v4, socket_v6], on_handoff)
+        handoff_task = loop.create_task(handoff_server.serve())
+
     # Serve requests until Ctrl+C is pressed
     print('Serving on {}'.format(server_v4.sockets[0].getsockname()))
     print('Serving on {}'.format(server_v6.sockets[0].getsockname()))
+    if metrics_server:
+        print('Metrics on {}'.format(metrics_server.sockets[0].getsockname()))
 
     try:
         loop.run_forever()
@@ -126,10 +262,24 @@ def main():
         pass
 
     # Close the server
+    expiry_task.cancel()
+    if loop_lag_task:
+        loop_lag_task.cancel()
+        loop.run_until_complete(asyncio.gather(loop_lag_task, return_exceptions=True))
+    if metrics_server:
+        metrics_server.close()
+        loop.run_until_complete(metrics_server.wait_closed())
+    if handoff_task:
+        handoff_task.cancel()
+        loop.run_until_complete(asyncio.gather(handoff_task, return_exceptions=True))
+    server_state.idle_reaper.stop()
     server_v4.close()
     server_v6.close()
     loop.run_until_complete(server_v4.wait_closed())
     loop.run_until_complete(server_v6.wait_closed())
     loop.close()
 
+    # A reload may have replaced the executor we started with
+    server_state.executor.shutdown()
+
 main()
@@ -0,0 +1,232 @@
+'''
+DynIPD - Node agent
+
+Keeps the IPs a node owns reserved on the server and configured on its interface, picking
+up from the NodeState saved by the last run.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import sys
+import time
+from pyroute2.netlink.exceptions import NetlinkError
+from dynipd.interface import DuplicateIPError, InterfaceConfigurationError, IPNotFound, \
+    InvalidNetworkDevice
+from dynipd.protocol.client import DynIPConnectionError, DynIPServerError
+from dynipd.reconciler import desired_ips_from_allocations
+
+# Most IPs a single RENEW may carry; MAX_BATCH_RESERVATION on the server
+RENEW_BATCH = 1024
+
+# Seconds a reservation lasts on the server after it's made or renewed
+RESERVATION_LIFETIME = 300.0
+
+# What configuring the interface can fail with; the reconcile is tried again next step
+INTERFACE_ERRORS = (InterfaceConfigurationError, DuplicateIPError, IPNotFound,
+                    InvalidNetworkDevice, NetlinkError, OSError)
+
+class NodeAgent(object):
+    '''Renews, reconciles and saves a node's state, one step() at a time
+
+    On each step:
+
+        - IPs whose reservation has already run out are dropped; the server will have
+          handed them back to the pool
+        - IPs whose reservation runs out within renew_within seconds are renewed. Any the
+          server didn't renew aren't ours any more, and are dropped
+        - given a StandbyPoolManager, the standby pool is topped up or trimmed, counting
+          the IPs scanner finds sockets on as utilized
+        - the interface is reconciled, but only if what we want on it has changed since the
+          last reconcile, or full_reconcile_interval seconds have passed. After a restart
+          with a saved state, that means no kernel dump at all until something changes
+        - given a ConnectivityProber, IPs the reconcile added are probed, and aren't counted
+          as standby until a probe gets through. The ones that don't are probed again on the
+          next step
+        - the state is saved if any of that changed it
+
+    Failing to reach the server isn't fatal; renewals are retried on the next step, and
+    there's time for a few of those before anything runs out. Nor is failing to configure
+    the interface; the reconcile is retried on the next step, and whatever renewing and
+    reserving changed is saved regardless.
+    '''
+
+    def __init__(self, client, node_state, state_file, reconciler, interface,
+                 managed_networks=None, pool_manager=None, scanner=None, renew_within=120.0,
+                 reservation_lifetime=RESERVATION_LIFETIME, full_reconcile_interval=300.0,
+                 prober=None):
+        '''
+        Args:
+            client - AsyncDynIPClient connected to dynipd
+            node_state - NodeState to work from; a fresh one if nothing was saved
+            state_file - NodeStateFile to save node_state to
+            reconciler - IPReconciler for the interface
+            interface - name of the interface, as node_state records it
+            managed_networks - the location's networks; see desired_ips_from_allocations()
+            pool_manager - StandbyPoolManager working from node_state, if the node keeps a
+                           standby pool
+            scanner - UtilizationScanner telling pool_manager which IPs are in use
+            prober - ConnectivityProber to test newly configured IPs with, if any
+        '''
+        # pylint: disable=too-many-arguments
+        self.client = client
+        self.node_state = node_state
+        self.state_file = state_file
+        self.reconciler = reconciler
+        self.interface = interface
+        self.managed_networks = managed_networks
+        self.pool_manager = pool_manager
+        self.scanner = scanner
+        self.renew_within = renew_within
+        self.reservation_lifetime = reservation_lifetime
+        self.full_reconcile_interval = full_reconcile_interval
+        self.prober = prober
+
+        self._last_full_reconcile = None
+
+        # Configured IPs no probe has got through from yet. Not saved; whatever was configured
+        # before a restart is taken to have been tested already
+        self.untested = set()
+
+        self.renewals = 0
+        self.reconciles = 0
+        self.probes = 0
+
+    async def step(self, now=None):
+        '''Runs one round of renewing, reconciling and saving. Returns True if the state
+        changed (and was saved)'''
+        now = time.time() if now is None else now
+        changed = self.drop_expired(now)
+        changed = await self.renew(now) or changed
+        changed = await self.manage_standby(now) or changed
+        try:
+            changed = self.reconcile(now) or changed
+        finally:
+            if changed:
+                self.state_file.save(self.node_state)
+        await self.probe()
+        return changed
+
+    def drop_expired(self, now=None):
+        '''Forgets IPs whose reservations have run out. Returns True if there were any'''
+        expired = set(self.node_state.expiring_reservations(0, now))
+        if not expired:
+            return False
+
+        sys.stderr.write('Reservations lapsed: %s\n' % ', '.join(sorted(expired)))
+        self._forget(expired)
+        return True
+
+    async def renew(self, now=None):
+        '''Renews reservations that are about to run out, and drops the ones the server
+        wouldn't renew. Returns True if anything changed'''
+        now = time.time() if now is None else now
+        expiring = self.node_state.expiring_reservations(self.renew_within, now)
+        if not expiring:
+            return False
+
+        changed = False
+        for start in range(0, len(expiring), RENEW_BATCH):
+            ip_addresses = expiring[start:start+RENEW_BATCH]
+            try:
+                renewed = await self.client.renew(self.node_state.machine_name, ip_addresses)
+            except (DynIPServerError, DynIPConnectionError) as error:
+                sys.stderr.write('Could not renew reservations: %s\n' % error)
+                break
+
+            # Whatever the server didn't renew has expired there, and may already be someone
+            # else's; it has to come off the interface
+            lost = set(ip_addresses) - set(renewed)
+            if lost:
+                sys.stderr.write('Reservations not renewed: %s\n' % ', '.join(sorted(lost)))
+                self._forget(lost)
+
+            deadline = now + self.reservation_lifetime
+            for ip_address in renewed:
+                self.node_state.set_reservation_deadline(ip_address, deadline)
+            self.renewals += len(renewed)
+            changed = True
+
+        return changed
+
+    async def manage_standby(self, now=None):
+        '''Steps the pool manager, if there is one. Returns True if anything was reserved
+        or released'''
+        if self.pool_manager is None:
+            return False
+
+        held = [ip_address for _, ip_addresses in self.node_state.get_allocations()
+                for ip_address in ip_addresses]
+        self.scanner.scan(held)
+        try:
+            result = await self.pool_manager.step(set(self.scanner.counts), now,
+                                                  self.untested)
+        except (DynIPServerError, DynIPConnectionError) as error:
+            sys.stderr.write('Could not manage the standby pool: %s\n' % error)
+            return False
+
+        return bool(result['reserved'] or result['released'])
+
+    def reconcile(self, now=None):
+        '''Reconciles the interface if it might be out of date. Returns True if it was
+
+        If the interface can't be configured, nothing is recorded as reconciled, so the next
+        call tries again'''
+        now = time.time() if now is None else now
+        desired_ips = desired_ips_from_allocations(self.node_state.get_allocations(),
+                                                   self.managed_networks)
+
+        full_due = self._last_full_reconcile is None or \
+            now - self._last_full_reconcile >= self.full_reconcile_interval
+        reconciled = self.node_state.get_reconciled(self.interface)
+        if reconciled is not None and _ip_set(reconciled) == _ip_set(desired_ips):
+            if self._last_full_reconcile is None:
+                # Resuming from a saved state that's still current; check the kernel agrees
+                # when the full reconcile comes round, not now
+                self._last_full_reconcile = now
+                return False
+            if not full_due:
+                return False
+
+        try:
+            adds, _ = self.reconciler.reconcile(desired_ips)
+        except INTERFACE_ERRORS as error:
+            sys.stderr.write('Could not reconcile %s: %s\n' % (self.interface, error))
+            return False
+
+        if self.prober is not None:
+            self.untested.update(ip_dict['ip_address'] for ip_dict in adds)
+            self.untested &= set(ip_dict['ip_address'] for ip_dict in desired_ips)
+
+        self.node_state.record_reconciled(self.interface, desired_ips)
+        self._last_full_reconcile = now
+        self.reconciles += 1
+        return True
+
+    async def probe(self):
+        '''Probes the configured IPs that haven't been through a probe yet. Returns how many
+        got through this time'''
+        if self.prober is None or not self.untested:
+            return 0
+
+        passed = 0
+        async for result in self.prober.probe_many(sorted(self.untested)):
+            self.probes += 1
+            if result['reachable']:
+                self.untested.discard(result['ip_address'])
+                passed += 1
+            else:
+                sys.stderr.write('Probe from %s failed: %s\n' % (result['ip_address'],
+                                                               result['error']))
+        return passed
+
+    def _forget(self, ip_addresses):
+        '''Drops IPs from node_state; the next reconcile takes them off the interface'''
+        self.node_state.set_allocations(
+            [(cidr, [ip_address for ip_address in allocated if ip_address not in ip_addresses])
+             for cidr, allocated in self.node_state.get_allocations()])
+
+def _ip_set(ip_dicts):
+    '''Returns ip_dicts as a set of (IP, prefix length), for comparison'''
+    return set((ip_dict['ip_address'], ip_dict['prefix_length']) for ip_dict in ip_dicts)
@@ -6,6 +6,7 @@ Created on Sep 19, 2015
 
 import ipaddress
 from dynipd.validation import ValidationAndNormlization as check
+from dynipd.validation import format_ip, ip_within_network, parse_ip
 from _socket import AF_INET, AF_INET6
 
 class AllocationFull(Exception):
@@ -36,8 +37,11 @@ class Allocation(object):
         # highest status of any IP within a block
         self._allocation_status = 'UNALLOCATED'
 
-        # Do the usual validation and sanity check
-        self._allocation = check.confirm_valid_network(ipaddress.ip_network(ip_range, strict=True))
+        # Do the usual validation and sanity check. NetworkBlock hands us network objects, so
+        # there's no need to go through a string for those
+        if not isinstance(ip_range, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+            ip_range = ipaddress.ip_network(ip_range, strict=True)
+        self._allocation = check.confirm_valid_network(ip_range)
         self._allocation_start = self._allocation.network_address
 
         address_size = None
@@ -49,6 +53,10 @@ class Allocation(object):
             address_size = 128
             self.family = AF_INET6
 
+        # IPs are checked and offset as integers; see parse_ip()
+        self._start_value = int(self._allocation_start)
+        self._network_key = (self.family, self._start_value, self._allocation.prefixlen)
+
         # Power of 2 math to the rescue; work out how many IPs we represent
         self._total_number_of_ip = 2**(address_size-self._allocation.prefixlen)
         self._available_ips = self._total_number_of_ip
@@ -95,19 +103,27 @@ class Allocation(object):
     def get_unused_ip(self):
         '''Returns an unallocated IP from the allocation'''
 
-        # Find the next open IP by walking the struct for the first gap
-        next_ip = None
-
-        for pointer in range(0, self._total_number_of_ip):
-            if not pointer in self._allocation_utilization:
-                next_ip = pointer
+        # A little IP math later, and we have our address
+        return self._allocation_start+self._get_unused_offset()
+
+    def reserve_unused_ips(self, count):
+        '''Moves up to count unused IPs to reserved. Returns the list of IPs reserved
+
+        Stops early if the allocation runs out; the caller can tell from the length'''
+        reserved = []
+        next_offset = 0
+        while len(reserved) < count:
+            # Everything below the last IP we reserved is known to be in use, so carry on
+            # from there rather than walking the whole allocation again
+            try:
+                next_offset = self._get_unused_offset(next_offset)
+            except AllocationFull:
                 break
 
-        if next_ip == None: # Zero can be a valid offset
-            raise AllocationFull('No unused IPs in block')
+            reserved.append(Allocation.mark_ip_as_reserved(
+                self, (self.family, self._start_value+next_offset)))
 
-        # A little IP math later, and we have our address
-        return self._allocation_start+next_ip
+        return reserved
 
     def get_usage(self):
         '''Reports the status of all IPs within a block'''
@@ -129,12 +145,12 @@ class Allocation(object):
     def mark_ip_as_reserved(self, ip_to_reserve):
         '''Moves an IP from unused to reserved'''
         # Check that this is a valid IP for this allocation
-        ip_address = ipaddress.ip_address(ip_to_reserve)
-        if not check.is_ip_within_block(ip_address, self._allocation):
+        ip_address = parse_ip(ip_to_reserve)
+        if not ip_within_network(ip_address, self._network_key):
             raise ValueError('ip_address not within allocation')
 
         if not self._confirm_ip_is_unused(ip_address):
-            raise ValueError(('%s is not UNALLOCATED' % (str(ip_address),) ))
+            raise ValueError(('%s is not UNALLOCATED' % (format_ip(*ip_address),) ))
 
         # We're good, create the allocation
         offset = self._calculate_offset(ip_address)
@@ -145,7 +161,7 @@ class Allocation(object):
         self._allocation_utilization.update({offset: ip_status})
 
         # We return the validated ip_address for postprocessing by the parent class
-        return ip_address
+        return self._allocation_start+offset
 
     def move_ip_to_standby(self, ip_address):
         '''Moves an IP to standby status'''
@@ -165,9 +181,7 @@ class Allocation(object):
 
     def _confirm_ip_is_unused(self, ip_address):
         '''Confirms an IP is unused within an allocation'''
-        ip_address = ipaddress.ip_address(ip_address)
-
-        offset = int(ip_address)-int(self._allocation_start)
+        offset = self._calculate_offset(ip_address)
 
         # if its not in the dict, its unused
         if not offset in self._allocation_utilization:
@@ -186,10 +200,20 @@ class Allocation(object):
     def _mark_broadcast_address(self):
         '''Mark the broadcast address'''
 
-        # The broadcast address is top of the block
-        self._allocation_utilization.update({self._total_number_of_ip : 'BROADCAST_ADDRESS'})
+        # The broadcast address is top of the block; offsets start from 0
+        self._allocation_utilization.update({self._total_number_of_ip-1 : 'BROADCAST_ADDRESS'})
         self._available_ips =- 1
 
+    def _get_unused_offset(self, start=0):
+        '''Returns the offset of the first unallocated IP at or after start'''
+
+        # Find the next open IP by walking the struct for the first gap
+        for pointer in range(start, self._total_number_of_ip):
+            if not pointer in self._allocation_utilization:
+                return pointer
+
+        raise AllocationFull('No unused IPs in block')
+
     def _calculate_offset(self, ip_address):
         '''Returns the offset within the dict of a given IP'''
-        return int(ip_address)-int(self._allocation_start)
+        return parse_ip(ip_address)[1]-self._start_value
@@ -4,14 +4,26 @@ Created on Sep 19, 2015
 @author: mcasadevall
 '''
 
+from dynipd.reconciler import IPReconciler, desired_ips_from_allocations
+
 class AllocationManagement(object):
     '''Interface for manipulating network state information in the database'''
 
-    def __init__(self, location):
-        '''Constructor'''
+    def __init__(self, location, policy=None):
+        '''Constructor
+
+        policy is the StandbyPolicy this node manages its standby pool with, if any'''
+        self.location = location
+        self.policy = policy
 
     def get_policy_information(self):
-        '''Shows allocation policies'''
+        '''Shows allocation policies, and the current demand forecast. None without a policy'''
+        if self.policy is None:
+            return None
+
+        information = self.policy.get_information()
+        information['location'] = self.location
+        return information
 
     def get_networks(self):
         '''Retrieves networks for this location'''
@@ -22,11 +34,28 @@ class AllocationManagement(object):
     def reserve_unused_allocation(self):
         '''Finds an unallocated IP, and allocates it'''
 
-    def configure_allocation(self):
-        '''Configurations an allocation on a network'''
+    def configure_allocation(self, interface_cfg, allocations, managed_networks=None):
+        '''Configurations allocations on an interface
+
+        Anything in managed_networks on the interface that isn't in allocations is removed.
+        See IPReconciler. Returns the (adds, removes) that were applied
+
+        Args:
+            interface_cfg - NetworkInterfaceConfig to configure
+            allocations - iterable of (allocation CIDR, list of IPs within it)
+            managed_networks - CIDR networks whose addresses we own on this interface. IPs
+                               take their prefix length from these; see
+                               desired_ips_from_allocations()
+        '''
+        reconciler = IPReconciler(interface_cfg, managed_networks)
+        return reconciler.reconcile(desired_ips_from_allocations(allocations, managed_networks))
 
-    def confirm_configuration(self):
-        '''Confirms an allocation is properly configured'''
+    def confirm_configuration(self, interface_cfg, allocations, managed_networks=None):
+        '''Confirms allocations are properly configured. Returns True if nothing needs to
+        change'''
+        reconciler = IPReconciler(interface_cfg, managed_networks)
+        return reconciler.is_converged(desired_ips_from_allocations(allocations,
+                                                                    managed_networks))
 
     def release_ip_to_pool(self):
         '''Releases an allocated IP back to the pool'''
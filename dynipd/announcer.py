@@ -0,0 +1,221 @@
+'''
+Gratuitous ARP and unsolicited Neighbor Advertisement announcer
+
+When an IP moves to a new machine, switches and neighbours keep sending its traffic to the
+old MAC address until their caches expire. Announcing the address (a gratuitous ARP for
+IPv4, an unsolicited NA for IPv6) gets them to update straight away. Since announcements
+are unacknowledged broadcasts, they're repeated a few times in case one gets lost.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import ipaddress
+import socket
+import struct
+import time
+from dynipd.validation import ValidationAndNormlization as check
+
+ETH_P_ARP = 0x0806
+ETH_P_IPV6 = 0x86dd
+ETHERNET_BROADCAST = b'\xff' * 6
+
+# ff02::1, all nodes, and the multicast MAC it maps to
+ALL_NODES_ADDRESS = ipaddress.ip_address('ff02::1').packed
+ALL_NODES_MAC = b'\x33\x33\x00\x00\x00\x01'
+
+ICMPV6_NEIGHBOR_ADVERTISEMENT = 136
+NA_FLAG_OVERRIDE = 0x20000000
+ND_OPTION_TARGET_LINK_ADDRESS = 2
+IPPROTO_ICMPV6 = 58
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IOVec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr),
+                ('msg_len', ctypes.c_uint)]
+
+def _load_sendmmsg():
+    '''Returns libc's sendmmsg(), or None if we don't have one'''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+_SENDMMSG = _load_sendmmsg()
+
+class AddressAnnouncer(object):
+    '''Announces IPs on an interface with gratuitous ARPs and unsolicited NAs
+
+    Frames are built once per address, and sent in bursts of up to burst_size frames per
+    system call with sendmmsg() (one send() per frame if libc doesn't have it). Each round
+    sends every frame; there are repeat rounds, interval seconds apart.
+
+    Needs CAP_NET_RAW.
+    '''
+
+    def __init__(self, interface, repeat=3, interval=1.0, burst_size=64):
+        '''Opens a packet socket on the interface
+
+        Args:
+            interface - name of the interface to announce on (i.e. 'eth0')
+            repeat - how many times each address is announced
+            interval - seconds between rounds
+            burst_size - most frames handed to the kernel in one system call
+        '''
+        self.interface = interface
+        self.repeat = repeat
+        self.interval = interval
+        self.burst_size = burst_size
+
+        # Protocol 0 means we never receive anything on this socket
+        self._socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        try:
+            self._socket.bind((interface, 0))
+        except OSError:
+            self._socket.close()
+            raise
+
+        # The kernel tells us the interface's MAC address when we bind
+        self.mac_address = self._socket.getsockname()[4]
+
+        self.frames_sent = 0
+        self.system_calls = 0
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        '''Closes the packet socket'''
+        if getattr(self, '_socket', None):
+            self._socket.close()
+            self._socket = None
+
+    def build_frames(self, ip_addresses):
+        '''Returns the announcement frames for a list of IPs, v4 and v6 mixed
+
+        Raises:
+            ValueError - an IP address is invalid
+        '''
+        frames = []
+        for ip_address in ip_addresses:
+            ip_address = ipaddress.ip_address(check.validate_and_normalize_ip(ip_address))
+            if ip_address.version == 4:
+                frames.append(build_gratuitous_arp(self.mac_address, ip_address))
+            else:
+                frames.append(build_unsolicited_na(self.mac_address, ip_address))
+        return frames
+
+    def announce(self, ip_addresses):
+        '''Announces every IP, repeat times. Blocks until the last round is sent
+
+        Raises:
+            ValueError - an IP address is invalid. Nothing is sent
+            OSError - the kernel refused to send
+        '''
+        frames = self.build_frames(ip_addresses)
+        for round_number in range(self.repeat):
+            if round_number:
+                time.sleep(self.interval)
+            self.send_frames(frames)
+
+    def send_frames(self, frames):
+        '''Sends a list of frames once, in bursts'''
+        for offset in range(0, len(frames), self.burst_size):
+            burst = frames[offset:offset+self.burst_size]
+            if _SENDMMSG:
+                self._sendmmsg(burst)
+            else:
+                for frame in burst:
+                    self._socket.send(frame)
+                    self.system_calls += 1
+            self.frames_sent += len(burst)
+
+    def _sendmmsg(self, frames):
+        '''Hands a burst of frames to the kernel with as few sendmmsg() calls as it takes'''
+        buffers = [ctypes.create_string_buffer(frame, len(frame)) for frame in frames]
+        iovecs = (_IOVec * len(frames))()
+        messages = (_MMsgHdr * len(frames))()
+        for index, frame_buffer in enumerate(buffers):
+            iovecs[index].iov_base = ctypes.addressof(frame_buffer)
+            iovecs[index].iov_len = len(frames[index])
+            messages[index].msg_hdr.msg_iov = ctypes.pointer(iovecs[index])
+            messages[index].msg_hdr.msg_iovlen = 1
+
+        # sendmmsg() can stop short, in which case we carry on from where it did
+        sent = 0
+        while sent < len(frames):
+            result = _SENDMMSG(self._socket.fileno(), ctypes.pointer(messages[sent]),
+                               len(frames) - sent, 0)
+            self.system_calls += 1
+            if result < 0:
+                error = ctypes.get_errno()
+                if error == errno.EINTR:
+                    continue
+                raise OSError(error, 'sendmmsg: %s' % errno.errorcode.get(error, error))
+            sent += result
+
+def build_gratuitous_arp(mac_address, ip_address):
+    '''Builds a broadcast ARP request for our own address, as arping -U sends'''
+    ip_bytes = ipaddress.IPv4Address(ip_address).packed
+    ethernet = ETHERNET_BROADCAST + mac_address + struct.pack('!H', ETH_P_ARP)
+    arp = struct.pack('!HHBBH6s4s6s4s',
+                      1,            # Ethernet
+                      0x0800,       # IPv4
+                      6, 4,
+                      1,            # Request
+                      mac_address, ip_bytes,
+                      b'\x00' * 6, ip_bytes)
+    return ethernet + arp
+
+def build_unsolicited_na(mac_address, ip_address):
+    '''Builds an unsolicited Neighbor Advertisement for our own address to all nodes
+
+    Per RFC 4861 7.2.6, Override is set, Solicited isn't, and our link-layer address is
+    included'''
+    ip_bytes = ipaddress.IPv6Address(ip_address).packed
+    icmp = struct.pack('!BBHI16sBB6s',
+                       ICMPV6_NEIGHBOR_ADVERTISEMENT, 0, 0,
+                       NA_FLAG_OVERRIDE,
+                       ip_bytes,
+                       ND_OPTION_TARGET_LINK_ADDRESS, 1, mac_address)
+
+    pseudo_header = ip_bytes + ALL_NODES_ADDRESS + struct.pack('!I3xB', len(icmp),
+                                                               IPPROTO_ICMPV6)
+    checksum = _internet_checksum(pseudo_header + icmp)
+    icmp = icmp[:2] + struct.pack('!H', checksum) + icmp[4:]
+
+    # Hop limit has to be 255, or receivers throw it away
+    ipv6 = struct.pack('!IHBB16s16s', 6 << 28, len(icmp), IPPROTO_ICMPV6, 255,
+                       ip_bytes, ALL_NODES_ADDRESS)
+    ethernet = ALL_NODES_MAC + mac_address + struct.pack('!H', ETH_P_IPV6)
+    return ethernet + ipv6 + icmp
+
+def _internet_checksum(data):
+    '''RFC 1071 checksum'''
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
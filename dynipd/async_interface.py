@@ -0,0 +1,213 @@
+'''
+Asyncio Network Interface Configuration
+
+AsyncNetworkInterfaceConfig is NetworkInterfaceConfig for code that lives in an event loop,
+such as a node agent that also talks to the dynipd server. Netlink requests go out over a
+non-blocking socket registered with the loop, so any number of them can be in flight at once
+without blocking anything else.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+from socket import AF_INET, AF_INET6
+from pyroute2 import AsyncIPRoute
+from dynipd.interface import InterfaceConfigBase, InterfaceConfigurationError, IPNotFound, \
+    InvalidNetworkDevice, DuplicateIPError, NETLINK_BATCH_SIZE, parse_address_message
+from dynipd.route_dump import async_dump_routes
+from dynipd.validation import ValidationAndNormlization as check
+
+class AsyncNetworkInterfaceConfig(InterfaceConfigBase):
+    '''Asyncio version of NetworkInterfaceConfig
+
+    The API is the same, except every call that talks to the kernel is a coroutine, and
+    the interface has to be opened before use:
+
+        async with AsyncNetworkInterfaceConfig('eth0') as interface_cfg:
+            await interface_cfg.add_v4_ip('192.0.2.10', 24)
+
+    Requests are matched to their responses by sequence number, so it's fine for many
+    coroutines to share one instance at the same time. The one exception is that the kernel
+    only runs one dump per socket at a time (anything else gets EBUSY), so address dumps
+    take turns. Validation, and the same before and after checks NetworkInterfaceConfig
+    does, are shared with it through InterfaceConfigBase.
+    '''
+
+    def __init__(self, interface):
+        '''Sets up to manipulate a given interface. Nothing happens until open()
+
+        Args:
+            interface - name of the interface to manipulate (i.e. 'eth0')
+        '''
+        self.interface = interface
+        self.iproute_api = None
+        self._dump_lock = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def open(self):
+        '''Opens the netlink socket, and looks up the interface. Returns self
+
+        Raises:
+            InvalidNetworkDevice - if the interface does not exist
+        '''
+        self.iproute_api = AsyncIPRoute()
+        self._dump_lock = asyncio.Lock()
+        try:
+            self.interface_index = await self._get_interface_index()
+        except InvalidNetworkDevice:
+            self.close()
+            raise
+
+        return self
+
+    def close(self):
+        '''Closes the netlink socket'''
+        if self.iproute_api:
+            self.iproute_api.close()
+            self.iproute_api = None
+
+    async def _get_interface_index(self):
+        '''Private API to get the interface index number
+
+        Raises:
+            InvalidNetworkDevice - if an interface isn't found by pyroute2
+        '''
+        links = await self.iproute_api.link_lookup(ifname=self.interface)
+        if not links:
+            raise InvalidNetworkDevice("Interface not found")
+
+        return links[0]
+
+    async def get_ips(self):
+        '''Returns a list of ip_dicts for this interface. See NetworkInterfaceConfig.get_ips()'''
+        async with self._dump_lock:
+            ip_cfgs = await self.iproute_api.get_addr(index=self.interface_index)
+            return [parse_address_message(ip_cfg) async for ip_cfg in ip_cfgs]
+
+    async def get_full_ip_info(self, wanted_address):
+        '''Returns an ip_dict for an individual IP address. Format identical to get_ips()
+
+        Raises:
+            ValueError - wanted_address is not a valid IP address
+            IPNotFound - this interface doesn't have this IP address
+        '''
+        wanted_address = check.validate_and_normalize_ip(wanted_address)
+        return self._find_ip(wanted_address, await self.get_ips())
+
+    async def add_v4_ip(self, ip_address, prefix_length):
+        '''Wrapper for add_ip - adds an IPv4 address to this interface'''
+        await self.add_ip({'ip_address': ip_address,
+                           'family': AF_INET,
+                           'prefix_length': prefix_length})
+
+    async def add_v6_ip(self, ip_address, prefix_length):
+        '''Wrapper for add_ip - adds an IPv6 address to this interface'''
+        await self.add_ip({'ip_address': ip_address,
+                           'family': AF_INET6,
+                           'prefix_length': prefix_length})
+
+    async def add_ip(self, ip_dict):
+        '''Adds an IP to an interface. See NetworkInterfaceConfig.add_ip()
+
+        Raises:
+            ValueError, DuplicateIPError, InterfaceConfigurationError
+        '''
+        check.validate_and_normalize_ip_dict(ip_dict)
+
+        # Throw an error if we try to add an existing address.
+        try:
+            await self.get_full_ip_info(ip_dict['ip_address'])
+        except IPNotFound:
+            pass
+        else:
+            raise DuplicateIPError("This IP has already been assigned!")
+
+        # We call add slightly differently based on socket family
+        if ip_dict['family'] == AF_INET:
+            await self.iproute_api.addr('add',
+                                        index=self.interface_index,
+                                        family=AF_INET,
+                                        address=ip_dict['ip_address'],
+                                        broadcast=ip_dict['broadcast'],
+                                        prefixlen=ip_dict['prefix_length'])
+
+        if ip_dict['family'] == AF_INET6:
+            await self.iproute_api.addr('add',
+                                        index=self.interface_index,
+                                        family=AF_INET6,
+                                        address=ip_dict['ip_address'],
+                                        prefixlen=ip_dict['prefix_length'])
+
+        # Do a sanity check and make sure the IP actually got added
+        ip_check = await self.get_full_ip_info(ip_dict['ip_address'])
+
+        if not (ip_check['ip_address'] == ip_dict['ip_address'] and
+                ip_check['prefix_length'] == ip_dict['prefix_length']):
+            raise InterfaceConfigurationError("IP failed to add!")
+
+    async def remove_ip(self, ip_address):
+        '''Removes an IP from an interface. See NetworkInterfaceConfig.remove_ip()
+
+        Raises:
+            ValueError, IPNotFound, InterfaceConfigurationError
+        '''
+        ip_info = await self.get_full_ip_info(ip_address)
+
+        # Attempt to delete
+        if ip_info['family'] == AF_INET:
+            await self.iproute_api.addr('delete',
+                                        index=self.interface_index,
+                                        address=ip_info['ip_address'],
+                                        broadcast=ip_info.get('broadcast'),
+                                        prefixlen=ip_info['prefix_length'])
+
+        if ip_info['family'] == AF_INET6:
+            await self.iproute_api.addr('delete',
+                                        index=self.interface_index,
+                                        address=ip_info['ip_address'],
+                                        prefixlen=ip_info['prefix_length'])
+
+        # Confirm the delete
+        try:
+            await self.get_full_ip_info(ip_address)
+        except IPNotFound:
+            return
+
+        raise InterfaceConfigurationError("IP deletion failure")
+
+    async def apply_ip_changes(self, adds=None, removes=None, configured_ips=None):
+        '''Adds and removes many IPs with one netlink batch. See
+        NetworkInterfaceConfig.apply_ip_changes()
+
+        Raises:
+            ValueError, DuplicateIPError, IPNotFound, InterfaceConfigurationError
+        '''
+        adds, removes = self._normalize_ip_changes(adds, removes)
+        if configured_ips is None:
+            configured_ips = await self.get_ips()
+        messages, wanted_ips = self._plan_ip_changes(adds, removes, configured_ips)
+
+        # As with the blocking version, the dump afterwards is what tells us what failed
+        for offset in range(0, len(messages), NETLINK_BATCH_SIZE):
+            async for _ in self.iproute_api.nlm_request_batch(
+                    messages[offset:offset+NETLINK_BATCH_SIZE], noraise=True):
+                pass
+
+        self._verify_ip_changes(removes, wanted_ips, await self.get_ips())
+
+    async def get_routes(self):
+        '''Gets routes for an interface. See NetworkInterfaceConfig.get_routes()'''
+        routing_table = []
+        for family in (AF_INET, AF_INET6):
+            async for route in async_dump_routes(family, oif=self.interface_index):
+                route_dict = self._parse_route_message(route)
+                if route_dict:
+                    routing_table.append(route_dict)
+        return routing_table
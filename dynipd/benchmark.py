@@ -0,0 +1,306 @@
+'''
+DynIPD - Protocol load generator and latency benchmark
+
+Opens a large number of concurrent sessions against a dynipd server and replays a weighted
+mix of commands, recording the latency of every request. It can run against a real server, or
+start one in-process on top of StandInDataStore so the server's own overhead can be measured
+without a MySQL server in the way.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import ipaddress
+import math
+import random
+import threading
+import time
+from socket import AF_INET, AF_INET6
+from dynipd.network_block import NetworkBlock, carve_reservations
+from dynipd.server.asyncio_handler import AsyncServerHandler
+from dynipd.server.event_bus import EventBus
+from dynipd.server.executor import DatastoreExecutor
+from dynipd.server.server_state import ServerState
+from dynipd.validation import ValidationAndNormlization as check
+
+class StandInDataStore(object):
+    '''Local stand-in for MySQLDataStore, for benchmarking the server by itself
+
+    Only implements what the protocol handler calls. Every call sleeps for query_latency
+    seconds to stand in for the round trip to the database; set it to 0 to measure nothing
+    but the server. Allocations are carved out of real NetworkBlocks, so that cost is
+    included, but nothing is persisted.
+    '''
+
+    # One v4 and one v6 network in BenchLocation unless we're told otherwise
+    default_topology = [{'id': 1, 'name': 'BenchNet', 'location': 'BenchLocation',
+                         'family': AF_INET, 'network': '10.0.0.0/12', 'allocation_size': 28,
+                         'reserved_blocks': ''},
+                        {'id': 2, 'name': 'BenchNetv6', 'location': 'BenchLocation',
+                         'family': AF_INET6, 'network': 'fd00:a3b1:78a2::/48',
+                         'allocation_size': 64, 'reserved_blocks': ''}]
+
+    def __init__(self, query_latency=0.001, machines=None, topology=None):
+        self.query_latency = query_latency
+        self.event_bus = None
+        self.queries = 0
+        self._lock = threading.Lock()
+        self._machines = {}
+
+        # {allocation CIDR: (machine name, AllocationServerSide)}, for RELEASE, and
+        # {IP: machine name}, for RENEW
+        self._allocations = {}
+        self._reservations = {}
+
+        for machine_id, name in enumerate(machines or ['BenchMachine'], start=1):
+            self._machines[name] = {'id': machine_id, 'name': name, 'token': 'benchmark'}
+
+        self._networks = [NetworkBlock(row, self) for row in topology or self.default_topology]
+
+    def refresh_network_topogoly(self, incremental=False):
+        '''Pretends to reload the topology'''
+        # pylint: disable=unused-argument
+        self._query()
+        return {'added': [], 'changed': [], 'removed': []}
+
+    def reconfigure(self, db_info_dict=None, pool_size=None, checkout_timeout=None):
+        '''There's no pool to rebuild; returns True if it would have been'''
+        # pylint: disable=unused-argument
+        return db_info_dict is not None or pool_size is not None
+
+    def get_machine(self, name):
+        '''Returns a fake machine row, or None for machines we weren't told about'''
+        self._query()
+        return self._machines.get(name)
+
+    def get_networks_by_location(self, location):
+        '''Returns the NetworkBlocks in a location'''
+        self._query()
+        return [network for network in self._networks if network.location == location]
+
+    def get_networks(self):
+        '''Returns every NetworkBlock; the real datastore reads these from memory too'''
+        return list(self._networks)
+
+    def reserve_ips(self, machine, location, family, count):
+        '''Same as MySQLDataStore.reserve_ips, minus the transaction'''
+        self._query()
+        with self._lock:
+            networks = [network for network in self._networks
+                        if network.location == location and network.family == family]
+            carved = carve_reservations(networks, machine, count)
+            for allocation, ip_addresses in carved:
+                self._allocations[allocation.get_allocation_cidr()] = (machine.get_name(),
+                                                                       allocation)
+                for ip_address in ip_addresses:
+                    self._reservations[str(ip_address)] = machine.get_name()
+            return carved
+
+    def renew_reservations(self, machine, ip_addresses):
+        '''Returns the IPs the machine has reserved; nothing ever expires here'''
+        ip_addresses = [check.validate_and_normalize_ip(ip_address)
+                        for ip_address in ip_addresses]
+        self._query()
+        with self._lock:
+            return [ip_address for ip_address in ip_addresses
+                    if self._reservations.get(ip_address) == machine.get_name()]
+
+    def release_allocations(self, machine, allocation_cidrs):
+        '''Same as MySQLDataStore.release_allocations, minus the transaction'''
+        allocation_cidrs = [check.validate_and_normalize_ip_network(cidr)
+                            for cidr in allocation_cidrs]
+        self._query()
+        released = 0
+        with self._lock:
+            for cidr in allocation_cidrs:
+                if self._allocations.get(cidr, (None,))[0] != machine.get_name():
+                    continue
+                _, allocation = self._allocations.pop(cidr)
+                allocation.get_network_block()._mark_allocation_free(cidr) # pylint: disable=protected-access
+                network = ipaddress.ip_network(cidr)
+                for ip_address in [ip_address for ip_address in self._reservations
+                                   if ipaddress.ip_address(ip_address) in network]:
+                    del self._reservations[ip_address]
+                released += 1
+        return released
+
+    def expire_reservations(self):
+        '''Nothing ever expires in the stand-in'''
+        self._query()
+        return 0
+
+    def get_pool_stats(self):
+        '''Reports how many queries we've pretended to run'''
+        return {'stand_in_queries': self.queries}
+
+    def _query(self):
+        '''Accounts for, and simulates, a round trip to the database'''
+        with self._lock:
+            self.queries += 1
+        if self.query_latency:
+            time.sleep(self.query_latency)
+
+class LatencyRecorder(object):
+    '''Collects per-verb latencies and works out percentiles'''
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, verb, latency):
+        '''Records a successful request'''
+        self.latencies.setdefault(verb, []).append(latency)
+
+    def record_error(self, verb):
+        '''Records a request that got an error response, or no response at all'''
+        self.errors[verb] = self.errors.get(verb, 0) + 1
+
+    def summarize(self, elapsed):
+        '''Returns a dict per verb of count, errors, throughput and p50/p99/p999 in seconds'''
+        summary = {}
+        for verb in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies.get(verb, []))
+            summary[verb] = {'count': len(latencies),
+                             'errors': self.errors.get(verb, 0),
+                             'throughput': len(latencies) / elapsed if elapsed else 0.0,
+                             'p50': percentile(latencies, 50),
+                             'p99': percentile(latencies, 99),
+                             'p999': percentile(latencies, 99.9)}
+        return summary
+
+def percentile(sorted_values, pct):
+    '''Nearest-rank percentile of an already sorted list. None if the list is empty'''
+    if not sorted_values:
+        return None
+
+    # The round() stops float error (99.9 / 100 * 1000 = 999.0000000000001) bumping us up a rank
+    rank = math.ceil(round(pct / 100.0 * len(sorted_values), 9)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+def parse_verb_mix(mix_string):
+    '''Turns "TEST=9,STATS=1" into {'TEST': 9, 'STATS': 1}
+
+    Commands can have arguments ("SUBSCRIBE BenchMachine=1"); latency is reported under
+    the verb alone.'''
+    mix = {}
+    for entry in mix_string.split(','):
+        command, _, weight = entry.rpartition('=')
+        if not command:
+            raise ValueError('Verb mix entries look like COMMAND=weight, got %r' % entry)
+        mix[command.strip()] = float(weight)
+
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError('Verb mix needs at least one positive weight')
+    return mix
+
+async def run_session(host, port, verb_mix, requests, recorder, timeout=30.0):
+    '''Runs a single client session, sending requests commands picked from verb_mix
+
+    A request that gets no response within timeout seconds is an error, and ends the session'''
+    # pylint: disable=too-many-arguments
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        greeting = await asyncio.wait_for(reader.readline(), timeout)
+        if not greeting.startswith(b'200'):
+            recorder.record_error('CONNECT')
+            return
+
+        # TEST2 is how a session authenticates, and it doesn't send a response
+        writer.write(b'TEST2\n')
+
+        commands = list(verb_mix.keys())
+        weights = list(verb_mix.values())
+
+        for command in random.choices(commands, weights, k=requests):
+            verb = command.split()[0]
+            started = time.perf_counter()
+            writer.write(command.encode() + b'\n')
+            await writer.drain()
+
+            try:
+                response = await asyncio.wait_for(reader.readline(), timeout)
+            except asyncio.TimeoutError:
+                response = b''
+
+            if not response or response[:1] in (b'4', b'5'):
+                recorder.record_error(verb)
+                if not response:
+                    return
+                continue
+
+            recorder.record(verb, time.perf_counter() - started)
+    except ConnectionError:
+        recorder.record_error('CONNECT')
+    finally:
+        writer.close()
+
+async def run_load(host, port, sessions, requests_per_session, verb_mix, connect_rate=None):
+    '''Runs sessions concurrent sessions against host:port
+
+    connect_rate spreads out connection attempts (per second); None connects everyone at once,
+    which is the worst case. Returns (LatencyRecorder, elapsed seconds)'''
+    # pylint: disable=too-many-arguments
+    recorder = LatencyRecorder()
+    started = time.perf_counter()
+
+    async def delayed_session(delay):
+        if delay:
+            await asyncio.sleep(delay)
+        await run_session(host, port, verb_mix, requests_per_session, recorder)
+
+    results = await asyncio.gather(*[delayed_session(i / connect_rate if connect_rate else 0)
+                                     for i in range(sessions)],
+                                   return_exceptions=True)
+
+    for result in results:
+        if isinstance(result, Exception):
+            recorder.record_error('CONNECT')
+
+    return (recorder, time.perf_counter() - started)
+
+async def start_in_process_server(datastore, pool_size=20, host='127.0.0.1', backlog=4096,
+                                  max_queued_requests=256, metrics=None, executor=None):
+    # pylint: disable=too-many-arguments
+    '''Starts a dynipd protocol server on an ephemeral port. Returns (server, port)
+
+    asyncio's default listen backlog of 100 overflows when thousands of sessions connect at
+    once, and the connections that fall off it stall for seconds in SYN retransmits. That's
+    worth measuring against a real server, but not by default here.
+
+    Pass an executor to be able to shut it down afterwards; otherwise a DatastoreExecutor of
+    pool_size threads is made, and lives as long as the process.'''
+    if executor is None:
+        executor = DatastoreExecutor(pool_size)
+    server_state = ServerState(datastore, EventBus(), executor,
+                               max_queued_requests=max_queued_requests, metrics=metrics)
+
+    async def begin_async_server(reader, writer):
+        '''Same as dynipd.py's, minus the globals'''
+        ash = AsyncServerHandler(reader, writer, server_state)
+        await ash.handle_inbound_connection()
+
+    server = await asyncio.start_server(begin_async_server, host, 0, backlog=backlog)
+    return (server, server.sockets[0].getsockname()[1])
+
+def format_report(summary, elapsed):
+    '''Formats the output of LatencyRecorder.summarize() as a table'''
+    def milliseconds(value):
+        return '-' if value is None else '%.3f' % (value * 1000)
+
+    lines = ['%-12s %9s %7s %11s %10s %10s %10s' % ('verb', 'requests', 'errors', 'req/s',
+                                                    'p50 ms', 'p99 ms', 'p999 ms')]
+    total = 0
+    for verb, stats in summary.items():
+        total += stats['count']
+        lines.append('%-12s %9d %7d %11.1f %10s %10s %10s' % (verb, stats['count'],
+                                                              stats['errors'],
+                                                              stats['throughput'],
+                                                              milliseconds(stats['p50']),
+                                                              milliseconds(stats['p99']),
+                                                              milliseconds(stats['p999'])))
+
+    lines.append('%d requests in %.2fs, %.1f req/s overall' % (total, elapsed,
+                                                              total / elapsed if elapsed else 0))
+    return '\n'.join(lines)
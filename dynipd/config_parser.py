@@ -5,6 +5,8 @@ Created on Sep 18, 2015
 '''
 
 import configparser
+import socket
+from dynipd.validation import ValidationAndNormlization as check
 
 class ConfigurationParser(object):
     '''Configuration File Helper'''
@@ -30,6 +32,145 @@ class ConfigurationParser(object):
         '''Returns database configuration'''
         return self._load_database_configuration(config_stanza)
 
-    def get_node_configuration(self):
-        '''Gets information related to this node'''
-        pass
+    def get_server_configuration(self, config_stanza='dynipd-server'):
+        '''Returns dynipd server tuning settings. Anything not set gets a default
+
+        Keys:
+            pool_size - database connections, and threads to run datastore calls on
+            checkout_timeout - seconds to wait for a free database connection
+            read_freshness - seconds a coalesced read result may be reused for
+            idle_timeout - seconds a client may sit idle before being disconnected
+            drain_timeout - seconds to let clients finish up after handing off to a new process
+            max_queued_requests - new reservations allowed to wait before more are told to
+                                  retry later
+            listen_backlog - connections the kernel holds for us before we accept them
+            metrics_host, metrics_port - where Prometheus metrics are served; a port of 0
+                                         turns them off
+        '''
+        server_config = {}
+        server_config['pool_size'] = self.config_parser.getint(config_stanza, "pool_size",
+                                                               fallback=20)
+        server_config['checkout_timeout'] = self.config_parser.getfloat(config_stanza,
+                                                                        "checkout_timeout",
+                                                                        fallback=5.0)
+        server_config['read_freshness'] = self.config_parser.getfloat(config_stanza,
+                                                                      "read_freshness",
+                                                                      fallback=0.5)
+        server_config['idle_timeout'] = self.config_parser.getfloat(config_stanza,
+                                                                    "idle_timeout",
+                                                                    fallback=10.0)
+        server_config['drain_timeout'] = self.config_parser.getfloat(config_stanza,
+                                                                     "drain_timeout",
+                                                                     fallback=30.0)
+        server_config['max_queued_requests'] = self.config_parser.getint(config_stanza,
+                                                                         "max_queued_requests",
+                                                                         fallback=256)
+        server_config['listen_backlog'] = self.config_parser.getint(config_stanza,
+                                                                    "listen_backlog",
+                                                                    fallback=4096)
+        server_config['metrics_host'] = self.config_parser.get(config_stanza, "metrics_host",
+                                                               fallback='127.0.0.1')
+        server_config['metrics_port'] = self.config_parser.getint(config_stanza, "metrics_port",
+                                                                  fallback=9888)
+
+        # mysql.connector won't build a pool larger than this
+        if server_config['pool_size'] < 1 or server_config['pool_size'] > 32:
+            raise ValueError('pool_size must be between 1 and 32')
+        if server_config['metrics_port'] < 0 or server_config['metrics_port'] > 65535:
+            raise ValueError('metrics_port must be between 0 and 65535')
+
+        return server_config
+
+    def get_prober_configuration(self, config_stanza='dynipd-prober'):
+        '''Returns connectivity prober settings. Anything not set gets a default
+
+        Keys:
+            v4_endpoint - (host, port) of the echo service for IPv4, from host:port
+            v6_endpoint - (host, port) of the echo service for IPv6, from [host]:port
+            timeout - seconds an individual probe may take
+            concurrency - most probes in flight at once
+        '''
+        prober_config = {}
+        for key in ('v4_endpoint', 'v6_endpoint'):
+            endpoint = self.config_parser.get(config_stanza, key, fallback=None)
+            prober_config[key] = self._parse_endpoint(endpoint) if endpoint else None
+
+        prober_config['timeout'] = self.config_parser.getfloat(config_stanza, "timeout",
+                                                               fallback=2.0)
+        prober_config['concurrency'] = self.config_parser.getint(config_stanza, "concurrency",
+                                                                 fallback=64)
+
+        if prober_config['concurrency'] < 1:
+            raise ValueError('concurrency must be at least 1')
+
+        return prober_config
+
+    @staticmethod
+    def _parse_endpoint(endpoint):
+        '''Splits host:port, or [host]:port for IPv6, into (host, port)'''
+        host, separator, port = endpoint.rpartition(':')
+        if not separator or not host:
+            raise ValueError('%s is not host:port' % endpoint)
+
+        return (host.strip('[]'), int(port))
+
+    def get_node_configuration(self, config_stanza='dynipd-node'):
+        '''Returns settings for the node agent on this machine. Anything not set gets a default
+
+        Keys:
+            machine_name - name this machine is known by to dynipd; defaults to the hostname
+            location - location to reserve IPs in
+            family - socket.AF_INET or AF_INET6, from 4 or 6; the family to reserve IPs in
+            interface - network interface to configure IPs on
+            server - (host, port) of dynipd, from host:port
+            networks - CIDR networks of the location, from a comma separated list. Reserved
+                       IPs are configured with their network's prefix length
+            interval - seconds between rounds of renewing and reconciling
+            keepalive - seconds of quiet before the connection to dynipd is kept open with a
+                        TEST; must be less than dynipd's idle_timeout. 0 turns them off
+            low_watermark - standby IPs to keep on top of forecast demand
+            high_watermark - standby IPs above which whole unused allocations are released
+            demand_window - seconds of IP demand the forecast averages over
+            forecast_horizon - seconds of forecast demand to hold standby IPs for
+            reserve_batch - fewest IPs to reserve at once
+            release_interval - seconds between releases of surplus allocations
+        '''
+        node_config = {}
+        node_config['machine_name'] = self.config_parser.get(config_stanza, "machine_name",
+                                                             fallback=socket.gethostname())
+        node_config['location'] = self.config_parser.get(config_stanza, "location",
+                                                         fallback=None)
+        node_config['interface'] = self.config_parser.get(config_stanza, "interface",
+                                                          fallback=None)
+        family = self.config_parser.get(config_stanza, "family", fallback='4')
+        node_config['family'] = {'4': socket.AF_INET, '6': socket.AF_INET6}.get(family)
+        node_config['server'] = self._parse_endpoint(
+            self.config_parser.get(config_stanza, "server", fallback='127.0.0.1:8888'))
+        networks = self.config_parser.get(config_stanza, "networks", fallback='')
+        node_config['networks'] = [check.validate_and_normalize_ip_network(network.strip())
+                                   for network in networks.split(',') if network.strip()]
+        node_config['interval'] = self.config_parser.getfloat(config_stanza, "interval",
+                                                              fallback=10.0)
+        node_config['keepalive'] = self.config_parser.getfloat(config_stanza, "keepalive",
+                                                               fallback=5.0)
+        for key, fallback in (('low_watermark', 4), ('high_watermark', 16),
+                              ('reserve_batch', 4)):
+            node_config[key] = self.config_parser.getint(config_stanza, key, fallback=fallback)
+        for key, fallback in (('demand_window', 300.0), ('forecast_horizon', 60.0),
+                              ('release_interval', 300.0)):
+            node_config[key] = self.config_parser.getfloat(config_stanza, key,
+                                                           fallback=fallback)
+
+        if node_config['low_watermark'] < 0 or \
+           node_config['high_watermark'] < node_config['low_watermark']:
+            raise ValueError('need 0 <= low_watermark <= high_watermark')
+        if node_config['family'] is None:
+            raise ValueError('family must be 4 or 6')
+        if node_config['reserve_batch'] < 1:
+            raise ValueError('reserve_batch must be at least 1')
+        if node_config['interval'] <= 0:
+            raise ValueError('interval must be positive')
+        if node_config['keepalive'] < 0:
+            raise ValueError('keepalive must not be negative')
+
+        return node_config
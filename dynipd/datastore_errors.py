@@ -0,0 +1,22 @@
+'''
+DynIPD - Datastore errors
+
+These live apart from MySQLDataStore so the protocol handler can catch them without
+importing mysql.connector.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+class DataStoreError(Exception):
+    '''The datastore couldn't carry out a request. Nothing was changed, and trying again
+    later may well work'''
+    def __init__(self, value):
+        super(DataStoreError, self).__init__(value)
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class PoolExhausted(DataStoreError):
+    '''No database connection became free within the checkout timeout'''
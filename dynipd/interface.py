@@ -12,7 +12,12 @@ Created on Sep 16, 2015
 from socket import AF_INET, AF_INET6
 import ipaddress
 from pyroute2.iproute import IPRoute
+from pyroute2.netlink import NLM_F_REQUEST, NLM_F_ACK, NLM_F_CREATE, NLM_F_EXCL
+from pyroute2.netlink.rtnl import RTM_NEWADDR, RTM_DELADDR
+from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
 from dynipd.validation import ValidationAndNormlization as check
+from dynipd.interface_cache import InterfaceStateCache
+from dynipd.route_dump import dump_routes
 
 # Exception classes for Network Interface Configuration
 class InterfaceConfigurationError(Exception):
@@ -49,7 +54,305 @@ class DuplicateIPError(Exception):
     def __str__(self):
         return repr(self.value)
 
-class NetworkInterfaceConfig(object):
+# Most address changes we'll put in a single sendmsg(). Every one of them gets an ACK back, and
+# we don't want those overflowing the socket's receive buffer before we get to read them
+NETLINK_BATCH_SIZE = 256
+
+class InterfaceConfigBase(object):
+    '''Logic shared by NetworkInterfaceConfig and AsyncNetworkInterfaceConfig
+
+    Nothing in here talks to the kernel; it validates, plans and checks changes, and parses
+    what the kernel sends back. Subclasses set interface_index, and do the I/O.
+    '''
+    interface_index = None
+
+    def _find_ip(self, wanted_address, ips):
+        '''Internal API. Finds a normalized address in a list of ip_dicts
+
+        Raises:
+            IPNotFound - the address isn't in the list
+        '''
+        # Walk the IP table and find the specific IP we want
+        for ip_address in ips:
+            if ip_address['ip_address'] == wanted_address:
+                return ip_address
+
+        # If we get here, the IP wasn't found
+        raise IPNotFound("IP not found on interface")
+
+    def _normalize_ip_changes(self, adds, removes):
+        '''Internal API. Validates the arguments to apply_ip_changes(). Returns (adds, removes)'''
+        adds = [check.validate_and_normalize_ip_dict(dict(ip_dict)) for ip_dict in adds or []]
+        removes = [check.validate_and_normalize_ip(ip_address) for ip_address in removes or []]
+        return (adds, removes)
+
+    def _plan_ip_changes(self, adds, removes, ips):
+        '''Internal API. Checks normalized changes against the configured ips, and builds the
+        netlink messages to send. Returns (messages, {ip_address: ip_dict} of IPs to add)'''
+        configured_ips = {ip_dict['ip_address']: ip_dict for ip_dict in ips}
+
+        # Sanity check everything before we send anything
+        remove_dicts = []
+        for ip_address in removes:
+            if ip_address not in configured_ips:
+                raise IPNotFound("IP %s not found on interface" % ip_address)
+            remove_dicts.append(configured_ips[ip_address])
+
+        wanted_ips = {}
+        for ip_dict in adds:
+            if ip_dict['ip_address'] in wanted_ips or (ip_dict['ip_address'] in configured_ips
+                                                       and ip_dict['ip_address'] not in removes):
+                raise DuplicateIPError("IP %s has already been assigned!" % ip_dict['ip_address'])
+            wanted_ips[ip_dict['ip_address']] = ip_dict
+
+        messages = ([self._build_address_message(RTM_DELADDR, ip_dict)
+                     for ip_dict in remove_dicts] +
+                    [self._build_address_message(RTM_NEWADDR, ip_dict)
+                     for ip_dict in adds])
+        return (messages, wanted_ips)
+
+    def _verify_ip_changes(self, removes, wanted_ips, ips):
+        '''Internal API. Compares a fresh dump against what _plan_ip_changes() asked for
+
+        Raises:
+            InterfaceConfigurationError - some of the changes didn't take
+        '''
+        configured_ips = {ip_dict['ip_address']: ip_dict for ip_dict in ips}
+
+        failed = []
+        for ip_address in removes:
+            if ip_address in configured_ips and ip_address not in wanted_ips:
+                failed.append(ip_address)
+
+        for ip_address, ip_dict in wanted_ips.items():
+            ip_check = configured_ips.get(ip_address)
+            if not ip_check or ip_check['prefix_length'] != ip_dict['prefix_length']:
+                failed.append(ip_address)
+
+        if failed:
+            raise InterfaceConfigurationError("IP changes failed for %s" % ', '.join(failed))
+
+    def _build_address_message(self, message_type, ip_dict):
+        '''Internal API. Builds a RTM_NEWADDR or RTM_DELADDR message for a validated ip_dict
+
+        This is the same message addr('add') and addr('delete') send, but built by hand so
+        apply_ip_changes() can send a pile of them together'''
+        message = ifaddrmsg()
+        message['family'] = ip_dict['family']
+        message['prefixlen'] = ip_dict['prefix_length']
+        message['index'] = self.interface_index
+        message['attrs'] = [['IFA_LOCAL', ip_dict['ip_address']],
+                            ['IFA_ADDRESS', ip_dict['ip_address']]]
+
+        if ip_dict['family'] == AF_INET and 'broadcast' in ip_dict:
+            message['attrs'].append(['IFA_BROADCAST', ip_dict['broadcast']])
+
+        message['header']['type'] = message_type
+        message['header']['flags'] = NLM_F_REQUEST | NLM_F_ACK
+        if message_type == RTM_NEWADDR:
+            message['header']['flags'] |= NLM_F_CREATE | NLM_F_EXCL
+
+        return message
+
+    def _parse_route_message(self, route):
+        '''Internal API. Turns a RTM_NEWROUTE message into a route dict
+
+        Returns None if it isn't a route we care about'''
+        if not self._filter_routing_table([route]):
+            return None
+
+        # _filter_routing_table got rid of most of the junk we don't care about
+        # so now we need to walk the table and make it something far similar to
+        # praise without ripping our hair out. We also filter out link-local
+        # addresses in this step because we need the full prefix to know if its
+        # a link-local network
+        route_dict = {}
+
+        # Let's get the easy stuff first
+        for attribute in route['attrs']:
+            if attribute[0] == 'RTA_PREFSRC':
+                route_dict['source'] = attribute[1]
+            if attribute[0] == 'RTA_DST':
+                route_dict['destination'] = attribute[1]
+            if attribute[0] == 'RTA_GATEWAY':
+                route_dict['gateway'] = attribute[1]
+
+        # Family is mapped straight through so AF_INET and AF_INET6 just match
+        route_dict['family'] = route['family']
+
+        # Attach prefixes if they're non-zero
+        if route['src_len'] != 0 and 'source' in route_dict:
+            route_dict['source'] += ("/%s" % route['src_len'])
+        if route['dst_len'] != 0 and 'destination' in route_dict:
+            route_dict['destination'] += ("/%s" % route['dst_len'])
+
+            # Check for link-local here
+            if ipaddress.ip_network(route_dict['destination']).is_link_local:
+                return None # skip the route
+
+        if route['dst_len'] != 0 and 'gateway' in route_dict:
+            route_dict['gateway'] += ("/%s" % route['dst_len'])
+
+        # Map the protocol to something human-readable
+        route_dict['protocol'] = map_protocol_number_to_string(route['proto'])
+        route_dict['type'] = determine_route_type(route_dict)
+
+        return route_dict
+
+    def _filter_routing_table(self, routing_table):
+        '''Internal API. Takes a list of raw routes, and filters down to what we care about'''
+
+        # For every configured IP address, a couple of automatic routes are
+        # generated that we're not interested in.
+        #
+        # Understanding this code requires an understanding of how the Linux kernel
+        # handles routing and routing tables. For each interface, the kernel has a possible
+        # 255 tables to hold routes. These exist to allow for specific routing rules and
+        # preferences as the system goes from table 255->1 in determining which route
+        # will be used.
+        #
+        # On a default configuration, only three routing tables are defined:
+        # 255 - local
+        # 254 - main
+        # 253 - default
+        #
+        # Table names are controlled in /etc/iproutes.d/rt_tables
+        #
+        # The local table is special as it can only be added to by the kernel, and removing
+        # entries from it is explicitly done "at your own risk". It defines which IPs this
+        # machine owns so any attempt to communicate on it comes back to itself. As such
+        # we can simply filter out 255 to make our lives considerably easier
+        #
+        # Unfortunately, filtering 255 doesn't get rid of all the "line noise" so to speak.
+        #
+        # From this point forward, I've had to work from kernel source, and the source of
+        # iproute2 to understand what's going on from netlayer. But basically, here's the
+        # rundown of what we need to do
+        #
+        # Case 1 - Cached Entries
+        # This is a surprising complicated case. Cached entries are used by the kernel for
+        # automatically configured routes. I haven't seen the kernel v4 table populated, but
+        # that may just be because of my local usage
+        #
+        # IPv6 is a different story. Routing information for IPv6 can come in the form of
+        # routing announcements, static configuration, and so forth. It seems all IPv6 info is
+        # is marked as a cached entry. This is made more complicated that the kernel stores
+        # various IPv6 routing information in the table for "random" hosts accessed. For example.
+        # on my home system ...
+        #
+        # mcasadevall@perdition:~/workspace/mcdynipd$ route -6 -C
+        # Kernel IPv6 routing cache
+        # Destination                    Next Hop                   Flag Met Ref Use If
+        # 2001:4860:4860::8888/128       fe80::4216:7eff:fe6c:492   UGDAC 0   0    47 eth0
+        # 2607:f8b0:4001:c09::bc/128     fe80::4216:7eff:fe6c:492   UGDAC 0   1    17 eth0
+        # 2607:f8b0:4004:808::1013/128   fe80::4216:7eff:fe6c:492   UGDAC 0   1    21 eth0
+        # 2607:f8b0:4009:805::1005/128   fe80::4216:7eff:fe6c:492   UGDAC 0   0     3 eth0
+        # 2607:f8b0:4009:80a::200e/128   fe80::4216:7eff:fe6c:492   UGDAC 0   0    85 eth0
+        # 2607:f8b0:400d:c04::bd/128     fe80::4216:7eff:fe6c:492   UGDAC 0   1    76 eth0
+        #
+        # 2607:f8b0::/32 is owned by Google, and these were connections my system made to Google
+        # systems. Looking at my router (which runs a 6to4 HE tunnel), it appears 6to4 is handled
+        # via static routing and should show up sans CACHEINFO (untested - needs confirmation).
+        #
+        # Digging into iproute2, the proto field defines what defined a route. Here's the list
+        # defined in the source
+        #
+        # ----------------------------------------------------------------------------
+        # #define RTPROT_UNSPEC   0
+        # #define RTPROT_REDIRECT 1       /* Route installed by ICMP redirects;
+        #                                     not used by current IPv4 */
+        # #define RTPROT_KERNEL   2       /* Route installed by kernel            */
+        # #define RTPROT_BOOT     3       /* Route installed during boot          */
+        # #define RTPROT_STATIC   4       /* Route installed by administrator     */
+        #
+        # /* Values of protocol >= RTPROT_STATIC are not interpreted by kernel;
+        #    they are just passed from user and back as is.
+        #    It will be used by hypothetical multiple routing daemons.
+        #    Note that protocol values should be standardized in order to
+        #    avoid conflicts.
+        #  */
+        #
+        # #define RTPROT_GATED    8       /* Apparently, GateD */
+        # #define RTPROT_RA       9       /* RDISC/ND router advertisements */
+        # #define RTPROT_MRT      10      /* Merit MRT */
+        # #define RTPROT_ZEBRA    11      /* Zebra */
+        # #define RTPROT_BIRD     12      /* BIRD */
+        # #define RTPROT_DNROUTED 13      /* DECnet routing daemon */
+        # #define RTPROT_XORP     14      /* XORP */
+        # #define RTPROT_NTK      15      /* Netsukuku */
+        # #define RTPROT_DHCP     16      /* DHCP client */
+        # #define RTPROT_MROUTED  17      /* Multicast daemon */
+        # ----------------------------------------------------------------------------
+        #
+        # Looking at the behavior of the kernel, if a given prefix has a route, it will
+        # place a proto 2 entry for it with no routing address. Cached table entries
+        # exist to the next point:
+        #
+        # 2001:4860:4860::8888/128       fe80::4216:7eff:fe6c:492   UGDAC 0   0    47 eth0
+        #
+        # (this shows up as proto 9 in the routing table)
+        #
+        # To get the default route of a device in IPv6, we need entries that ONLY have RTA_GATEWAY
+        # and not RTA_DEST, regardless of protocol. Otherwise, we filter out proto 9. This gets
+        # output identical to route aside from the multicast address (ff00::/8)
+        #
+        # As a final note to this saga, after I coded this, I found rtnetlink is documented on
+        # Linux systems. Run man 7 rtnetlink to save yourself a source dive :(
+
+        filtered_table = []
+        non_cached_table = []
+
+        # Pass 1. Exclude table 255, and any entries that have RTA_CACHEINFO
+        for route in routing_table:
+            # If this is a 255 entry, ignore it, we don't care
+            if route['table'] == 255:
+                continue
+
+            # Now the table cache
+            cached_entry = False
+            destination_address = None
+            gateway_address = None
+
+            routing_attributes = route['attrs']
+            for attribute in routing_attributes:
+                if attribute[0] == 'RTA_CACHEINFO':
+                    cached_entry = True
+                if attribute[0] == 'RTA_DST':
+                    destination_address = attribute[1]
+                if attribute[0] == 'RTA_GATEWAY':
+                    gateway_address = attribute[1]
+
+            # If its not a cached entry, always keep it
+            if not cached_entry:
+                non_cached_table.append(route)
+                continue
+
+            # Keep it if proto != 9
+            if route['proto'] != 9:
+                non_cached_table.append(route)
+                continue
+
+            # If it only has DST or GATEWAY, its a default route, keep it
+            if ((gateway_address and not destination_address) or
+                    (destination_address and not gateway_address)):
+                non_cached_table.append(route)
+                continue
+
+        for route in non_cached_table:
+            # Like IP addresses, most of the route information is stored
+            # in attributes. RTA_OIF (OIF = Outbound Interface), contains
+            # the index number of the interface this route is assigned to
+            routing_attributes = route['attrs']
+
+            for attribute in routing_attributes:
+                if attribute[0] == 'RTA_OIF' and attribute[1] == self.interface_index:
+                    filtered_table.append(route)
+
+        # filtered_table should just contain our OIFs, pass this back up for
+        # processing
+        return filtered_table
+
+class NetworkInterfaceConfig(InterfaceConfigBase):
     '''High-level abstraction of a network interface's configuration
 
     NetworkInterfaceConfig is designed to abstract most of the pain of
@@ -65,27 +368,64 @@ class NetworkInterfaceConfig(object):
     to make sure there wasn't some sort of silent failure.
 
     A single IPRoute() socket is open per instance of this class for performance
-    reasons. This class is thread-safe.
+    reasons, unless it's a view handed out by a NetworkInterfaceManager, in which case
+    the manager's socket, link table and dumps are shared. This class is thread-safe.
+
+    With cached=True, the interface's addresses and routes are mirrored in memory from
+    kernel notifications (see InterfaceStateCache), and get_ips(), get_full_ip_info() and
+    get_routes() are answered without talking to the kernel at all.
     '''
-    def __init__(self, interface):
+    def __init__(self, interface, cached=False, manager=None):
         '''Manipulations the configuration of a given interface
 
         Args:
             interface - name of the interface to manipulate (i.e. 'eth0')
+            cached - keep an event-driven mirror of addresses and routes for lookups
+            manager - NetworkInterfaceManager to share a socket and dumps with. Normally
+                      set by NetworkInterfaceManager.get_interface()
 
         Raises:
             InvalidNetworkDevice - if the interface does not exist
         '''
 
         self.interface = interface
-        self.iproute_api = IPRoute()
-
-        # Confirm this is a valid interface
-        # This will chuck a IndexError exception if it doesn't exist
-        self.interface_index = self._get_interface_index()
+        self._manager = manager
+        self._cache = None
+
+        if manager:
+            self.iproute_api = manager.iproute_api
+            self.interface_index = manager.get_link_index(interface)
+        else:
+            self.iproute_api = IPRoute()
+
+            # Confirm this is a valid interface
+            # This will chuck a IndexError exception if it doesn't exist
+            self.interface_index = self._get_interface_index()
+
+        if cached:
+            # The cache only dumps when it's lost track, so make sure that's a real dump
+            # and not a manager's snapshot
+            self._cache = InterfaceStateCache(self.interface_index,
+                                              lambda: self._dump_addresses(fresh=True),
+                                              lambda: self._dump_routes(fresh=True),
+                                              parse_address_message,
+                                              self._parse_route_message)
+            self._cache.start()
 
     def __del__(self):
-        self.iproute_api.close()
+        self.close()
+
+    def close(self):
+        '''Releases the netlink sockets. Needed with cached=True, as the cache's listening
+        thread keeps this object alive until then'''
+        if self._cache:
+            self._cache.close()
+            self._cache = None
+
+        # A manager's socket is the manager's to close
+        if self.iproute_api and not self._manager:
+            self.iproute_api.close()
+        self.iproute_api = None
 
     def _get_interface_index(self):
         '''Private API to get the interface index number
@@ -116,71 +456,38 @@ class NetworkInterfaceConfig(object):
             if family == AF_INET
                 broadcast - broadcast address for an interface
         '''
+        if self._cache:
+            return self._cache.get_ips()
 
-        # I'd like to use label= here, but IPv6 information is not returned
-        # when doing so. Possibly a bug in pyroute2
-        ip_cfgs = self.iproute_api.get_addr(index=self.interface_index)
+        return self._get_ips_from_kernel()
 
-        # get_addr returns IPs in a nasty to praise format. We need to look at the attrs
-        # section of each item we get, and find IFA_ADDRESS, and check the second element
-        # of the tuple to get the IP address
+    def _get_ips_from_kernel(self, fresh=False):
+        '''Internal API. get_ips(), bypassing the cache, which is updated from it too
+
+        With fresh=True, a manager's snapshot is bypassed as well; that's how changes are
+        verified'''
+        ip_cfgs = self._dump_addresses(fresh)
+        if self._cache:
+            self._cache.load_addresses(ip_cfgs)
 
-        # Here's an example of what we're praising
-        #
-        # [{'attrs': [['IFA_ADDRESS', '10.0.241.123'],
-        #    ['IFA_LOCAL', '10.0.241.123'],
-        #    ['IFA_BROADCAST', '10.0.241.255'],
-        #    ['IFA_LABEL', 'dummy0'],
-        #    ['IFA_CACHEINFO',
-        #     {'cstamp': 181814615,
-        #      'ifa_prefered': 4294967295,
-        #      'ifa_valid': 4294967295,
-        #      'tstamp': 181814615}]],
-        #      'event': 'RTM_NEWADDR',
-        #      'family': 2,
-        #      'flags': 128,
-        #      'header': {'error': None,
-        #                 'flags': 2,
-        #                 'length': 80,
-        #                 'pid': 4294395048,
-        #                 'sequence_number': 255,
-        #                 'type': 20},
-        #      'index': 121,
-        #      'prefixlen': 24,
-        #      'scope': 0}]'''
-
-        # Walk the list
         ips = []
         for ip_cfg in ip_cfgs:
-            ip_address = None
-            family = None
-            broadcast = None
-            prefixlen = None
-
-            ip_attrs = ip_cfg['attrs']
-            for attribute in ip_attrs:
-                if attribute[0] == "IFA_ADDRESS":
-                    ip_address = attribute[1]
-                if attribute[0] == "IFA_BROADCAST":
-                    broadcast = attribute[1]
-            prefixlen = ip_cfg['prefixlen']
-            family = ip_cfg['family'] # 2 for AF_INET, 10 for AF_INET6
-
-            # Build IP dictionary
-            ip_dict = {'ip_address': ip_address,
-                       'prefix_length': prefixlen,
-                       'family' : family}
-
-            # Handle v4-only information
-            if broadcast:
-                ip_dict['broadcast'] = broadcast
-
-            # Push it onto the list to be returned
-            ips.append(ip_dict)
-
-        # And break!
+            ips.append(parse_address_message(ip_cfg))
+
         return ips
 
+    def _dump_addresses(self, fresh=False):
+        '''Internal API. Dumps the raw address messages for this interface
+
+        Views get them from the manager's dump of every interface, which is only redone when
+        it's refreshed, or when asked for a fresh one'''
+        if self._manager:
+            return self._manager.get_address_messages(self.interface_index, fresh)
+
+        # I'd like to use label= here, but IPv6 information is not returned
+        # when doing so. Possibly a bug in pyroute2
+        return self.iproute_api.get_addr(index=self.interface_index)
+
     def get_full_ip_info(self, wanted_address):
         '''Returns an ip_dict for an individual IP address. Format identical to get_ips()
 
@@ -194,15 +501,14 @@ class NetworkInterfaceConfig(object):
         '''
         wanted_address = check.validate_and_normalize_ip(wanted_address)
 
-        ips = self.get_ips()
+        # The cache is indexed by address, so no need to walk anything
+        if self._cache:
+            ip_dict = self._cache.get_ip(wanted_address)
+            if ip_dict:
+                return ip_dict
+            raise IPNotFound("IP not found on interface")
 
-        # Walk the IP table and find the specific IP we want
-        for ip_address in ips:
-            if ip_address['ip_address'] == wanted_address:
-                return ip_address
-
-        # If we get here, the IP wasn't found
-        raise IPNotFound("IP not found on interface")
+        return self._find_ip(wanted_address, self.get_ips())
 
     def add_v4_ip(self, ip_address, prefix_length):
         '''Wrapper for add_ip - adds an IPv4 address to this interface
@@ -278,8 +584,9 @@ class NetworkInterfaceConfig(object):
                                   address=ip_dict['ip_address'],
                                   prefixlen=ip_dict['prefix_length'])
 
-        # Do a sanity check and make sure the IP actually got added
-        ip_check = self.get_full_ip_info(ip_dict['ip_address'])
+        # Do a sanity check and make sure the IP actually got added. This always asks the
+        # kernel, since the cache may not have seen the change yet
+        ip_check = self._find_ip(ip_dict['ip_address'], self._get_ips_from_kernel(fresh=True))
 
         if not (ip_check['ip_address'] == ip_dict['ip_address'] and
                 ip_check['prefix_length'] == ip_dict['prefix_length']):
@@ -312,7 +619,7 @@ class NetworkInterfaceConfig(object):
             self.iproute_api.addr('delete',
                                   index=self.interface_index,
                                   address=ip_info['ip_address'],
-                                  broadcast=ip_info['broadcast'],
+                                  broadcast=ip_info.get('broadcast'),
                                   prefixlen=ip_info['prefix_length'])
 
         if ip_info['family'] == AF_INET6:
@@ -321,9 +628,9 @@ class NetworkInterfaceConfig(object):
                                   address=ip_info['ip_address'],
                                   prefixlen=ip_info['prefix_length'])
 
-        # Confirm the delete. get_full_ip_info will throw an exception if it can't find it
+        # Confirm the delete. _find_ip will throw an exception if it can't find it
         try:
-            self.get_full_ip_info(ip_address)
+            self._find_ip(ip_address, self._get_ips_from_kernel(fresh=True))
         except IPNotFound:
             # We got it!
             return
@@ -331,6 +638,46 @@ class NetworkInterfaceConfig(object):
         # Didn't get it. Throw an exception and bail
         raise InterfaceConfigurationError("IP deletion failure")
 
+    def apply_ip_changes(self, adds=None, removes=None, configured_ips=None):
+        '''Adds and removes many IPs at once. Batch version of add_ip() and remove_ip()
+
+        add_ip() and remove_ip() dump the address table before and after every change, which
+        adds up fast when configuring hundreds of IPs. This checks the whole request against
+        a single dump, sends every change as one netlink batch, waits for the kernel to ACK
+        them all, and then verifies the result against a second dump.
+
+        Removes are sent before adds, so an IP can be in both to reconfigure it.
+
+        Args:
+            adds - list of ip_dicts (see get_ips) to add
+            removes - list of IP addresses to remove
+            configured_ips - the result of a get_ips() the caller has just done, to check
+                             against instead of dumping again
+
+        Raises:
+            ValueError
+                An IP address in either list is invalid. Nothing is sent
+            DuplicateIPError
+                An IP to add is already configured, or is listed twice. Nothing is sent
+            IPNotFound
+                An IP to remove is not configured on this interface. Nothing is sent
+            InterfaceConfigurationError
+                The batch was sent, but some changes didn't take. The message lists them
+        '''
+        adds, removes = self._normalize_ip_changes(adds, removes)
+        if configured_ips is None:
+            configured_ips = self.get_ips()
+        messages, wanted_ips = self._plan_ip_changes(adds, removes, configured_ips)
+
+        # Individual failures would raise NetlinkError halfway through reading the ACKs, so
+        # we don't raise here; the dump below tells us exactly what did and didn't happen
+        for offset in range(0, len(messages), NETLINK_BATCH_SIZE):
+            self.iproute_api.nlm_request_batch(messages[offset:offset+NETLINK_BATCH_SIZE],
+                                               noraise=True)
+
+        # Now confirm every change actually took
+        self._verify_ip_changes(removes, wanted_ips, self._get_ips_from_kernel(fresh=True))
+
     def add_default_gateway(self, gateway, prefix_length):
         '''Adds a default gateway for a given prefix length'''
         raise NotImplementedError
@@ -349,61 +696,34 @@ class NetworkInterfaceConfig(object):
 
     def get_routes(self):
         '''Gets routes for an interface'''
-
-        # The only way to get routes for an interface is to pull the entire routing table, and
-        # filter entries for this interface. Miserable interfaces are miserable. Furthermore,
-        # I can only get the v4 and v6 routes as a separate transaction
-
-        # In theory, we can apply a filter to returned routes, but I can't figure out if
-        # we can exclude things like cache entries, so we'll just grab stuff on a per family
-        # level, and filter for ourselves
-
-        # Pull the v4 and v6 global routing table
-        v4_routing_table = self.iproute_api.get_routes(family=AF_INET)
-        v6_routing_table = self.iproute_api.get_routes(family=AF_INET6)
-        kernel_routing_table = self._filter_routing_table(v4_routing_table + v6_routing_table)
-
-        # _filter_routing_table got rid of most of the junk we don't care about
-        # so now we need to walk the table and make it something far similar to
-        # praise without ripping our hair out. We also filter out link-local
-        # addresses in this step because we need the full prefix to know if its
-        # a link-local network
+        if self._cache:
+            return self._cache.get_routes()
 
         routing_table = []
-        for route in kernel_routing_table:
-            route_dict = {}
-
-            # Let's get the easy stuff first
-            for attribute in route['attrs']:
-                if attribute[0] == 'RTA_PREFSRC':
-                    route_dict['source'] = attribute[1]
-                if attribute[0] == 'RTA_DST':
-                    route_dict['destination'] = attribute[1]
-                if attribute[0] == 'RTA_GATEWAY':
-                    route_dict['gateway'] = attribute[1]
-
-            # Family is mapped straight through so AF_INET and AF_INET6 just match
-            route_dict['family'] = route['family']
-
-            # Attach prefixes if they're non-zero
-            if route['src_len'] != 0 and 'source' in route_dict:
-                route_dict['source'] += ("/%s" % route['src_len'])
-            if route['dst_len'] != 0 and 'destination' in route_dict:
-                route_dict['destination'] += ("/%s" % route['dst_len'])
+        for route in self._dump_routes():
+            route_dict = self._parse_route_message(route)
+            if route_dict:
+                routing_table.append(route_dict)
+        return routing_table
 
-                # Check for link-local here
-                if ipaddress.ip_network(route_dict['destination']).is_link_local:
-                    continue # skip the route
+    def _dump_routes(self, fresh=False):
+        '''Internal API. Yields the raw v4 and v6 routes out of this interface, in every table
 
-            if route['dst_len'] != 0 and 'gateway' in route_dict:
-                route_dict['gateway'] += ("/%s" % route['dst_len'])
+        This used to pull the entire v4 and v6 routing tables and filter them here, which is
+        miserable on anything carrying a full table. dump_routes() gets the kernel to do the
+        per-interface filtering, and streams the results, so we never hold more than a
+        datagram's worth of routes. Table 255 and cache entries are still weeded out by
+        _filter_routing_table.
 
-            # Map the protocol to something human-readable
-            route_dict['protocol'] = map_protocol_number_to_string(route['proto'])
-            route_dict['type'] = determine_route_type(route_dict)
+        Views get routes from the manager instead, same as _dump_addresses()'''
+        if self._manager:
+            for route in self._manager.get_route_messages(self.interface_index, fresh):
+                yield route
+            return
 
-            routing_table.append(route_dict)
-        return routing_table
+        for family in (AF_INET, AF_INET6):
+            for route in dump_routes(family, oif=self.interface_index):
+                yield route
 
     def determine_if_route_exists(self):
         '''Checks if a route exists'''
@@ -413,163 +733,66 @@ class NetworkInterfaceConfig(object):
         '''Validates a routing information dict'''
         raise NotImplementedError
 
-    def _filter_routing_table(self, routing_table):
-        '''Internal API. Takes output of get_routes, and filters down to what we care about'''
-
-        # For every configured IP address, a couple of automatic routes are
-        # generated that we're not interested in.
-        #
-        # Understanding this code requires an understanding of how the Linux kernel
-        # handles routing and routing tables. For each interface, the kernel has a possible
-        # 255 tables to hold routes. These exist to allow for specific routing rules and
-        # preferences as the system goes from table 255->1 in determining which route
-        # will be used.
-        #
-        # On a default configuration, only three routing tables are defined:
-        # 255 - local
-        # 254 - main
-        # 253 - default
-        #
-        # Table names are controlled in /etc/iproutes.d/rt_tables
-        #
-        # The local table is special as it can only be added to by the kernel, and removing
-        # entries from it is explicitly done "at your own risk". It defines which IPs this
-        # machine owns so any attempt to communicate on it comes back to itself. As such
-        # we can simply filter out 255 to make our lives considerably easier
-        #
-        # Unfortunately, filtering 255 doesn't get rid of all the "line noise" so to speak.
-        #
-        # From this point forward, I've had to work from kernel source, and the source of
-        # iproute2 to understand what's going on from netlayer. But basically, here's the
-        # rundown of what we need to do
-        #
-        # Case 1 - Cached Entries
-        # This is a surprising complicated case. Cached entries are used by the kernel for
-        # automatically configured routes. I haven't seen the kernel v4 table populated, but
-        # that may just be because of my local usage
-        #
-        # IPv6 is a different story. Routing information for IPv6 can come in the form of
-        # routing announcements, static configuration, and so forth. It seems all IPv6 info is
-        # is marked as a cached entry. This is made more complicated that the kernel stores
-        # various IPv6 routing information in the table for "random" hosts accessed. For example.
-        # on my home system ...
-        #
-        # mcasadevall@perdition:~/workspace/mcdynipd$ route -6 -C
-        # Kernel IPv6 routing cache
-        # Destination                    Next Hop                   Flag Met Ref Use If
-        # 2001:4860:4860::8888/128       fe80::4216:7eff:fe6c:492   UGDAC 0   0    47 eth0
-        # 2607:f8b0:4001:c09::bc/128     fe80::4216:7eff:fe6c:492   UGDAC 0   1    17 eth0
-        # 2607:f8b0:4004:808::1013/128   fe80::4216:7eff:fe6c:492   UGDAC 0   1    21 eth0
-        # 2607:f8b0:4009:805::1005/128   fe80::4216:7eff:fe6c:492   UGDAC 0   0     3 eth0
-        # 2607:f8b0:4009:80a::200e/128   fe80::4216:7eff:fe6c:492   UGDAC 0   0    85 eth0
-        # 2607:f8b0:400d:c04::bd/128     fe80::4216:7eff:fe6c:492   UGDAC 0   1    76 eth0
-        #
-        # 2607:f8b0::/32 is owned by Google, and these were connections my system made to Google
-        # systems. Looking at my router (which runs a 6to4 HE tunnel), it appears 6to4 is handled
-        # via static routing and should show up sans CACHEINFO (untested - needs confirmation).
-        #
-        # Digging into iproute2, the proto field defines what defined a route. Here's the list
-        # defined in the source
-        #
-        # ----------------------------------------------------------------------------
-        # #define RTPROT_UNSPEC   0
-        # #define RTPROT_REDIRECT 1       /* Route installed by ICMP redirects;
-        #                                     not used by current IPv4 */
-        # #define RTPROT_KERNEL   2       /* Route installed by kernel            */
-        # #define RTPROT_BOOT     3       /* Route installed during boot          */
-        # #define RTPROT_STATIC   4       /* Route installed by administrator     */
-        #
-        # /* Values of protocol >= RTPROT_STATIC are not interpreted by kernel;
-        #    they are just passed from user and back as is.
-        #    It will be used by hypothetical multiple routing daemons.
-        #    Note that protocol values should be standardized in order to
-        #    avoid conflicts.
-        #  */
-        #
-        # #define RTPROT_GATED    8       /* Apparently, GateD */
-        # #define RTPROT_RA       9       /* RDISC/ND router advertisements */
-        # #define RTPROT_MRT      10      /* Merit MRT */
-        # #define RTPROT_ZEBRA    11      /* Zebra */
-        # #define RTPROT_BIRD     12      /* BIRD */
-        # #define RTPROT_DNROUTED 13      /* DECnet routing daemon */
-        # #define RTPROT_XORP     14      /* XORP */
-        # #define RTPROT_NTK      15      /* Netsukuku */
-        # #define RTPROT_DHCP     16      /* DHCP client */
-        # #define RTPROT_MROUTED  17      /* Multicast daemon */
-        # ----------------------------------------------------------------------------
-        #
-        # Looking at the behavior of the kernel, if a given prefix has a route, it will
-        # place a proto 2 entry for it with no routing address. Cached table entries
-        # exist to the next point:
-        #
-        # 2001:4860:4860::8888/128       fe80::4216:7eff:fe6c:492   UGDAC 0   0    47 eth0
-        #
-        # (this shows up as proto 9 in the routing table)
-        #
-        # To get the default route of a device in IPv6, we need entries that ONLY have RTA_GATEWAY
-        # and not RTA_DEST, regardless of protocol. Otherwise, we filter out proto 9. This gets
-        # output identical to route aside from the multicast address (ff00::/8)
-        #
-        # As a final note to this saga, after I coded this, I found rtnetlink is documented on
-        # Linux systems. Run man 7 rtnetlink to save yourself a source dive :(
-
-        filtered_table = []
-        non_cached_table = []
-
-        # Pass 1. Exclude table 255, and any entries that have RTA_CACHEINFO
-        for route in routing_table:
-            # If this is a 255 entry, ignore it, we don't care
-            if route['table'] == 255:
-                continue
-
-            # Now the table cache
-            cached_entry = False
-            destination_address = None
-            gateway_address = None
-
-            routing_attributes = route['attrs']
-            for attribute in routing_attributes:
-                if attribute[0] == 'RTA_CACHEINFO':
-                    cached_entry = True
-                if attribute[0] == 'RTA_DST':
-                    destination_address = attribute[1]
-                if attribute[0] == 'RTA_GATEWAY':
-                    gateway_address = attribute[1]
-
-            # If its not a cached entry, always keep it
-            if not cached_entry:
-                non_cached_table.append(route)
-                continue
-
-            # Keep it if proto != 9
-            if route['proto'] != 9:
-                non_cached_table.append(route)
-                continue
-
-            # If it only has DST or GATEWAY, its a default route, keep it
-            if ((gateway_address and not destination_address) or
-                    (destination_address and not gateway_address)):
-                non_cached_table.append(route)
-                continue
-
-        for route in non_cached_table:
-            # Like IP addresses, most of the route information is stored
-            # in attributes. RTA_OIF (OIF = Outbound Interface), contains
-            # the index number of the interface this route is assigned to
-            routing_attributes = route['attrs']
-
-            for attribute in routing_attributes:
-                if attribute[0] == 'RTA_OIF' and attribute[1] == self.interface_index:
-                    filtered_table.append(route)
-
-        # filtered_table should just contain our OIFs, pass this back up for
-        # processing
-        return filtered_table
-
 # Utility functions go down here
 
 
 
+def parse_address_message(ip_cfg):
+    '''Turns a RTM_NEWADDR message from the kernel into an ip_dict (see get_ips)'''
+
+    # get_addr returns IPs in a nasty to praise format. We need to look at the attrs
+    # section of each item we get, and find IFA_ADDRESS, and check the second element
+    # of the tuple to get the IP address
+
+    # Here's an example of what we're praising
+    #
+    # [{'attrs': [['IFA_ADDRESS', '10.0.241.123'],
+    #    ['IFA_LOCAL', '10.0.241.123'],
+    #    ['IFA_BROADCAST', '10.0.241.255'],
+    #    ['IFA_LABEL', 'dummy0'],
+    #    ['IFA_CACHEINFO',
+    #     {'cstamp': 181814615,
+    #      'ifa_prefered': 4294967295,
+    #      'ifa_valid': 4294967295,
+    #      'tstamp': 181814615}]],
+    #      'event': 'RTM_NEWADDR',
+    #      'family': 2,
+    #      'flags': 128,
+    #      'header': {'error': None,
+    #                 'flags': 2,
+    #                 'length': 80,
+    #                 'pid': 4294395048,
+    #                 'sequence_number': 255,
+    #                 'type': 20},
+    #      'index': 121,
+    #      'prefixlen': 24,
+    #      'scope': 0}]'''
+
+    ip_address = None
+    family = None
+    broadcast = None
+    prefixlen = None
+
+    ip_attrs = ip_cfg['attrs']
+    for attribute in ip_attrs:
+        if attribute[0] == "IFA_ADDRESS":
+            ip_address = attribute[1]
+        if attribute[0] == "IFA_BROADCAST":
+            broadcast = attribute[1]
+    prefixlen = ip_cfg['prefixlen']
+    family = ip_cfg['family'] # 2 for AF_INET, 10 for AF_INET6
+
+    # Build IP dictionary
+    ip_dict = {'ip_address': ip_address,
+               'prefix_length': prefixlen,
+               'family' : family}
+
+    # Handle v4-only information
+    if broadcast:
+        ip_dict['broadcast'] = broadcast
+
+    return ip_dict
+
 def map_protocol_number_to_string(protocol_number):
     '''Maps kernel routing protocol to string.'''
     protocol_mapping_table = {0: 'unspec',
@@ -0,0 +1,232 @@
+'''
+Event-driven mirror of an interface's addresses and routes
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import errno
+import os
+import select
+import socket
+import threading
+from pyroute2.netlink.rtnl import RTM_NEWADDR, RTM_DELADDR, RTM_NEWROUTE, RTM_DELROUTE, \
+    RTM_NEWLINK, RTM_DELLINK, RTMGRP_LINK, RTMGRP_IPV4_IFADDR, RTMGRP_IPV6_IFADDR, \
+    RTMGRP_IPV4_ROUTE, RTMGRP_IPV6_ROUTE
+from pyroute2.netlink.rtnl.marshal import MarshalRtnl
+
+# Multicast groups we mirror. Links are only watched because taking one down flushes its
+# routes without a RTM_DELROUTE for each
+CACHE_GROUPS = (RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR |
+                RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_ROUTE)
+
+# Ask for a large receive buffer so a burst of changes doesn't overflow it between reads.
+# The kernel caps this at net.core.rmem_max, and we resync if it overflows anyway
+CACHE_RECEIVE_BUFFER = 4 * 1024 * 1024
+
+class InterfaceStateCache(object):
+    '''Keeps addresses and routes for one interface in memory, updated from kernel events
+
+    A background thread listens for RTM_NEWADDR/RTM_DELADDR/RTM_NEWROUTE/RTM_DELROUTE
+    notifications and applies them to dicts indexed by address and by route, so lookups
+    are dictionary hits and never make a syscall.
+
+    There are two cases where notifications can't be trusted to tell us everything:
+
+    - if the socket's receive buffer overflows (ENOBUFS), we've lost events
+    - the kernel flushes routes that depend on a removed v4 address, or on a link that went
+      down, without sending RTM_DELROUTE for them
+
+    In both cases the affected table is marked stale, and the next lookup re-dumps it.
+
+    Dumps always happen in the caller's thread (pyroute2 sockets are tied to the thread that
+    created them), using the dump_* callables we're given. parse_address and parse_route
+    turn raw messages into the dicts handed back; parse_route returns None for routes that
+    aren't of interest.
+    '''
+
+    def __init__(self, interface_index, dump_addresses, dump_routes, parse_address, parse_route):
+        # pylint: disable=too-many-arguments
+        self.interface_index = interface_index
+        self._dump_addresses = dump_addresses
+        self._dump_routes = dump_routes
+        self._parse_address = parse_address
+        self._parse_route = parse_route
+
+        # Held while reading from the socket and applying events, and while resyncing, so
+        # events are always applied in the order the kernel sent them
+        self._lock = threading.Lock()
+        self._addresses = {}
+        self._routes = {}
+        self._addresses_stale = True
+        self._routes_stale = True
+
+        self._marshal = MarshalRtnl()
+        self._socket = None
+        self._wakeup = None
+        self._thread = None
+
+        self.events = 0
+        self.overflows = 0
+        self.resyncs = 0
+
+    def start(self):
+        '''Subscribes to kernel notifications, then does the initial load
+
+        Subscribing first means anything that changes during the initial dump is replayed
+        on top of it afterwards, rather than missed'''
+        self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CACHE_RECEIVE_BUFFER)
+        self._socket.bind((0, CACHE_GROUPS))
+        self._wakeup = os.pipe()
+
+        self._thread = threading.Thread(target=self._run, name='InterfaceStateCache',
+                                        daemon=True)
+        self._thread.start()
+        self._refresh_if_stale()
+
+    def close(self):
+        '''Stops listening for notifications'''
+        if not self._thread:
+            return
+
+        os.write(self._wakeup[1], b'x')
+        self._thread.join()
+        self._thread = None
+
+        self._socket.close()
+        for pipe_end in self._wakeup:
+            os.close(pipe_end)
+
+    def get_ips(self):
+        '''Returns a list of ip_dicts, same as NetworkInterfaceConfig.get_ips()'''
+        self._refresh_if_stale()
+        with self._lock:
+            return [dict(ip_dict) for ip_dict in self._addresses.values()]
+
+    def get_ip(self, ip_address):
+        '''Returns the ip_dict of a normalized address, or None if it isn't configured'''
+        self._refresh_if_stale()
+        with self._lock:
+            ip_dict = self._addresses.get(ip_address)
+            return dict(ip_dict) if ip_dict else None
+
+    def get_routes(self):
+        '''Returns a list of route dicts, same as NetworkInterfaceConfig.get_routes()'''
+        self._refresh_if_stale()
+        with self._lock:
+            return [dict(route_dict) for route_dict in self._routes.values()]
+
+    def load_addresses(self, ip_cfgs):
+        '''Replaces the address table with a fresh dump of raw messages
+
+        Anything still queued on the socket is older or newer than the dump; applying it
+        afterwards leaves each address as the latest event says, which is right either way'''
+        with self._lock:
+            self._load_addresses(ip_cfgs)
+
+    def load_routes(self, routes):
+        '''Replaces the route table with a fresh dump of raw messages'''
+        with self._lock:
+            self._load_routes(routes)
+
+    def _load_addresses(self, ip_cfgs):
+        '''load_addresses(), with the lock held'''
+        self._addresses = {}
+        for ip_cfg in ip_cfgs:
+            ip_dict = self._parse_address(ip_cfg)
+            self._addresses[ip_dict['ip_address']] = ip_dict
+        self._addresses_stale = False
+
+    def _load_routes(self, routes):
+        '''load_routes(), with the lock held'''
+        self._routes = {}
+        for route in routes:
+            route_dict = self._parse_route(route)
+            if route_dict:
+                self._routes[route_key(route)] = route_dict
+        self._routes_stale = False
+
+    def _refresh_if_stale(self):
+        '''Re-dumps whichever tables we can't trust any more'''
+        if not (self._addresses_stale or self._routes_stale):
+            return
+
+        with self._lock:
+            if self._addresses_stale:
+                self._load_addresses(self._dump_addresses())
+                self.resyncs += 1
+            if self._routes_stale:
+                self._load_routes(self._dump_routes())
+                self.resyncs += 1
+
+    def _run(self):
+        '''Background thread. Reads notifications until close() is called'''
+        while True:
+            readable, _, _ = select.select([self._socket, self._wakeup[0]], [], [])
+            if self._wakeup[0] in readable:
+                return
+
+            with self._lock:
+                try:
+                    data = self._socket.recv(65536, socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    continue
+                except OSError as error:
+                    if error.errno != errno.ENOBUFS:
+                        raise
+
+                    # We've lost events; the next lookup gets everything again
+                    self.overflows += 1
+                    self._addresses_stale = True
+                    self._routes_stale = True
+                    continue
+
+                for message in self._marshal.parse(data):
+                    self._apply(message)
+
+    def _apply(self, message):
+        '''Applies a single notification, with the lock held'''
+        message_type = message['header']['type']
+        self.events += 1
+
+        if message_type in (RTM_NEWADDR, RTM_DELADDR):
+            if message['index'] != self.interface_index:
+                return
+
+            ip_dict = self._parse_address(message)
+            if message_type == RTM_NEWADDR:
+                self._addresses[ip_dict['ip_address']] = ip_dict
+                return
+
+            self._addresses.pop(ip_dict['ip_address'], None)
+
+            # Routes using this as their source are gone, and nobody's going to tell us
+            if ip_dict['family'] == socket.AF_INET:
+                self._routes_stale = True
+
+        elif message_type in (RTM_NEWROUTE, RTM_DELROUTE):
+            key = route_key(message)
+            route_dict = None
+            if message_type == RTM_NEWROUTE:
+                route_dict = self._parse_route(message)
+
+            # A replace can move a route off this interface, so drop anything we don't keep
+            if route_dict:
+                self._routes[key] = route_dict
+            else:
+                self._routes.pop(key, None)
+
+        elif message_type in (RTM_NEWLINK, RTM_DELLINK):
+            if message['index'] == self.interface_index:
+                self._routes_stale = True
+
+def route_key(route):
+    '''Identifies a route the same way the kernel does when deleting it'''
+    return (route['family'],
+            route.get_attr('RTA_TABLE') or route['table'],
+            route['dst_len'],
+            route.get_attr('RTA_DST'),
+            route['tos'],
+            route.get_attr('RTA_PRIORITY'))
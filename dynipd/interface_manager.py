@@ -0,0 +1,146 @@
+'''
+Network Interface Manager
+
+Nodes with bonds and VLANs end up with a NetworkInterfaceConfig for every interface, each
+with its own netlink socket, its own link lookup, and its own dumps. NetworkInterfaceManager
+owns one socket and one link table, and hands out NetworkInterfaceConfig views that share
+them, along with a single address dump and a single route dump covering every interface.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import threading
+from socket import AF_INET, AF_INET6
+from pyroute2.iproute import IPRoute
+from dynipd.interface import NetworkInterfaceConfig, InvalidNetworkDevice
+from dynipd.route_dump import dump_routes
+
+class NetworkInterfaceManager(object):
+    '''Owns the netlink socket, link table and kernel dumps for any number of interfaces
+
+    Views handed out by get_interface() are regular NetworkInterfaceConfigs, except that
+    their lookups are answered from a snapshot of every interface's addresses (and routes)
+    taken with one kernel request. The snapshot is kept until refresh() is called, or until
+    a change made through any view invalidates it; changes are always verified against a
+    fresh dump.
+
+    Routes are dumped once per family for all interfaces, and bucketed by outgoing
+    interface as they stream in. Only routes for interfaces with a view are kept. On hosts
+    carrying a full table, that one dump means parsing the whole table; standalone
+    NetworkInterfaceConfigs get the kernel to filter per interface instead.
+    '''
+
+    def __init__(self):
+        '''Opens the shared socket and loads the link table'''
+        self.iproute_api = IPRoute()
+        self._lock = threading.RLock()
+        self._links = {}
+        self._views = {}
+        self._addresses = None
+        self._routes = None
+
+        # How many dumps we've asked the kernel for, for anyone counting
+        self.dumps = 0
+
+        self.refresh_links()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        '''Closes the shared socket. Views stop working after this'''
+        if self.iproute_api:
+            self.iproute_api.close()
+            self.iproute_api = None
+
+    def refresh_links(self):
+        '''Reloads the interface name to index table'''
+        with self._lock:
+            self._links = {}
+            for link in self.iproute_api.get_links():
+                self._links[link.get_attr('IFLA_IFNAME')] = link['index']
+            self.dumps += 1
+
+    def refresh(self):
+        '''Forgets the address and route snapshot; the next lookup dumps again'''
+        with self._lock:
+            self._addresses = None
+            self._routes = None
+
+    def interface_names(self):
+        '''Returns the names of every interface in the link table'''
+        with self._lock:
+            return list(self._links.keys())
+
+    def get_link_index(self, interface):
+        '''Returns the index of an interface. Reloads the link table once if it isn't there
+
+        Raises:
+            InvalidNetworkDevice - if the interface does not exist
+        '''
+        with self._lock:
+            if interface not in self._links:
+                self.refresh_links()
+
+            if interface not in self._links:
+                raise InvalidNetworkDevice("Interface not found")
+
+            return self._links[interface]
+
+    def get_interface(self, interface, cached=False):
+        '''Returns a NetworkInterfaceConfig view of an interface that shares our socket
+
+        The same view is handed back for the same interface, unless cached differs
+
+        Raises:
+            InvalidNetworkDevice - if the interface does not exist
+        '''
+        with self._lock:
+            view = self._views.get(interface)
+            if view is None or bool(view._cache) != cached: # pylint: disable=protected-access
+                view = NetworkInterfaceConfig(interface, cached=cached, manager=self)
+                self._views[interface] = view
+
+                # Route snapshots only hold routes for interfaces with views
+                self._routes = None
+
+            return view
+
+    def get_address_messages(self, interface_index, fresh=False):
+        '''Returns the raw address messages for one interface from the snapshot
+
+        fresh=True throws the snapshot away first. Address changes usually change routes
+        too, so that goes as well'''
+        with self._lock:
+            if fresh:
+                self.refresh()
+
+            if self._addresses is None:
+                self._addresses = {}
+                for ip_cfg in self.iproute_api.get_addr():
+                    self._addresses.setdefault(ip_cfg['index'], []).append(ip_cfg)
+                self.dumps += 1
+
+            return list(self._addresses.get(interface_index, []))
+
+    def get_route_messages(self, interface_index, fresh=False):
+        '''Returns the raw route messages for one interface from the snapshot'''
+        with self._lock:
+            if fresh:
+                self.refresh()
+
+            if self._routes is None:
+                wanted = set(view.interface_index for view in self._views.values())
+                wanted.add(interface_index)
+
+                self._routes = {}
+                for family in (AF_INET, AF_INET6):
+                    for route in dump_routes(family):
+                        oif = route.get_attr('RTA_OIF')
+                        if oif in wanted:
+                            self._routes.setdefault(oif, []).append(route)
+                    self.dumps += 1
+
+            return list(self._routes.get(interface_index, []))
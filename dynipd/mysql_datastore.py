@@ -5,29 +5,93 @@ Created on Sep 19, 2015
 @author: mcasadevall
 '''
 
+import contextlib
+import threading
+import time
 import mysql.connector
+from dynipd.datastore_errors import DataStoreError, PoolExhausted
 from dynipd.server.allocation import AllocationServerSide
-from dynipd.network_block import NetworkBlock
+from dynipd.network_block import NetworkBlock, carve_reservations, release_reservations
 from dynipd.validation import ValidationAndNormlization as check
 from dynipd.server.machine import Machine
+from dynipd.server import event_bus as events
 
 class MySQLDataStore(object):
     '''Implements the data storage model on a MySQL database'''
     _networks = { }
 
-    def __init__(self, db_info_dict):
-        '''Opens a connection to the MySQL database'''
+    def __init__(self, db_info_dict, event_bus=None, pool_size=20, checkout_timeout=5.0,
+                 metrics=None):
+        # pylint: disable=too-many-arguments
+        '''Opens a connection to the MySQL database
+
+        If an EventBus is passed in, allocation and topology changes are published to it.
+
+        mysql.connector's pool raises the moment it runs dry, so checkouts are gated on a
+        semaphore of the same size; callers beyond pool_size wait up to checkout_timeout
+        seconds for a connection before PoolExhausted is raised. Size the executor that calls
+        into us to match (see DatastoreExecutor)
+
+        If a ServerMetrics is passed in, checkout waits and how long each statement holds its
+        connection are recorded in it'''
         self.db_info = db_info_dict
-        self.mysql_pool = mysql.connector.pooling.MySQLConnectionPool(pool_name = "datastore_pool",
-                                                                     pool_size=20,
-                                                                     **self.db_info)
+        self.event_bus = event_bus
+        self.metrics = metrics
+        self.pool_size = pool_size
+        self.checkout_timeout = checkout_timeout
+
+        # The pool and the semaphore gating it, as one attribute so reconfigure() can swap
+        # them together and _connection() never sees one without the other
+        mysql_pool = mysql.connector.pooling.MySQLConnectionPool(pool_name = "datastore_pool",
+                                                                pool_size=pool_size,
+                                                                **self.db_info)
+        self._pool = (mysql_pool, threading.BoundedSemaphore(pool_size))
+
+        # NetworkBlocks are shared between every executor thread; anything carving
+        # allocations out of them holds this
+        self._allocation_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._pool_stats = {'checkouts': 0,
+                            'checked_out': 0,
+                            'exhausted': 0,
+                            'timeouts': 0,
+                            'wait_time_total': 0.0,
+                            'wait_time_max': 0.0}
 
         #self._refresh_network_topogoly()
 
+    def reconfigure(self, db_info_dict=None, pool_size=None, checkout_timeout=None):
+        '''Applies new database settings without dropping work in progress
+
+        A new endpoint or pool size means a new pool. It's built (and so connected) before
+        anything is swapped, so if the new settings are bad the old pool keeps going and the
+        error is raised to the caller. Connections checked out of the old pool go back to it
+        when they're done, and it's closed once nothing holds it any more.
+
+        Returns True if the pool was replaced'''
+        if checkout_timeout is not None:
+            self.checkout_timeout = checkout_timeout
+
+        db_info_dict = db_info_dict if db_info_dict is not None else self.db_info
+        pool_size = pool_size if pool_size is not None else self.pool_size
+        if db_info_dict == self.db_info and pool_size == self.pool_size:
+            return False
+
+        mysql_pool = mysql.connector.pooling.MySQLConnectionPool(pool_name = "datastore_pool",
+                                                                pool_size=pool_size,
+                                                                **db_info_dict)
+
+        # _connection() reads this once per checkout, so swapping it is safe mid-flight
+        self._pool = (mysql_pool, threading.BoundedSemaphore(pool_size))
+        self.db_info = db_info_dict
+        self.pool_size = pool_size
+        return True
+
     def create_machine(self, name, token):
         '''Creates a machine in the database'''
         query = 'INSERT INTO machine_info (name, token) VALUES (%s, %s)'
-        self._do_insert(query, (name,token))
+        self._do_insert(query, (name,token), 'create_machine')
 
     def create_network(self, name, location, family, network, allocation_size, reserved_blocks):
         # pylint: disable=too-many-arguments
@@ -43,11 +107,14 @@ class MySQLDataStore(object):
                                                  reserved_blocks) VALUES (%s, %s, %s,%s, %s, %s)'''
 
         self._do_insert(query, (name, location, int(family), network, allocation_size,
-                               reserved_blocks))
+                               reserved_blocks), 'create_network')
 
         # Update our state information to see the new network
         self.refresh_network_topogoly()
 
+        if self.event_bus:
+            self.event_bus.publish_location_event(location, events.EVENT_TOPOLOGY_CHANGED, name)
+
     def assign_new_allocation(self, machine, new_allocation):
         '''Assigns an a new allocation to a machine'''
 
@@ -63,10 +130,16 @@ class MySQLDataStore(object):
 
         allocation_id = self._do_insert(query,  (new_allocation.get_allocation_cidr(),
                                                  new_allocation.get_network_block().get_id(),
-                                                 machine.get_id()))
+                                                 machine.get_id()),
+                                        'assign_new_allocation')
 
         new_allocation.set_id(allocation_id)
 
+        if self.event_bus:
+            self.event_bus.publish_machine_event(machine.get_name(),
+                                                 events.EVENT_ALLOCATION_ASSIGNED,
+                                                 new_allocation.get_allocation_cidr())
+
         # Return the allocation+ID to the caller
         return new_allocation
 
@@ -80,7 +153,8 @@ class MySQLDataStore(object):
         query = '''DELETE FROM allocated_blocks WHERE allocation_id = %s LIMIT 1'''
 
         try:
-            count = self._do_delete(query, (ip_allocation.get_id(),))
+            count = self._do_delete(query, (ip_allocation.get_id(),),
+                                   'remove_allocation_assignment')
         except mysql.connector.errors.IntegrityError:
             raise ValueError('Allocation is actively used!')
 
@@ -104,45 +178,308 @@ class MySQLDataStore(object):
 
         # We use REPLACE to make sure statuses are always accurate to the server. In case
         # of conflict, the server is always the correct source of information
+        # reservation_expires is null unless we're going to RESERVED; reservations get the
+        # same five minutes as a freshly assigned allocation
+        reservation_expires = 'NULL'
+        if status == 'RESERVED':
+            reservation_expires = "ADDTIME(NOW(), '00:05:00')"
+
         query = '''REPLACE INTO ip_allocations (from_allocation, allocated_to, ip_address,
-                   status, reservation_expires) VALUES (%s, %s, %s, %s, %s)'''
+                   status, reservation_expires) VALUES (%%s, %%s, %%s, %%s, %s)''' % (
+                       reservation_expires,)
 
-        # reservation status is null unless we're going to/from RESERVED
-        reservation_status = 'NULL'
         self._do_insert(query, (allocation.get_id(),
                                 machine.get_id(),
                                 ip_address,
-                                status,
-                                reservation_status))
+                                status),
+                        'set_ip_status')
 
-    def refresh_network_topogoly(self):
-        '''Updates the network topology in the database'''
+    def reserve_ips(self, machine, location, family, count):
+        '''Reserves count IPs for a machine from the networks in a location
 
-        # Setup the connection, and cursor
-        cnx = self.mysql_pool.get_connection()
-        cursor = cnx.cursor(dictionary=True)
-
-        # Pull the entire topology from the database
-        query = "SELECT * FROM network_topology ORDER BY id"
-        cursor.execute(query)
+        Allocations are carved out of as many NetworkBlocks as it takes, and everything is
+        written in a single transaction; either all count IPs are reserved or none are.
 
-        # Clear out the network store
-        # FIXME: this doesn't seem right
+        Returns a list of (AllocationServerSide, [ip_address, ...]) tuples
 
-        self._networks = {}
-        for row in cursor:
-            self._networks[row['id']] = NetworkBlock(row, self)
-
-        cnx.close()
+        Raises:
+            NetworkBlockFull - the location doesn't have count IPs free in this family
+            DataStoreError - the reservations couldn't be written; nothing was reserved
+        '''
+        check.is_valid_ip_family(family)
+        if not isinstance(machine, Machine):
+            raise ValueError('machine is not Machine object')
+        if count < 1:
+            raise ValueError('count must be at least 1')
+
+        with self._allocation_lock:
+            networks = [network for network in self.get_networks_by_location(location)
+                        if network.family == family]
+            carved = carve_reservations(networks, machine, count)
+
+            try:
+                self._persist_reservations(machine, carved)
+            except mysql.connector.Error as error:
+                # Put the NetworkBlocks back the way we found them. An IntegrityError here
+                # means our view of allocated_blocks was stale; the next refresh fixes that,
+                # so the request is worth retrying
+                release_reservations(carved)
+                raise DataStoreError('Could not save reservations: %s' % error)
+            except Exception:
+                release_reservations(carved)
+                raise
+
+        for allocation, _ in carved:
+            machine._add_allocation_association(allocation) # pylint: disable=protected-access
+            if self.event_bus:
+                self.event_bus.publish_machine_event(machine.get_name(),
+                                                     events.EVENT_ALLOCATION_ASSIGNED,
+                                                     allocation.get_allocation_cidr())
+
+        return carved
+
+    def _persist_reservations(self, machine, carved):
+        '''Writes carved allocations and their reserved IPs in one transaction'''
+        with self._connection('persist_reservations') as cnx:
+            cursor = cnx.cursor()
+            try:
+                query = '''INSERT INTO allocated_blocks (allocated_block, network_id, machine_id,
+                           status, reservation_expires) VALUES
+                           (%s, %s, %s, 'RESERVED', ADDTIME(NOW(), '00:05:00'))'''
+                for allocation, _ in carved:
+                    cursor.execute(query, (allocation.get_allocation_cidr(),
+                                           allocation.get_network_block().get_id(),
+                                           machine.get_id()))
+                    allocation.set_id(cursor.lastrowid)
+
+                # executemany() turns this into a single multi-row INSERT
+                query = '''INSERT INTO ip_allocations (from_allocation, allocated_to, ip_address,
+                           status, reservation_expires) VALUES
+                           (%s, %s, %s, 'RESERVED', ADDTIME(NOW(), '00:05:00'))'''
+                cursor.executemany(query, [(allocation.get_id(), machine.get_id(), str(ip_address))
+                                           for allocation, ip_addresses in carved
+                                           for ip_address in ip_addresses])
+                cnx.commit()
+            except mysql.connector.Error:
+                cnx.rollback()
+                raise
+
+    def renew_reservations(self, machine, ip_addresses):
+        '''Gives a machine's reserved IPs another five minutes
+
+        IPs that aren't reserved by this machine (including ones that have already expired)
+        are skipped. Returns the IPs that were renewed, so the machine can let go of the rest
+
+        Raises:
+            ValueError - an IP address is invalid
+            DataStoreError - the database couldn't be updated
+        '''
+        if not isinstance(machine, Machine):
+            raise ValueError('machine is not Machine object')
+        ip_addresses = [check.validate_and_normalize_ip(ip_address)
+                        for ip_address in ip_addresses]
+        if not ip_addresses:
+            return []
+
+        # UPDATE's rowcount only counts rows it changed, and a renewal within the same second
+        # changes nothing, so the rows are picked (and locked against expiry) first
+        with self._connection('renew_reservations') as cnx:
+            cursor = cnx.cursor(dictionary=True)
+            try:
+                query = '''SELECT id, ip_address FROM ip_allocations
+                           WHERE allocated_to = %%s AND status = 'RESERVED'
+                           AND ip_address IN (%s)
+                           FOR UPDATE''' % (', '.join(['%s'] * len(ip_addresses)),)
+                cursor.execute(query, tuple([machine.get_id()] + ip_addresses))
+                renewed = cursor.fetchall()
+
+                if renewed:
+                    query = '''UPDATE ip_allocations
+                               SET reservation_expires = ADDTIME(NOW(), '00:05:00')
+                               WHERE id IN (%s)''' % (', '.join(['%s'] * len(renewed)),)
+                    cursor.execute(query, tuple(row['id'] for row in renewed))
+                cnx.commit()
+            except mysql.connector.Error as error:
+                cnx.rollback()
+                raise DataStoreError('Could not renew reservations: %s' % error)
+
+        return [check.validate_and_normalize_ip(row['ip_address']) for row in renewed]
+
+    def release_allocations(self, machine, allocation_cidrs):
+        '''Hands a machine's allocations back to the pool, with every IP reserved in them
+
+        Allocations that aren't the machine's (including ones that have already expired)
+        are skipped. Returns how many were released
+
+        Raises:
+            ValueError - an allocation CIDR is invalid
+            DataStoreError - the database couldn't be updated; nothing was released
+        '''
+        if not isinstance(machine, Machine):
+            raise ValueError('machine is not Machine object')
+        allocation_cidrs = [check.validate_and_normalize_ip_network(cidr)
+                            for cidr in allocation_cidrs]
+        if not allocation_cidrs:
+            return 0
+
+        # Same order as reserve_ips(); the NetworkBlocks are updated under the same lock as
+        # the rows are deleted, so the space can't be carved again before it's free
+        with self._allocation_lock, self._connection('release_allocations') as cnx:
+            cursor = cnx.cursor(dictionary=True)
+            try:
+                query = '''SELECT allocation_id, allocated_block, network_id
+                           FROM allocated_blocks
+                           WHERE machine_id = %%s AND allocated_block IN (%s)
+                           FOR UPDATE''' % (', '.join(['%s'] * len(allocation_cidrs)),)
+                cursor.execute(query, tuple([machine.get_id()] + allocation_cidrs))
+                released = cursor.fetchall()
+                self._delete_allocated_blocks(cursor, released)
+                cnx.commit()
+            except mysql.connector.Error as error:
+                cnx.rollback()
+                raise DataStoreError('Could not release allocations: %s' % error)
+
+            self._free_allocated_blocks(released)
+
+        if self.event_bus:
+            for row in released:
+                self.event_bus.publish_machine_event(machine.get_name(),
+                                                     events.EVENT_ALLOCATION_RELEASED,
+                                                     row['allocated_block'])
+
+        return len(released)
+
+    def expire_reservations(self):
+        '''Returns timed out IP reservations to the pool
+
+        Allocations left with no reservations in them are handed back too. Returns the
+        number of reservations that expired. Each one is published to the event bus so the
+        machine that held it finds out without having to ask'''
+        with self._allocation_lock, self._connection('expire_reservations') as cnx:
+            cursor = cnx.cursor(dictionary=True)
+
+            # Lock the rows we're about to delete so a renewal can't sneak in between the two
+            # statements
+            query = '''SELECT ip_allocations.id, ip_allocations.ip_address,
+                       ip_allocations.from_allocation, machine_info.name
+                       FROM ip_allocations
+                       JOIN machine_info ON machine_info.id = ip_allocations.allocated_to
+                       WHERE ip_allocations.status = 'RESERVED'
+                       AND ip_allocations.reservation_expires < NOW()
+                       FOR UPDATE'''
+            cursor.execute(query)
+            expired = cursor.fetchall()
+
+            emptied = []
+            if expired:
+                query = 'DELETE FROM ip_allocations WHERE id IN (%s)' % (
+                    ', '.join(['%s'] * len(expired)),)
+                cursor.execute(query, tuple(row['id'] for row in expired))
+
+                # An allocation is only ever reserved into when it's carved, so once the
+                # last of its reservations is gone nothing will use it again
+                allocation_ids = sorted(set(row['from_allocation'] for row in expired))
+                query = '''SELECT allocation_id, allocated_block, network_id
+                           FROM allocated_blocks
+                           WHERE allocation_id IN (%s)
+                           AND NOT EXISTS (SELECT 1 FROM ip_allocations
+                                           WHERE from_allocation =
+                                                 allocated_blocks.allocation_id)
+                           FOR UPDATE''' % (', '.join(['%s'] * len(allocation_ids)),)
+                cursor.execute(query, tuple(allocation_ids))
+                emptied = cursor.fetchall()
+                self._delete_allocated_blocks(cursor, emptied)
+            cnx.commit()
+
+            self._free_allocated_blocks(emptied)
+
+        if self.event_bus:
+            for row in expired:
+                self.event_bus.publish_machine_event(row['name'],
+                                                     events.EVENT_RESERVATION_EXPIRED,
+                                                     row['ip_address'])
+
+        return len(expired)
+
+    @staticmethod
+    def _delete_allocated_blocks(cursor, rows):
+        '''Deletes allocated_blocks rows, and any ip_allocations in them'''
+        if not rows:
+            return
+
+        allocation_ids = tuple(row['allocation_id'] for row in rows)
+        placeholders = ', '.join(['%s'] * len(allocation_ids))
+        cursor.execute('DELETE FROM ip_allocations WHERE from_allocation IN (%s)' %
+                       (placeholders,), allocation_ids)
+        cursor.execute('DELETE FROM allocated_blocks WHERE allocation_id IN (%s)' %
+                       (placeholders,), allocation_ids)
+
+    def _free_allocated_blocks(self, rows):
+        '''Frees deleted allocated_blocks rows in their NetworkBlocks. The caller holds
+        _allocation_lock'''
+        for row in rows:
+            network = self._networks.get(row['network_id'])
+            if network is not None:
+                network._mark_allocation_free(row['allocated_block']) # pylint: disable=protected-access
+
+    def refresh_network_topogoly(self, incremental=False):
+        '''Updates the network topology in the database
+
+        A full refresh rebuilds every NetworkBlock from the database. An incremental one
+        keeps the NetworkBlocks whose network_topology row hasn't changed as they are, and
+        only reads back the allocations of networks that are new or were redefined.
+
+        Returns {'added': [names], 'changed': [names], 'removed': [names]}'''
+
+        # The lock is held from the first read to the swap. Otherwise a RESERVE committing in
+        # between wouldn't be in what we read back, and its allocation could be carved again.
+        # reserve_ips() takes the lock before a connection too, so the two can't deadlock
+        with self._allocation_lock, self._connection('refresh_network_topogoly') as cnx:
+            cursor = cnx.cursor(dictionary=True)
+
+            # Pull the entire topology from the database
+            query = "SELECT * FROM network_topology ORDER BY id"
+            cursor.execute(query)
+            rows = cursor.fetchall()
+
+            current = dict(self._networks)
+
+            changes = {'added': [], 'changed': [], 'removed': []}
+            networks = {}
+            fresh = []
+            for row in rows:
+                existing = current.pop(row['id'], None)
+                if incremental and existing is not None and existing.is_defined_by(row):
+                    networks[row['id']] = existing
+                    continue
+
+                networks[row['id']] = NetworkBlock(row, self)
+                fresh.append(row['id'])
+                if existing is None:
+                    changes['added'].append(row['name'])
+                else:
+                    changes['changed'].append(row['name'])
+            changes['removed'] = [network.get_name() for network in current.values()]
+
+            # Fresh NetworkBlocks think they're empty, so tell them what's already handed out
+            if fresh:
+                query = ('SELECT allocated_block, network_id FROM allocated_blocks '
+                         'WHERE network_id IN (%s)' % ', '.join(['%s'] * len(fresh)))
+                cursor.execute(query, tuple(fresh))
+                for row in cursor:
+                    networks[row['network_id']]._mark_allocation_in_use(row['allocated_block']) # pylint: disable=protected-access
+
+            self._networks = networks
+
+        return changes
 
     def get_machine(self, name):
         '''Retrieves a machine from the database'''
-        cnx = self.mysql_pool.get_connection()
-        cursor = cnx.cursor(dictionary=True)
-        query = '''SELECT * FROM machine_info WHERE name=%s'''
-        cursor.execute(query, (name,))
-        machine_dict = cursor.fetchone()
-        cnx.close()
+        with self._connection('get_machine') as cnx:
+            cursor = cnx.cursor(dictionary=True)
+            query = '''SELECT * FROM machine_info WHERE name=%s'''
+            cursor.execute(query, (name,))
+            machine_dict = cursor.fetchone()
 
         return machine_dict
 
@@ -157,6 +494,10 @@ class MySQLDataStore(object):
         # Network not found
         raise ValueError('Network does not exist')
 
+    def get_networks_by_location(self, location):
+        '''Returns a list of networks within a location'''
+        return [network for network in self.get_networks() if network.location == location]
+
     def get_networks(self):
         '''Returns a list of networks'''
 
@@ -180,34 +521,96 @@ class MySQLDataStore(object):
         file.close()
 
         # Setup the connection, and cursor
-        cnx = self.mysql_pool.get_connection()
-        cursor = cnx.cursor()
-        result = cursor.execute(sql, multi=True)
-
-        # We need to iterate on result to get it to execute; while loop just hangs
-        for row in result: #@UnusedVariable
-            pass
-        cnx.close()
-
-    def _do_query(self, query, argument_tuple):
+        with self._connection('load_file_into_database') as cnx:
+            cursor = cnx.cursor()
+            result = cursor.execute(sql, multi=True)
+
+            # We need to iterate on result to get it to execute; while loop just hangs
+            for row in result: #@UnusedVariable
+                pass
+
+    def get_pool_stats(self):
+        '''Returns a copy of the connection pool statistics
+
+        Keys:
+            pool_size - number of connections in the pool
+            checkouts - total connections handed out
+            checked_out - connections currently in use
+            exhausted - checkouts that had to wait for a connection to be returned
+            timeouts - checkouts that gave up waiting and raised PoolExhausted
+            wait_time_total, wait_time_max - seconds spent waiting for a connection
+        '''
+        with self._stats_lock:
+            stats = dict(self._pool_stats)
+        stats['pool_size'] = self.pool_size
+        return stats
+
+    @contextlib.contextmanager
+    def _connection(self, statement='other'):
+        '''Checks a connection out of the pool for the duration of a with block
+
+        statement names what the connection is for in the metrics
+
+        Raises:
+            PoolExhausted - no connection became free within checkout_timeout
+        '''
+        # Hold on to the pool and semaphore we started with, in case reconfigure() swaps them
+        # while we're using them
+        mysql_pool, pool_semaphore = self._pool
+
+        started = time.monotonic()
+        exhausted = not pool_semaphore.acquire(blocking=False)
+        if exhausted and not pool_semaphore.acquire(timeout=self.checkout_timeout):
+            with self._stats_lock:
+                self._pool_stats['exhausted'] += 1
+                self._pool_stats['timeouts'] += 1
+            if self.metrics:
+                self.metrics.record_checkout(time.monotonic() - started, timed_out=True)
+            raise PoolExhausted('No database connection free after %ss' % self.checkout_timeout)
+
+        waited = time.monotonic() - started
+        with self._stats_lock:
+            self._pool_stats['checkouts'] += 1
+            self._pool_stats['checked_out'] += 1
+            self._pool_stats['wait_time_total'] += waited
+            self._pool_stats['wait_time_max'] = max(self._pool_stats['wait_time_max'], waited)
+            if exhausted:
+                self._pool_stats['exhausted'] += 1
+        if self.metrics:
+            self.metrics.record_checkout(waited)
+
+        checked_out = time.monotonic()
+        try:
+            cnx = mysql_pool.get_connection()
+            try:
+                yield cnx
+            finally:
+                cnx.close()
+        finally:
+            with self._stats_lock:
+                self._pool_stats['checked_out'] -= 1
+            pool_semaphore.release()
+            if self.metrics:
+                self.metrics.record_query(statement, time.monotonic() - checked_out)
+
+    def _do_query(self, query, argument_tuple, statement='other'):
         '''Wrapper for doing queries. Returns dict with status info'''
-        cnx = self.mysql_pool.get_connection()
-        cursor = cnx.cursor()
-        cursor.execute(query, argument_tuple)
-        cnx.commit()
-        cnx.close()
+        with self._connection(statement) as cnx:
+            cursor = cnx.cursor()
+            cursor.execute(query, argument_tuple)
+            cnx.commit()
 
         results = {}
         results['lastrowid'] = cursor.lastrowid
         results['rowcount'] = cursor.rowcount
         return results
 
-    def _do_insert(self, query, argument_tuple):
+    def _do_insert(self, query, argument_tuple, statement='other'):
         '''Wrapper for doing INSERTs, returns lastrowid'''
-        results = self._do_query(query, argument_tuple)
+        results = self._do_query(query, argument_tuple, statement)
         return results['lastrowid']
 
-    def _do_delete(self, query, argument_tuple):
+    def _do_delete(self, query, argument_tuple, statement='other'):
         '''Wrapper for doing DELETEs, returns rowcount'''
-        results = self._do_query(query, argument_tuple)
+        results = self._do_query(query, argument_tuple, statement)
         return results['rowcount']
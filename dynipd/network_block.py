@@ -7,6 +7,7 @@ Created on Sep 20, 2015
 import ipaddress
 from socket import AF_INET, AF_INET6
 from dynipd.validation import ValidationAndNormlization as check
+from dynipd.validation import networks_overlap, parse_network, to_ip_network
 from dynipd.server.allocation import AllocationServerSide
 
 class NetworkBlockFull(Exception):
@@ -25,6 +26,44 @@ class AllocationNotFound(Exception):
     def __str__(self):
         return repr(self.value)
 
+def carve_reservations(networks, machine, count):
+    '''Carves allocations out of networks, in order, until count IPs are reserved
+
+    Everything happens in memory; the caller is expected to persist the result, and to call
+    release_reservations() if that fails. The caller must also hold whatever lock protects
+    the NetworkBlocks.
+
+    Returns a list of (AllocationServerSide, [ip_address, ...]) tuples
+
+    Raises:
+        NetworkBlockFull - the networks don't have count IPs free between them. Nothing is
+                           left carved in that case
+    '''
+    carved = []
+    remaining = count
+
+    for network in networks:
+        while remaining:
+            try:
+                allocation = network._carve_allocation(machine) # pylint: disable=protected-access
+            except NetworkBlockFull:
+                break
+
+            ip_addresses = allocation.reserve_unused_ips(remaining)
+            carved.append((allocation, ip_addresses))
+            remaining -= len(ip_addresses)
+
+        if not remaining:
+            return carved
+
+    release_reservations(carved)
+    raise NetworkBlockFull('Only %d of %d IPs available' % (count-remaining, count))
+
+def release_reservations(carved):
+    '''Undoes carve_reservations()'''
+    for allocation, _ in carved:
+        allocation.get_network_block()._remove_allocation_assoication(allocation) # pylint: disable=protected-access
+
 class NetworkBlock(object):
     '''A NetworkBlock represents an object from the network_topologies table
 
@@ -49,6 +88,10 @@ class NetworkBlock(object):
         self.datastore = datastore
         self._network_block_utilization = {}
 
+        # Allocations carved or marked in use, kept up to date as they come and go so the
+        # metrics endpoint never has to count them
+        self.allocations_used = 0
+
         self._network_id = network_dict['id']
         self.network_name = network_dict['name']
         self.family = network_dict['family']
@@ -72,6 +115,10 @@ class NetworkBlock(object):
             if self.allocation_size > 128 or self.allocation_size < self._network.prefixlen:
                 raise ValueError('Allocation prefix size is too large!')
 
+        # Allocations are carved and looked up as integers; see parse_network()
+        self._network_key = (self.family, int(self._network.network_address),
+                             self._network.prefixlen)
+
         # We can calculate the number of hosts by doing powers of 2 math
         self._total_number_of_allocations = 2**(self.allocation_size-self._network.prefixlen)
 
@@ -93,6 +140,10 @@ class NetworkBlock(object):
         # else ends up in the right ranges
         self._total_number_of_allocations -= 1
 
+        # Offset 0 is the network address, and offsets from _total_number_of_allocations up
+        # are never carved (the broadcast address lives there for IPv4)
+        self.allocations_total = max(0, self._total_number_of_allocations - 1)
+
         # In all cases, we need to handle the _network address
         self._mark_network_address()
 
@@ -107,6 +158,21 @@ class NetworkBlock(object):
 
         return False
 
+    def is_defined_by(self, network_dict):
+        '''Checks a network_topology row still describes this NetworkBlock exactly'''
+        try:
+            network = parse_network(network_dict['network'])
+        except ValueError:
+            return False
+
+        return (network_dict['id'] == self._network_id and
+                network_dict['name'] == self.network_name and
+                network_dict['family'] == self.family and
+                network_dict['location'] == self.location and
+                network == self._network_key and
+                network_dict['allocation_size'] == self.allocation_size and
+                network_dict['reserved_blocks'] == self.reserved_blocks)
+
     def get_id(self):
         '''Returns database ID number'''
         return self._network_id
@@ -115,6 +181,11 @@ class NetworkBlock(object):
         '''Returns the name of this _network'''
         return self.network_name
 
+    @property
+    def allocations_free(self):
+        '''Number of allocations that can still be handed out'''
+        return self.allocations_total - self.allocations_used
+
     def create_new_allocation(self, machine):
         '''Creates a new allocation and assigns it to a machine'''
         new_allocation = self._get_new_allocation(machine)
@@ -123,6 +194,17 @@ class NetworkBlock(object):
 
     def _get_new_allocation(self, machine):
         '''Retrieves the next allocation available for a machine'''
+        unusued_allocation = self._carve_allocation(machine)
+
+        # Assoicate the allocation with a machine
+        machine.add_allocation(unusued_allocation)
+        return unusued_allocation
+
+    def _carve_allocation(self, machine):
+        '''Claims the next free allocation in memory only; nothing is written to the database
+
+        Used directly when the caller persists a whole batch itself (see
+        MySQLDataStore.reserve_ips). Undo with _remove_allocation_assoication()'''
 
         # Find the next open IP by walking the struct for the first gap
         next_allocation = None
@@ -140,17 +222,45 @@ class NetworkBlock(object):
         # the _network address, then the start of the next allocation is _block_seperator
         # (which is the size of an allocation as an integer) * next allocation
 
-        # Knowing that, calculating next_address and next_network is easy
-        next_address = self._network.network_address + self._block_seperator*next_allocation
-        next_network = ipaddress.ip_network(('%s/%s') % (next_address, self.allocation_size))
+        # Knowing that, calculating next_network is easy
+        next_address = self._network_key[1] + self._block_seperator*next_allocation
+        next_network = to_ip_network(self.family, next_address, self.allocation_size)
 
         unusued_allocation = AllocationServerSide(next_network, self, machine, self.datastore)
         self._network_block_utilization.update({pointer: unusued_allocation})
-
-        # Assoicate the allocation with a machine
-        machine.add_allocation(unusued_allocation)
+        self.allocations_used += 1
         return unusued_allocation
 
+    def _mark_allocation_in_use(self, cidr_block):
+        '''Marks an allocation that already exists in the database as used
+
+        We only need to know the space is taken so it isn't handed out again, so a marker is
+        stored rather than a full AllocationServerSide'''
+        ip_network = parse_network(cidr_block)
+        if not networks_overlap(self._network_key, ip_network):
+            raise ValueError('Allocation block not within NetworkBlock')
+
+        # Same offset math as _get_allocation_offset
+        offset = (ip_network[1]-self._network_key[1]) // self._block_seperator
+        if offset not in self._network_block_utilization:
+            self.allocations_used += 1
+        self._network_block_utilization.update({offset: 'ALLOCATED'})
+
+    def _mark_allocation_free(self, cidr_block):
+        '''Frees an allocation that has been deleted from the database, whether it was
+        carved here or marked in use. Returns False if it wasn't in use to begin with'''
+        try:
+            offset = self._get_allocation_offset(cidr_block)
+        except AllocationNotFound:
+            return False
+        # Strings are markers; only 'ALLOCATED' stands in for an allocation
+        in_use = self._network_block_utilization[offset]
+        if isinstance(in_use, str) and in_use != 'ALLOCATED':
+            raise ValueError('%s is not an allocation' % cidr_block)
+
+        self._network_block_utilization.pop(offset)
+        self.allocations_used -= 1
+        return True
 
     def _mark_network_address(self):
         '''Marks the _network address in an _allocation'''
@@ -168,18 +278,16 @@ class NetworkBlock(object):
         '''Gets the offset within the dict for a given allocation'''
 
         # Validate our input
-        ip_network = check.validate_ip_network(cidr_block)
-        if not check.do_cidr_blocks_overlap(self._network, cidr_block):
+        family, network_value, prefix_length = parse_network(cidr_block)
+        if not networks_overlap(self._network_key, (family, network_value, prefix_length)):
             raise ValueError('Allocation block not within NetworkBlock')
-        if ip_network.prefixlen != self.allocation_size:
+        if prefix_length != self.allocation_size:
             raise ValueError('Allocation block has wrong allocation size')
 
-        # Offset is calculated by the difference in network addresses
-        offset = int(ip_network.network_address)-int(self._network.network_address)
+        # Offset is calculated by the difference in network addresses, in units of allocations
+        # (see _get_new_allocation)
+        offset = (network_value-self._network_key[1]) // self._block_seperator
 
-        import pprint
-        pprint.pprint(offset)
-        pprint.pprint(self._network_block_utilization)
         # Confirm it exists, or throw a ValueError
         if offset in self._network_block_utilization:
             return offset
@@ -195,4 +303,8 @@ class NetworkBlock(object):
 
         # _get_allocation_offset will sanity check the input for us
         offset = self._get_allocation_offset(ip_allocation.get_allocation_cidr())
-        self._network_block_utilization.pop(offset)
+        removed = self._network_block_utilization.pop(offset)
+
+        # Strings are markers; only 'ALLOCATED' stands in for an allocation
+        if not isinstance(removed, str) or removed == 'ALLOCATED':
+            self.allocations_used -= 1
@@ -0,0 +1,172 @@
+'''
+Persistent node agent state
+
+Everything a node agent knows about what it owns lives in memory, so after a restart it
+has to ask the server and dump the kernel before it can do anything. When a whole fleet
+reboots at once, that's every node hitting the server at the same moment. Keeping a copy
+on disk lets an agent pick up where it left off: renew what's about to expire, and only
+reconcile what's changed.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import json
+import os
+import tempfile
+import time
+from dynipd.validation import ValidationAndNormlization as check
+
+# Bumped whenever the layout changes; older files are ignored rather than misread
+STATE_FORMAT_VERSION = 1
+
+class NodeState(object):
+    '''What a node agent knows about the IPs it owns
+
+    allocations - {allocation CIDR: [IPs reserved within it]}, as handed out by the server
+    reservation_deadlines - {IP: wall clock time its reservation runs out}
+    reconciled - {interface: [ip_dicts]} as they were after the last successful reconcile
+    '''
+
+    def __init__(self, machine_name):
+        self.machine_name = machine_name
+        self.allocations = {}
+        self.reservation_deadlines = {}
+        self.reconciled = {}
+        self.saved_at = None
+
+    def set_allocations(self, allocations):
+        '''Replaces the allocations with an iterable of (CIDR, [IPs]), as RESERVE returns.
+        Deadlines for IPs no longer in any allocation are dropped'''
+        self.allocations = {}
+        for cidr, ip_addresses in allocations:
+            cidr = check.validate_and_normalize_ip_network(cidr)
+            self.allocations[cidr] = [check.validate_and_normalize_ip(ip_address)
+                                      for ip_address in ip_addresses]
+
+        owned = set(ip_address for ip_addresses in self.allocations.values()
+                    for ip_address in ip_addresses)
+        self.reservation_deadlines = {ip_address: deadline for ip_address, deadline
+                                      in self.reservation_deadlines.items()
+                                      if ip_address in owned}
+
+    def get_allocations(self):
+        '''Returns the allocations as a list of (CIDR, [IPs])'''
+        return sorted(self.allocations.items())
+
+    def set_reservation_deadline(self, ip_address, deadline):
+        '''Records when an IP's reservation runs out, as a time.time() value'''
+        self.reservation_deadlines[check.validate_and_normalize_ip(ip_address)] = deadline
+
+    def expiring_reservations(self, within, now=None):
+        '''Returns the IPs whose reservations run out in the next within seconds, soonest
+        first. Anything already expired is included'''
+        if now is None:
+            now = time.time()
+        expiring = [(deadline, ip_address) for ip_address, deadline
+                    in self.reservation_deadlines.items() if deadline <= now + within]
+        return [ip_address for _, ip_address in sorted(expiring)]
+
+    def record_reconciled(self, interface, ip_dicts):
+        '''Records what an interface looked like after a successful reconcile'''
+        self.reconciled[interface] = [{'ip_address': ip_dict['ip_address'],
+                                       'family': ip_dict['family'],
+                                       'prefix_length': ip_dict['prefix_length']}
+                                      for ip_dict in ip_dicts]
+
+    def get_reconciled(self, interface):
+        '''Returns the ip_dicts an interface had after its last reconcile, or None'''
+        ip_dicts = self.reconciled.get(interface)
+        if ip_dicts is None:
+            return None
+        return [dict(ip_dict) for ip_dict in ip_dicts]
+
+    def to_dict(self):
+        '''Returns everything as plain types, ready for JSON'''
+        return {'version': STATE_FORMAT_VERSION,
+                'machine_name': self.machine_name,
+                'saved_at': self.saved_at,
+                'allocations': self.allocations,
+                'reservation_deadlines': self.reservation_deadlines,
+                'reconciled': self.reconciled}
+
+    @classmethod
+    def from_dict(cls, state_dict):
+        '''Rebuilds a NodeState from to_dict() output
+
+        Raises:
+            ValueError - the dict is from another format version, or is malformed
+        '''
+        if not isinstance(state_dict, dict) or \
+           state_dict.get('version') != STATE_FORMAT_VERSION:
+            raise ValueError('Unknown state format')
+
+        try:
+            state = cls(state_dict['machine_name'])
+            state.set_allocations(state_dict['allocations'].items())
+            for ip_address, deadline in state_dict['reservation_deadlines'].items():
+                state.set_reservation_deadline(ip_address, float(deadline))
+            for interface, ip_dicts in state_dict['reconciled'].items():
+                state.record_reconciled(interface, ip_dicts)
+            state.saved_at = state_dict['saved_at']
+        except (KeyError, TypeError, AttributeError) as error:
+            raise ValueError('Malformed state: %s' % error)
+
+        return state
+
+class NodeStateFile(object):
+    '''Loads and atomically replaces a NodeState on disk
+
+    The new state is written to a temporary file next to the old one, flushed to disk,
+    and renamed over it, so a crash or power cut at any point leaves either the old file
+    or the new one, never half of each.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, machine_name=None):
+        '''Returns the saved NodeState, or None if there isn't a usable one
+
+        A missing, unreadable, corrupt or old format file is treated as no file; the agent
+        falls back to a full sync. So is one saved by a different machine_name, if given'''
+        try:
+            with open(self.path, 'r') as state_file:
+                state = NodeState.from_dict(json.load(state_file))
+        except (OSError, ValueError):
+            return None
+
+        if machine_name is not None and state.machine_name != machine_name:
+            return None
+
+        return state
+
+    def save(self, state):
+        '''Writes state to disk, replacing whatever was there
+
+        Raises:
+            OSError - the state couldn't be written. The old file is left as it was
+        '''
+        state.saved_at = time.time()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.dynipd-state')
+        try:
+            with os.fdopen(file_descriptor, 'w') as state_file:
+                json.dump(state.to_dict(), state_file, separators=(',', ':'), sort_keys=True)
+                state_file.flush()
+                os.fsync(state_file.fileno())
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(temporary_path)
+            except OSError:
+                pass
+            raise
+
+        # The rename itself isn't durable until the directory is flushed too
+        directory_descriptor = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_descriptor)
+        finally:
+            os.close(directory_descriptor)
@@ -0,0 +1,224 @@
+'''
+DynIPD - Standby pool policy for node agents
+
+A node keeps a standby pool of IPs that are configured, tested and unused, so a service
+that wants an IP gets one straight away rather than waiting on a round trip to dynipd.
+StandbyPolicy decides how big that pool should be from how fast it's been drained lately,
+and StandbyPoolManager tops it up and trims it through the protocol client.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import math
+import time
+from dynipd.protocol.client import DynIPConnectionError, DynIPServerError
+
+class StandbyPolicy(object):
+    '''Works out how many standby IPs a node should hold, and which allocations it can give up
+
+    Demand is the rate IPs move from standby to utilized. It's tracked as an exponentially
+    decaying moving average with a time constant of demand_window seconds, so a burst is
+    noticed straight away and forgotten gradually rather than all at once.
+
+    The pool is topped up whenever it drops below the low watermark plus the IPs we expect
+    to hand out over the next forecast_horizon seconds; that should be at least as long as
+    getting a new allocation reserved, configured and tested takes. Reservations are made
+    at least reserve_batch IPs at a time, so a steady trickle doesn't turn into one round
+    trip per IP.
+
+    Anything above the high watermark (or the forecast, if that's higher) is surplus.
+    Surplus is only given back every release_interval seconds, and only in whole
+    allocations with nothing utilized in them (see the README), so a short lull doesn't
+    release IPs we'll need again in a minute.
+    '''
+
+    def __init__(self, low_watermark=4, high_watermark=16, demand_window=300.0,
+                 forecast_horizon=60.0, reserve_batch=4, release_interval=300.0):
+        # pylint: disable=too-many-arguments
+        if low_watermark < 0 or high_watermark < low_watermark:
+            raise ValueError('Watermarks must satisfy 0 <= low_watermark <= high_watermark')
+        if demand_window <= 0 or forecast_horizon < 0 or reserve_batch < 1:
+            raise ValueError('Invalid standby policy settings')
+
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.demand_window = demand_window
+        self.forecast_horizon = forecast_horizon
+        self.reserve_batch = reserve_batch
+        self.release_interval = release_interval
+
+        # IPs per second, as of _rate_updated
+        self._rate = 0.0
+        self._rate_updated = None
+        self._last_release = None
+
+        self.demand_total = 0
+
+    def record_demand(self, count=1, now=None):
+        '''Records count IPs going from standby to utilized'''
+        now = time.monotonic() if now is None else now
+        self._rate = self.demand_rate(now) + count / self.demand_window
+        self._rate_updated = now
+        self.demand_total += count
+
+    def demand_rate(self, now=None):
+        '''Returns the moving average of demand, in IPs per second'''
+        if self._rate_updated is None:
+            return 0.0
+
+        now = time.monotonic() if now is None else now
+        elapsed = max(0.0, now - self._rate_updated)
+        return self._rate * math.exp(-elapsed / self.demand_window)
+
+    def forecast(self, now=None):
+        '''Returns how many IPs we expect to hand out over the forecast horizon'''
+        # Rounded to the nearest IP; rounding up would keep an IP in hand forever for demand
+        # that's long since decayed away
+        return int(math.floor(self.demand_rate(now) * self.forecast_horizon + 0.5))
+
+    def target(self, now=None):
+        '''Returns how many standby IPs we want to be holding'''
+        return self.low_watermark + self.forecast(now)
+
+    def ips_to_reserve(self, standby_count, now=None):
+        '''Returns how many IPs to reserve now, 0 if the pool is big enough'''
+        shortfall = self.target(now) - standby_count
+        if shortfall <= 0:
+            return 0
+        return max(shortfall, self.reserve_batch)
+
+    def release_due(self, now=None):
+        '''Checks whether it's time to look for surplus to give back'''
+        now = time.monotonic() if now is None else now
+        return self._last_release is None or now - self._last_release >= self.release_interval
+
+    def select_surplus(self, allocations, utilized_ips, now=None):
+        '''Picks allocations to give back. Returns a list of CIDRs, possibly empty
+
+        Nothing is picked unless release_due(); when it is, this counts as the scheduled
+        release whether or not anything's picked.
+
+        Args:
+            allocations - iterable of (allocation CIDR, [IPs]) the node holds
+            utilized_ips - set of IPs in use by something on the node
+        '''
+        if not self.release_due(now):
+            return []
+        self._last_release = time.monotonic() if now is None else now
+
+        allocations = list(allocations)
+        standby_count = sum(1 for _, ip_addresses in allocations
+                            for ip_address in ip_addresses if ip_address not in utilized_ips)
+        surplus = standby_count - max(self.high_watermark, self.target(now))
+
+        # Smallest first, so we trim as close to the limit as we can without going under it
+        candidates = sorted(((len(ip_addresses), cidr) for cidr, ip_addresses in allocations
+                             if not any(ip_address in utilized_ips
+                                        for ip_address in ip_addresses)),
+                            key=lambda candidate: candidate[0])
+
+        released = []
+        for size, cidr in candidates:
+            if size > surplus:
+                break
+            released.append(cidr)
+            surplus -= size
+
+        return released
+
+    def get_information(self, now=None):
+        '''Returns the policy settings and current forecast as a dict'''
+        return {'low_watermark': self.low_watermark,
+                'high_watermark': self.high_watermark,
+                'demand_window': self.demand_window,
+                'forecast_horizon': self.forecast_horizon,
+                'reserve_batch': self.reserve_batch,
+                'release_interval': self.release_interval,
+                'demand_rate': self.demand_rate(now),
+                'demand_total': self.demand_total,
+                'forecast': self.forecast(now),
+                'target': self.target(now)}
+
+class StandbyPoolManager(object):
+    '''Applies a StandbyPolicy to the allocations in a NodeState
+
+    Call step() periodically with the IPs that are currently utilized (for instance from
+    UtilizationScanner). Newly utilized IPs count as demand, but not on the first step, when
+    everything already in use after a restart would look new; the pool is then topped up
+    with a single RESERVE if it's short, and surplus allocations are RELEASEd and dropped
+    from the NodeState on the policy's schedule. If the RELEASE doesn't get through, they're
+    dropped all the same; once they stop being renewed, the server expires them.
+
+    Configuring and testing the IPs is left to NodeAgent, working from the same NodeState;
+    it passes in the IPs that haven't passed a ConnectivityProber probe yet, which aren't
+    counted as standby.
+    '''
+
+    def __init__(self, policy, client, node_state, location, family,
+                 reservation_lifetime=300.0):
+        # pylint: disable=too-many-arguments
+        self.policy = policy
+        self.client = client
+        self.node_state = node_state
+        self.location = location
+        self.family = family
+        self.reservation_lifetime = reservation_lifetime
+
+        # None until the first step, which only takes note of what's in use
+        self._utilized = None
+
+    def standby_ips(self, utilized_ips=None):
+        '''Returns the IPs we hold that aren't utilized'''
+        if utilized_ips is None:
+            utilized_ips = self._utilized or set()
+        return [ip_address for _, ip_addresses in self.node_state.get_allocations()
+                for ip_address in ip_addresses if ip_address not in utilized_ips]
+
+    async def step(self, utilized_ips, now=None, untested_ips=()):
+        '''Records demand, then reserves and releases as the policy says. untested_ips are
+        held but not usable yet, so don't count towards the standby pool
+
+        Returns {'reserved': [(CIDR, [IPs])], 'released': [CIDRs]}'''
+        utilized_ips = set(utilized_ips)
+        held = set(ip_address for _, ip_addresses in self.node_state.get_allocations()
+                   for ip_address in ip_addresses)
+        if self._utilized is not None:
+            newly_utilized = (utilized_ips - self._utilized) & held
+            if newly_utilized:
+                self.policy.record_demand(len(newly_utilized), now)
+        self._utilized = utilized_ips
+
+        result = {'reserved': [], 'released': []}
+        count = self.policy.ips_to_reserve(
+            len(self.standby_ips(utilized_ips | set(untested_ips))), now)
+        if count:
+            reserved = await self.client.reserve(self.node_state.machine_name, self.location,
+                                                 self.family, count)
+            allocations = dict(self.node_state.get_allocations())
+            for cidr, ip_addresses in reserved:
+                allocations[cidr] = list(allocations.get(cidr, [])) + ip_addresses
+            self.node_state.set_allocations(allocations.items())
+
+            deadline = time.time() + self.reservation_lifetime
+            for _, ip_addresses in reserved:
+                for ip_address in ip_addresses:
+                    self.node_state.set_reservation_deadline(ip_address, deadline)
+            result['reserved'] = reserved
+
+        released = self.policy.select_surplus(self.node_state.get_allocations(), utilized_ips,
+                                              now)
+        if released:
+            try:
+                await self.client.release(self.node_state.machine_name, released)
+            except (DynIPServerError, DynIPConnectionError):
+                pass
+
+            released_set = set(released)
+            self.node_state.set_allocations(
+                [(cidr, ip_addresses) for cidr, ip_addresses in self.node_state.get_allocations()
+                 if cidr not in released_set])
+            result['released'] = released
+
+        return result
@@ -0,0 +1,115 @@
+'''
+Bidirectional connectivity prober
+
+An IP only moves from RESERVED to STANDBY once we know traffic gets to and from it. We
+find out by connecting to an echo service with the IP as our source, sending something
+nobody else could guess, and getting the same thing back. Doing that for one IP at a time
+means a /24 takes as long as 254 timeouts, so probes are run concurrently.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import ipaddress
+import os
+import time
+from socket import AF_INET, AF_INET6
+
+class ConnectivityProber(object):
+    '''Probes many source IPs against a TCP echo service at once
+
+        prober = ConnectivityProber(v4_endpoint=('192.0.2.1', 7))
+        async for result in prober.probe_many(ip_addresses):
+            ...
+
+    Each probe binds the source IP, connects, writes a random token and reads it back, all
+    within timeout seconds. At most concurrency probes are running at any time. Results
+    are dicts:
+
+        ip_address - the source IP that was probed
+        reachable - True if the token made the round trip
+        round_trip - seconds the probe took, if it was reachable
+        error - why not, if it wasn't
+    '''
+
+    def __init__(self, v4_endpoint=None, v6_endpoint=None, timeout=2.0, concurrency=64):
+        '''
+        Args:
+            v4_endpoint - (host, port) of the echo service IPv4 sources probe against
+            v6_endpoint - (host, port) of the echo service IPv6 sources probe against
+            timeout - seconds an individual probe may take, connecting included
+            concurrency - most probes in flight at once
+        '''
+        self.endpoints = {AF_INET: v4_endpoint, AF_INET6: v6_endpoint}
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+    async def probe(self, ip_address):
+        '''Probes a single source IP. Returns a result dict'''
+        result = {'ip_address': str(ip_address),
+                  'reachable': False,
+                  'round_trip': None,
+                  'error': None}
+
+        try:
+            ip_address = ipaddress.ip_address(ip_address)
+        except ValueError as error:
+            result['error'] = str(error)
+            return result
+
+        endpoint = self.endpoints[AF_INET if ip_address.version == 4 else AF_INET6]
+        if endpoint is None:
+            result['error'] = 'no endpoint for IPv%d' % ip_address.version
+            return result
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._echo(str(ip_address), endpoint), self.timeout)
+        except asyncio.TimeoutError:
+            result['error'] = 'timed out'
+        except (OSError, asyncio.IncompleteReadError, ValueError) as error:
+            result['error'] = str(error) or type(error).__name__
+        else:
+            result['reachable'] = True
+            result['round_trip'] = time.monotonic() - started
+
+        return result
+
+    async def probe_many(self, ip_addresses):
+        '''Probes many source IPs, yielding each result dict as soon as it's known
+
+        Results come back in the order probes finish, not the order IPs were given. If the
+        caller stops iterating early, outstanding probes are cancelled.'''
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded_probe(ip_address):
+            async with semaphore:
+                return await self.probe(ip_address)
+
+        tasks = [asyncio.ensure_future(bounded_probe(ip_address))
+                 for ip_address in ip_addresses]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _echo(self, ip_address, endpoint):
+        '''Connects from ip_address, and checks a token comes back unchanged
+
+        Raises:
+            ValueError - something other than our token came back
+        '''
+        token = os.urandom(16).hex().encode() + b'\n'
+        reader, writer = await asyncio.open_connection(endpoint[0], endpoint[1],
+                                                       local_addr=(ip_address, 0))
+        try:
+            writer.write(token)
+            await writer.drain()
+            if await reader.readexactly(len(token)) != token:
+                raise ValueError('echo mismatch')
+        finally:
+            writer.close()
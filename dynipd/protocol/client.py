@@ -0,0 +1,480 @@
+'''
+DynIPD protocol client
+
+Agents talk to dynipd over one long-lived connection instead of opening a connection (or
+worse, a database connection) per operation. Requests are pipelined: each is written as
+soon as it's made, and since dynipd answers commands on a connection in order, responses
+are matched to requests first in, first out. EVENT lines pushed by SUBSCRIBE are picked
+out of the stream and queued separately.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import collections
+import random
+import threading
+import time
+from socket import AF_INET, AF_INET6
+
+DEFAULT_PORT = 8888
+
+class DynIPServerError(Exception):
+    '''dynipd answered a request with an error status
+
+    retry_after is dynipd's hint of how many seconds to wait before trying again, when it
+    turned the request away for being busy'''
+    def __init__(self, value, status=None, retry_after=None):
+        super(DynIPServerError, self).__init__(value)
+        self.value = value
+        self.status = status
+        self.retry_after = retry_after
+    def __str__(self):
+        return repr(self.value)
+
+class DynIPConnectionError(ConnectionError):
+    '''The connection to dynipd was lost, or couldn't be made'''
+    def __init__(self, value):
+        super(DynIPConnectionError, self).__init__(value)
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class AsyncDynIPClient(object):
+    '''asyncio client for the dynipd protocol
+
+        client = AsyncDynIPClient('dynipd.example.com')
+        allocations = await client.reserve('node1', 'TestNet', AF_INET, 4)
+
+    The connection is made on first use, and remade with decorrelated jitter backoff (see
+    decorrelated_jitter()) if it's lost, so a fleet doesn't reconnect in lockstep. When
+    dynipd is too busy for a request, it's retried the same way, waiting at least as long
+    as dynipd asked, up to busy_retries times. Requests that were in flight
+    when it was lost fail with DynIPConnectionError; they aren't resent, since there's no
+    telling whether dynipd acted on them. A SUBSCRIBE is re-issued on the new connection.
+
+    dynipd hangs up on connections that have been quiet for its idle_timeout (10 seconds by
+    default). So that an agent with nothing to say doesn't reconnect every time it next
+    speaks, a TEST is sent whenever nothing else has been for keepalive_interval seconds.
+
+    Any number of coroutines may make requests at the same time.
+    '''
+
+    def __init__(self, host, port=DEFAULT_PORT, authenticate=True, connect_timeout=5.0,
+                 backoff_start=0.1, backoff_max=10.0, connect_attempts=6, busy_retries=8,
+                 keepalive_interval=5.0):
+        '''
+        Args:
+            host, port - where dynipd is listening
+            authenticate - authenticate as soon as we connect
+            connect_timeout - seconds to wait for a connection and dynipd's greeting
+            backoff_start, backoff_max - bounds of the delay between attempts
+            connect_attempts - attempts before giving up and raising DynIPConnectionError
+            busy_retries - retries of a request dynipd was too busy for
+            keepalive_interval - seconds of quiet before sending a TEST to keep the
+                                 connection open; must be less than dynipd's idle_timeout.
+                                 0 turns keepalives off
+        '''
+        # pylint: disable=too-many-arguments
+        self.host = host
+        self.port = port
+        self.authenticate = authenticate
+        self.connect_timeout = connect_timeout
+        self.backoff_start = backoff_start
+        self.backoff_max = backoff_max
+        self.connect_attempts = connect_attempts
+        self.busy_retries = busy_retries
+        self.keepalive_interval = keepalive_interval
+
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._keepalive_task = None
+        self._last_sent = 0.0
+        self._connect_lock = None
+        self._pending = collections.deque()
+        self._subscription = None
+        self._events = None
+        self._closed = False
+
+        self.connects = 0
+        self.requests = 0
+        self.busy_responses = 0
+        self.keepalives = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        '''Connects if we aren't connected, retrying with backoff
+
+        Raises:
+            DynIPConnectionError - every attempt failed
+        '''
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        if self._events is None:
+            self._events = asyncio.Queue()
+
+        async with self._connect_lock:
+            if self._closed:
+                raise DynIPConnectionError('Client is closed')
+            if self._writer is not None:
+                return
+
+            last_error = None
+            delay = self.backoff_start
+            for attempt in range(self.connect_attempts):
+                if attempt:
+                    delay = decorrelated_jitter(delay, self.backoff_start, self.backoff_max)
+                    await asyncio.sleep(delay)
+                try:
+                    await asyncio.wait_for(self._open_connection(), self.connect_timeout)
+                    return
+                except (OSError, asyncio.TimeoutError, DynIPServerError) as error:
+                    last_error = error
+
+            raise DynIPConnectionError('Could not connect to %s:%s: %s' %
+                                       (self.host, self.port, last_error))
+
+    async def close(self):
+        '''Closes the connection for good. Outstanding requests fail'''
+        self._closed = True
+        self._disconnected(DynIPConnectionError('Client closed'))
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+            self._read_task = None
+
+    async def request(self, command):
+        '''Sends one command line, and returns dynipd's response line
+
+        Raises:
+            DynIPServerError - dynipd answered with a 4xx or 5xx status, or was still busy
+                               after busy_retries retries
+            DynIPConnectionError - we couldn't connect, or lost the connection first
+        '''
+        delay = None
+        for attempt in range(self.busy_retries + 1):
+            await self.connect()
+            try:
+                return await self._send([command])[0]
+            except DynIPServerError as error:
+                if error.retry_after is None or attempt == self.busy_retries:
+                    raise
+                self.busy_responses += 1
+
+                # Never sooner than dynipd asked, and spread out from there
+                base = max(error.retry_after, self.backoff_start)
+                delay = decorrelated_jitter(delay or base, base, max(base, self.backoff_max))
+                await asyncio.sleep(delay)
+
+    async def request_many(self, commands):
+        '''Sends several command lines in one write, and returns their responses in order
+
+        Busy responses aren't retried here; the caller decides what to resend.
+
+        Raises:
+            DynIPServerError - the first command dynipd answered with an error status
+            DynIPConnectionError - we couldn't connect, or lost the connection first
+        '''
+        await self.connect()
+        return list(await asyncio.gather(*self._send(commands)))
+
+    async def test(self):
+        '''Sends TEST. Returns dynipd's response'''
+        return await self.request('TEST')
+
+    async def stats(self):
+        '''Returns dynipd's STATS as a dict of strings'''
+        response = await self.request('STATS')
+        return dict(pair.split('=', 1) for pair in response.split()[1:])
+
+    async def reserve(self, machine_name, location, family, count):
+        '''Reserves count IPs. Returns a list of (allocation CIDR, [IPs]), as
+        IPReconciler's desired_ips_from_allocations() takes'''
+        family_name = {AF_INET: '4', AF_INET6: '6'}[family]
+        response = await self.request('RESERVE %s %s %s %d' % (machine_name, location,
+                                                               family_name, count))
+        return parse_reservations(response)
+
+    async def renew(self, machine_name, ip_addresses):
+        '''Renews a machine's reservations. Returns the IPs dynipd renewed; the machine no
+        longer holds any others it asked about
+
+        Renewals are served ahead of new reservations, so renew before asking for more'''
+        response = await self.request('RENEW %s %s' % (machine_name, ' '.join(ip_addresses)))
+        return response.split()[3:]
+
+    async def release(self, machine_name, allocation_cidrs):
+        '''Hands a machine's allocations, and the IPs reserved in them, back to dynipd.
+        Returns how many it released'''
+        response = await self.request('RELEASE %s %s' % (machine_name,
+                                                         ' '.join(allocation_cidrs)))
+        return int(response.split()[-1])
+
+    async def subscribe(self, machine_name, location=None):
+        '''Subscribes to events for a machine. Events are read with get_event()'''
+        command = 'SUBSCRIBE %s' % machine_name
+        if location:
+            command += ' %s' % location
+
+        response = await self.request(command)
+        self._subscription = command
+        return response
+
+    async def unsubscribe(self):
+        '''Stops events being sent to us'''
+        self._subscription = None
+        return await self.request('UNSUBSCRIBE')
+
+    async def get_event(self):
+        '''Waits for the next event. Returns (event type, detail)'''
+        if self._events is None:
+            self._events = asyncio.Queue()
+        return await self._events.get()
+
+    async def _open_connection(self):
+        '''Connects, reads the greeting, and authenticates and resubscribes if need be'''
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            greeting = (await reader.readline()).decode().rstrip()
+            if not greeting.startswith('200'):
+                raise DynIPServerError(greeting or 'Connection closed before greeting')
+        except BaseException:
+            writer.close()
+            raise
+
+        self._reader = reader
+        self._writer = writer
+        self._read_task = asyncio.ensure_future(self._read_responses(reader))
+        self._last_sent = time.monotonic()
+        self.connects += 1
+        if self.keepalive_interval:
+            self._keepalive_task = asyncio.ensure_future(self._keep_alive(writer))
+
+        # TEST2 authenticates, and gets no response
+        if self.authenticate:
+            writer.write(b'TEST2\n')
+
+        if self._subscription:
+            self._send([self._subscription])
+
+    def _send(self, commands):
+        '''Writes commands in one go. Returns a future for each response'''
+        if self._writer is None:
+            raise DynIPConnectionError('Not connected')
+
+        futures = []
+        loop = asyncio.get_event_loop()
+        for _ in commands:
+            # Failures are raised to whoever awaits the future; the callback just stops
+            # asyncio complaining about ones nobody got round to awaiting
+            future = loop.create_future()
+            future.add_done_callback(_ignore_result)
+            self._pending.append(future)
+            futures.append(future)
+
+        self._writer.write(''.join(command + '\n' for command in commands).encode())
+        self._last_sent = time.monotonic()
+        self.requests += len(commands)
+        return futures
+
+    async def _keep_alive(self, writer):
+        '''Sends a TEST whenever nothing has been sent for keepalive_interval seconds, for
+        as long as writer is the connection'''
+        while self._writer is writer:
+            quiet_until = self._last_sent + self.keepalive_interval
+            if time.monotonic() < quiet_until:
+                await asyncio.sleep(quiet_until - time.monotonic())
+                continue
+
+            # Nobody waits for the answer; if the connection's gone, the next request finds out
+            self._send(['TEST'])
+            self.keepalives += 1
+
+    async def _read_responses(self, reader):
+        '''Reads lines until the connection goes, handing responses to requests in order'''
+        error = DynIPConnectionError('Connection closed by dynipd')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                line = line.decode().rstrip('\n')
+                if line.startswith('EVENT '):
+                    _, event_type, detail = (line.split(' ', 2) + [''])[:3]
+                    self._events.put_nowait((event_type, detail))
+                    continue
+
+                if not self._pending:
+                    # Nobody asked for this; it's not safe to match anything else up now
+                    error = DynIPConnectionError('Unexpected response: %s' % line)
+                    break
+
+                future = self._pending.popleft()
+                if future.done():
+                    continue
+
+                status = line.split(' ', 1)[0]
+                if status[:1] in ('4', '5') and status.isdigit():
+                    future.set_exception(DynIPServerError(line, int(status),
+                                                          _parse_retry_after(line)))
+                else:
+                    future.set_result(line)
+        except (OSError, asyncio.IncompleteReadError) as read_error:
+            error = DynIPConnectionError(str(read_error))
+        finally:
+            if self._reader is reader:
+                self._disconnected(error)
+
+    def _disconnected(self, error):
+        '''Fails everything in flight, and forgets the connection'''
+        if self._writer is not None:
+            self._writer.close()
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        self._reader = None
+        self._writer = None
+
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+class DynIPClient(object):
+    '''Blocking wrapper around AsyncDynIPClient, for code without an event loop
+
+    The async client runs on an event loop in a background thread, so the connection is
+    kept open between calls. It's safe to call from several threads at once; their
+    requests are pipelined over the one connection.
+    '''
+
+    def __init__(self, host, port=DEFAULT_PORT, timeout=30.0, **kwargs):
+        '''Takes the same arguments as AsyncDynIPClient, plus timeout, the most seconds
+        any call will block for'''
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='DynIPClient',
+                                        daemon=True)
+        self._thread.start()
+        self._client = AsyncDynIPClient(host, port, **kwargs)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Closes the connection, and stops the background thread'''
+        if self._loop.is_closed():
+            return
+
+        self._call(self._client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def connect(self):
+        '''See AsyncDynIPClient.connect()'''
+        return self._call(self._client.connect())
+
+    def request(self, command):
+        '''See AsyncDynIPClient.request()'''
+        return self._call(self._client.request(command))
+
+    def request_many(self, commands):
+        '''See AsyncDynIPClient.request_many()'''
+        return self._call(self._client.request_many(commands))
+
+    def test(self):
+        '''See AsyncDynIPClient.test()'''
+        return self._call(self._client.test())
+
+    def stats(self):
+        '''See AsyncDynIPClient.stats()'''
+        return self._call(self._client.stats())
+
+    def reserve(self, machine_name, location, family, count):
+        '''See AsyncDynIPClient.reserve()'''
+        return self._call(self._client.reserve(machine_name, location, family, count))
+
+    def renew(self, machine_name, ip_addresses):
+        '''See AsyncDynIPClient.renew()'''
+        return self._call(self._client.renew(machine_name, ip_addresses))
+
+    def release(self, machine_name, allocation_cidrs):
+        '''See AsyncDynIPClient.release()'''
+        return self._call(self._client.release(machine_name, allocation_cidrs))
+
+    def subscribe(self, machine_name, location=None):
+        '''See AsyncDynIPClient.subscribe()'''
+        return self._call(self._client.subscribe(machine_name, location))
+
+    def unsubscribe(self):
+        '''See AsyncDynIPClient.unsubscribe()'''
+        return self._call(self._client.unsubscribe())
+
+    def get_event(self, timeout=None):
+        '''Waits up to timeout seconds for the next event. Returns (event type, detail)
+
+        Raises:
+            TimeoutError - no event arrived in time
+        '''
+        future = asyncio.run_coroutine_threadsafe(self._client.get_event(), self._loop)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def _call(self, coroutine):
+        '''Runs a coroutine on the background loop, and waits for its result'''
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(self.timeout)
+
+def parse_reservations(response):
+    '''Parses a RESERVE response into a list of (allocation CIDR, [IPs])
+
+        200 10.0.2.4/30=10.0.2.5,10.0.2.6 10.0.2.8/30=10.0.2.9
+    '''
+    reservations = []
+    for reservation in response.split()[1:]:
+        cidr, _, ip_addresses = reservation.partition('=')
+        reservations.append((cidr, ip_addresses.split(',') if ip_addresses else []))
+    return reservations
+
+def decorrelated_jitter(previous, base, cap):
+    '''Returns the next delay for decorrelated jitter backoff
+
+    Each delay is picked at random between base and three times the last one, capped. It
+    grows about as fast as exponential backoff, but clients that started retrying at the
+    same moment drift apart instead of retrying together every time'''
+    return min(cap, random.uniform(base, previous * 3))
+
+def _parse_retry_after(line):
+    '''Returns the retry-after=<seconds> hint in a response line, or None'''
+    for word in line.split():
+        if word.startswith('retry-after='):
+            try:
+                return float(word[len('retry-after='):])
+            except ValueError:
+                return None
+    return None
+
+def _ignore_result(future):
+    '''Done callback that retrieves a future's exception, so nothing warns it was dropped'''
+    if not future.cancelled():
+        future.exception()
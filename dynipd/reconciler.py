@@ -0,0 +1,170 @@
+'''
+Desired-state reconciliation of an interface's IP addresses
+
+The server tells a node which IPs it should have; the kernel tells us which it does have.
+IPReconciler works out the smallest set of changes to get from one to the other, and
+applies them with a single netlink batch.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+from dynipd.validation import ValidationAndNormlization as check
+from dynipd.validation import ADDRESS_BITS, format_ip, ip_within_network, parse_ip, \
+    parse_network
+
+class IPReconciler(object):
+    '''Converges the IPs on an interface to a desired list
+
+    Addresses are compared as (family, integer) pairs, so the diff is a handful of set
+    operations however many IPs there are. An IP that's configured with the wrong prefix
+    length is removed and re-added in the same batch.
+
+    We only ever remove addresses within managed_networks; link-local addresses, and
+    anything else someone has put on the interface, are left alone. If managed_networks
+    isn't given, the networks of the desired IPs are used, which means IPs in a network
+    we no longer want anything in are never cleaned up. Pass the location's networks to
+    get that.
+
+    On a node that's already converged, reconcile() costs one address dump (none with a
+    cached interface), and sends nothing.
+
+    Given an AddressAnnouncer, IPs that get added are announced once they're configured.
+    '''
+
+    def __init__(self, interface_cfg, managed_networks=None, announcer=None):
+        '''
+        Args:
+            interface_cfg - a NetworkInterfaceConfig
+            managed_networks - CIDR networks whose addresses we own on this interface
+            announcer - AddressAnnouncer for the same interface, to announce new IPs with
+        '''
+        self.interface_cfg = interface_cfg
+        self.announcer = announcer
+        self.managed_networks = None
+        if managed_networks is not None:
+            self.managed_networks = [parse_network(network) for network in managed_networks]
+
+    def plan(self, desired_ips, configured_ips):
+        '''Works out the changes needed. Returns (ip_dicts to add, IP addresses to remove)
+
+        Args:
+            desired_ips - list of ip_dicts we want configured
+            configured_ips - list of ip_dicts actually configured, as from get_ips()
+
+        Raises:
+            ValueError - a desired IP is invalid, or is listed twice
+        '''
+        desired = {}
+        for ip_dict in desired_ips:
+            ip_dict = check.validate_and_normalize_ip_dict(dict(ip_dict))
+            key = address_key(ip_dict['ip_address'])
+            if key in desired:
+                raise ValueError('%s is listed more than once' % ip_dict['ip_address'])
+            desired[key] = ip_dict
+
+        configured = {address_key(ip_dict['ip_address']): ip_dict for ip_dict in configured_ips}
+
+        # Wrong prefix lengths get removed and added back in the same batch
+        reconfigure = set(key for key in desired.keys() & configured.keys()
+                          if desired[key]['prefix_length'] !=
+                          configured[key]['prefix_length'])
+
+        managed_networks = self.managed_networks
+        if managed_networks is None:
+            # _NetworkSet ignores host bits, so there's no need to mask them off here
+            managed_networks = [key + (ip_dict['prefix_length'],)
+                                for key, ip_dict in desired.items()]
+        managed = _NetworkSet(managed_networks)
+
+        add_keys = (desired.keys() - configured.keys()) | reconfigure
+        remove_keys = set(key for key in configured.keys() - desired.keys()
+                          if key in managed) | reconfigure
+
+        adds = [desired[key] for key in sorted(add_keys)]
+        removes = [configured[key]['ip_address'] for key in sorted(remove_keys)]
+        return (adds, removes)
+
+    def reconcile(self, desired_ips):
+        '''Makes the interface match desired_ips. Returns the (adds, removes) that were applied
+
+        Raises:
+            ValueError - a desired IP is invalid, or is listed twice. Nothing is sent
+            InterfaceConfigurationError - the changes were sent, but some didn't take
+        '''
+        configured_ips = self.interface_cfg.get_ips()
+        adds, removes = self.plan(desired_ips, configured_ips)
+
+        if adds or removes:
+            self.interface_cfg.apply_ip_changes(adds, removes, configured_ips=configured_ips)
+
+        if adds and self.announcer:
+            self.announcer.announce([ip_dict['ip_address'] for ip_dict in adds])
+
+        return (adds, removes)
+
+    def is_converged(self, desired_ips):
+        '''Returns True if the interface already matches desired_ips'''
+        adds, removes = self.plan(desired_ips, self.interface_cfg.get_ips())
+        return not (adds or removes)
+
+def desired_ips_from_allocations(allocations, networks=None):
+    '''Turns allocations handed out by the server into ip_dicts for IPReconciler
+
+    An allocation is just a slice of a subnet, so its own prefix length says nothing about
+    what's on-link; a /32 allocation would even make its only IP the broadcast address.
+    Each IP is configured with the prefix length of the network its allocation was carved
+    from. Without one, IPs are configured as host addresses (/32 or /128), which never
+    claims anything on-link we aren't sure of.
+
+    Args:
+        allocations - iterable of (allocation CIDR, list of IPs reserved within it), as
+                      returned by RESERVE
+        networks - CIDR networks the allocations were carved from; the location's networks
+    '''
+    parents = [parse_network(network) for network in networks or []]
+
+    desired_ips = []
+    for cidr, ip_addresses in allocations:
+        allocation = parse_network(cidr)
+        family = allocation[0]
+
+        # The most specific network containing the whole allocation
+        prefix_length = max([parent[2] for parent in parents
+                             if parent[2] <= allocation[2] and
+                             ip_within_network(allocation[:2], parent)] or
+                            [ADDRESS_BITS[family]])
+
+        for ip_address in ip_addresses:
+            address = parse_ip(ip_address)
+            if not ip_within_network(address, allocation):
+                raise ValueError('%s is not within %s' % (ip_address, cidr))
+
+            desired_ips.append({'ip_address': format_ip(*address),
+                                'family': family,
+                                'prefix_length': prefix_length})
+    return desired_ips
+
+def address_key(ip_address):
+    '''Returns an IP address as a (family, integer) pair, for set operations'''
+    return parse_ip(ip_address)
+
+class _NetworkSet(object):
+    '''Membership test for address_key()s against many parse_network() networks
+
+    Networks are grouped by prefix length, so a lookup is one shift and one set hit per
+    distinct prefix length rather than a comparison against every network'''
+
+    def __init__(self, networks):
+        self._by_prefix = {}
+        for family, network_value, prefix_length in networks:
+            bits = ADDRESS_BITS[family] - prefix_length
+            self._by_prefix.setdefault((family, bits), set()).add(network_value >> bits)
+
+    def __contains__(self, key):
+        family, address = key
+        for (network_family, bits), prefixes in self._by_prefix.items():
+            if network_family == family and address >> bits in prefixes:
+                return True
+        return False
@@ -0,0 +1,119 @@
+'''
+DynIPD - Prioritized admission for datastore writes
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+# Lower numbers go first
+PRIORITY_RENEWAL = 0
+PRIORITY_NEW = 1
+
+class AdmissionControl(object):
+    '''Decides which datastore writes run next, and which get told to come back later
+
+    When a whole row of machines powers on at once, every agent asks for allocations at the
+    same moment. Letting all of those into the executor's queue means a renewal (which keeps
+    IPs a machine already has from expiring out from under it) waits behind every new
+    request. Instead, at most slots writes are handed to the executor at a time, and the
+    rest wait here, renewals first.
+
+    Once max_waiting new requests are already waiting, more are turned away straight away
+    with a hint of how long the backlog will take to clear, rather than piling up until
+    clients time out and retry on top of it. Renewals are never turned away.
+    '''
+
+    def __init__(self, slots, max_waiting=256):
+        self.slots = slots
+        self.max_waiting = max_waiting
+        self._running = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+
+        # Moving average of how long a write holds its slot, for retry hints
+        self._service_time = 0.05
+
+        self.admitted = 0
+        self.shed = 0
+
+    def waiting(self, priority=None):
+        '''Returns how many writes are waiting, of a given priority or in total'''
+        return sum(1 for entry in self._waiting
+                   if not entry[2].done() and (priority is None or entry[0] == priority))
+
+    def should_shed(self, priority):
+        '''Returns True, and counts it, if a request at this priority should be told to
+        come back later'''
+        if priority == PRIORITY_RENEWAL or self._running < self.slots:
+            return False
+
+        if self.waiting(PRIORITY_NEW) < self.max_waiting:
+            return False
+
+        self.shed += 1
+        return True
+
+    def retry_after(self):
+        '''Returns whole seconds until the current backlog should have cleared, at least 1'''
+        backlog = self.waiting() + self._running
+        return max(1, int(math.ceil(backlog * self._service_time / self.slots)))
+
+    async def run(self, priority, function):
+        '''Waits for a slot, then awaits function(). Returns its result'''
+        await self._acquire(priority)
+        started = time.monotonic()
+        try:
+            return await function()
+        finally:
+            self._service_time = 0.9 * self._service_time + 0.1 * (time.monotonic() - started)
+            self._release()
+
+    async def _acquire(self, priority):
+        '''Waits until a slot is free and nobody more important is waiting for it'''
+        if self._running < self.slots and not self.waiting():
+            self._running += 1
+            self.admitted += 1
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # If we were handed a slot just as we were cancelled, pass it on
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        self.admitted += 1
+
+    def resize(self, slots):
+        '''Changes how many writes may run at once
+
+        Growing lets waiting writes in straight away. Shrinking never interrupts anything;
+        slots are just not handed on as running writes finish until we're under the new
+        limit'''
+        self.slots = slots
+        while self._running < self.slots and self._wake_next():
+            self._running += 1
+
+    def _release(self):
+        '''Gives the slot to whoever's next in line, or frees it'''
+        if self._running <= self.slots and self._wake_next():
+            return
+        self._running -= 1
+
+    def _wake_next(self):
+        '''Hands a slot to the most important waiter. Returns False if nobody's waiting'''
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                future.set_result(None)
+                return True
+        return False
@@ -5,7 +5,13 @@ Created on Sep 19, 2015
 '''
 
 import asyncio
-from asyncio import futures
+import sys
+import time
+from socket import AF_INET, AF_INET6
+from dynipd.datastore_errors import DataStoreError
+from dynipd.network_block import NetworkBlockFull
+from dynipd.server.admission import PRIORITY_NEW, PRIORITY_RENEWAL
+from dynipd.server.machine import Machine
 
 def test():
     return b'test\n'
@@ -16,57 +22,311 @@ def test2(autheticated):
 protocol_verbs = {'TEST': test,
                   'TEST2': test2}
 
+# Verbs requests are counted under in the metrics; anything else is UNKNOWN
+COMMAND_VERBS = frozenset(['SUBSCRIBE', 'RESERVE', 'RENEW', 'RELEASE', 'STATS',
+                           'UNSUBSCRIBE'] + list(protocol_verbs))
+
+# Largest number of IPs (or allocations) a single RESERVE, RENEW or RELEASE may ask for
+MAX_BATCH_RESERVATION = 1024
+
 class AsyncServerHandler(object):
-    def __init__(self, reader, writer, mysql_data_store):
+    def __init__(self, reader, writer, server_state):
         self.reader = reader
         self.writer = writer
-        self.mysql_data_store = mysql_data_store
+        self.server_state = server_state
+        self.mysql_data_store = server_state.datastore
         self.loop = asyncio.get_event_loop()
 
+        # Set when the client sends SUBSCRIBE; events are pushed by _push_events
+        self.subscription = None
+        self._push_task = None
+
+        # Updated on every line read; IdleReaper closes us if this gets too old
+        self.last_activity = time.monotonic()
+
+        # True while a command is being processed. A draining server closes connections
+        # between commands, never in the middle of one
+        self.busy = False
+
 
     def run(self):
         pass
 
-    @asyncio.coroutine
-    def handle_inbound_connection(self):
+    async def handle_inbound_connection(self):
         '''Handles connection and authetication state'''
-        authetication = False
+        self.server_state.idle_reaper.register(self)
+        try:
+            await self._process_commands()
+        finally:
+            self.server_state.idle_reaper.unregister(self)
+            self._unsubscribe()
+            self.writer.close()
+
+    def is_idle_exempt(self):
+        '''Subscribed clients are expected to sit idle waiting for events'''
+        return self.subscription is not None
 
-        print ('here')
+    def close_idle(self):
+        '''Called by IdleReaper when the client has timed out
+
+        Closing the transport feeds EOF to our reader, so _process_commands winds down through
+        its normal path.'''
+        self.writer.close()
+
+    async def _process_commands(self):
+        '''Reads and dispatches commands until the client leaves or times out'''
+        authetication = False
 
         # If we can process connections, send OK code
         self.writer.write(b'200 Go Ahead\n')
-        yield from self.writer.drain()
+        await self.writer.drain()
 
         while True:
+            self.busy = False
+            if self.server_state.draining:
+                # We're handing over to a new process; the client will reconnect to it
+                return
+
+            # Idle timeouts are handled by the IdleReaper closing the connection on us, which
+            # turns up here as EOF
             data = None
             try:
-                data = yield from asyncio.wait_for(self.reader.readline(), 10.0)
-            except futures.TimeoutError:
-                # Client timed out
-                self.writer.close()
+                data = await self.reader.readline()
+            except ConnectionError:
                 return
 
-            if data is None:
-                self.writer.close()
+            if not data:
+                # EOF, client went away or timed out
                 return
 
+            self.last_activity = started = time.monotonic()
+            self.busy = True
+
             # Loose the newline, and figure out our verb
             command_line = str(data.decode()).rstrip()
             verb = str(command_line).split(sep=" ")
 
-            command_function = None
-            if verb[0] in protocol_verbs:
-                command_function = protocol_verbs[verb[0]]
+            # Authetication is a special case, and doesn't get a response, even if something
+            # goes wrong; the client isn't expecting one
+            response = None
+            if verb[0] in protocol_verbs and protocol_verbs[verb[0]] == test2:
+                authetication = True
+            else:
+                # A datastore that's struggling shouldn't cost the client its connection;
+                # tell it to come back later, or that something broke, and carry on
+                try:
+                    response = await self._run_command(authetication, verb)
+                except DataStoreError as error:
+                    sys.stderr.write('%s failed: %s\n' % (verb[0], error))
+                    response = b'503 Busy retry-after=%d\n' % (
+                        self.server_state.admission.retry_after(),)
+                except Exception as error: # pylint: disable=broad-except
+                    sys.stderr.write('%s failed: %r\n' % (verb[0], error))
+                    response = b'500 Internal error\n'
 
-            # testing
-            future1 = self.loop.run_in_executor(None, self.mysql_data_store.load_network_topogoly)
-            yield from future1
+            if response is not None:
+                self.writer.write(response)
+                await self.writer.drain()
 
-            # Authetication is a special case
-            if command_function == test2:
-                authetication = True
-                continue
+            # The client may have been waiting on us for a while; it isn't idle until it's
+            # had its answer
+            self.last_activity = time.monotonic()
+
+            # Anything a client makes up is counted under one label, so it can't blow up the
+            # number of series we keep
+            self.server_state.metrics.record_request(
+                verb[0] if verb[0] in COMMAND_VERBS else 'UNKNOWN',
+                self.last_activity - started)
+
+    async def _run_command(self, authetication, verb):
+        '''Runs a command other than TEST2. Returns the response line'''
+        # SUBSCRIBE switches the connection into push mode, so it's handled here rather
+        # than through protocol_verbs
+        if verb[0] == 'SUBSCRIBE':
+            return await self._subscribe(authetication, verb[1:])
+        if verb[0] == 'RESERVE':
+            return await self._reserve(authetication, verb[1:])
+        if verb[0] == 'RENEW':
+            return await self._renew(authetication, verb[1:])
+        if verb[0] == 'RELEASE':
+            return await self._release(authetication, verb[1:])
+        if verb[0] == 'STATS':
+            return self._stats()
+        if verb[0] == 'UNSUBSCRIBE':
+            self._unsubscribe()
+            return b'200 Unsubscribed\n'
+        if verb[0] not in protocol_verbs:
+            return b'400 Unknown command\n'
+        return protocol_verbs[verb[0]]()
+
+    async def _subscribe(self, authetication, arguments):
+        '''Handles SUBSCRIBE <machine> [location]. Returns the response line'''
+        if not authetication:
+            return b'401 Not authenticated\n'
+
+        if self.subscription:
+            return b'409 Already subscribed\n'
+
+        if len(arguments) not in (1, 2) or not arguments[0]:
+            return b'400 Usage: SUBSCRIBE <machine> [location]\n'
+
+        machine_name = arguments[0]
+        location = arguments[1] if len(arguments) == 2 else None
+
+        # Make sure this is a machine we know about before listening on its behalf
+        machine_dict = await self.server_state.reads.get_machine(machine_name)
+        if machine_dict is None:
+            return b'404 Unknown machine\n'
+
+        self.subscription = self.server_state.event_bus.subscribe(machine_name, location)
+        self._push_task = asyncio.ensure_future(self._push_events(self.subscription))
+        return b'200 Subscribed\n'
+
+    async def _reserve(self, authetication, arguments):
+        '''Handles RESERVE <machine> <location> <4|6> <count>. Returns the response line
+
+        Reserves count IPs in one go, and answers with every allocation carved and the IPs
+        reserved within it:
+
+            200 10.0.2.4/30=10.0.2.5,10.0.2.6 10.0.2.8/30=10.0.2.9
+        '''
+        if not authetication:
+            return b'401 Not authenticated\n'
+
+        usage = b'400 Usage: RESERVE <machine> <location> <4|6> <count>\n'
+        if len(arguments) != 4:
+            return usage
+
+        machine_name, location, family_name, count = arguments
+        family = {'4': AF_INET, '6': AF_INET6}.get(family_name)
+        try:
+            count = int(count)
+        except ValueError:
+            return usage
+
+        if family is None or count < 1 or count > MAX_BATCH_RESERVATION:
+            return usage
+
+        if await self.server_state.reads.get_machine(machine_name) is None:
+            return b'404 Unknown machine\n'
+
+        # Turn new requests away before they join the queue if we're swamped; the client
+        # retries after the hint, with jitter. There must be no await between this and run()
+        admission = self.server_state.admission
+        if admission.should_shed(PRIORITY_NEW):
+            return b'503 Busy retry-after=%d\n' % admission.retry_after()
+
+        def reserve_ips():
+            '''Runs on the executor; Machine() hits the database too'''
+            machine = Machine(machine_name, self.mysql_data_store)
+            return self.mysql_data_store.reserve_ips(machine, location, family, count)
+
+        try:
+            carved = await admission.run(PRIORITY_NEW, lambda: self.loop.run_in_executor(
+                self.server_state.executor, reserve_ips))
+        except NetworkBlockFull:
+            return b'409 Not enough free IPs in location\n'
+
+        reservations = ['%s=%s' % (allocation.get_allocation_cidr(),
+                                   ','.join(str(ip_address) for ip_address in ip_addresses))
+                        for allocation, ip_addresses in carved]
+        return ('200 %s\n' % ' '.join(reservations)).encode()
+
+    async def _renew(self, authetication, arguments):
+        '''Handles RENEW <machine> <ip> [ip ...]. Returns the response line
+
+        Pushes back the deadline of IPs the machine has reserved. Renewals are served ahead
+        of new reservations, and are never turned away for being busy, since a machine that
+        misses its renewal loses IPs it may already be using. The IPs that were renewed are
+        listed; any others asked about are no longer the machine's:
+
+            200 Renewed 2 10.0.2.5 10.0.2.6
+        '''
+        if not authetication:
+            return b'401 Not authenticated\n'
+
+        if len(arguments) < 2 or len(arguments) > MAX_BATCH_RESERVATION + 1:
+            return b'400 Usage: RENEW <machine> <ip> [ip ...]\n'
+
+        machine_name, ip_addresses = arguments[0], arguments[1:]
+        if await self.server_state.reads.get_machine(machine_name) is None:
+            return b'404 Unknown machine\n'
+
+        def renew_reservations():
+            '''Runs on the executor'''
+            machine = Machine(machine_name, self.mysql_data_store)
+            return self.mysql_data_store.renew_reservations(machine, ip_addresses)
+
+        try:
+            renewed = await self.server_state.admission.run(
+                PRIORITY_RENEWAL,
+                lambda: self.loop.run_in_executor(self.server_state.executor,
+                                                  renew_reservations))
+        except ValueError:
+            return b'400 Invalid IP address\n'
+
+        return ('%s\n' % ' '.join(['200 Renewed %d' % len(renewed)] + renewed)).encode()
+
+    async def _release(self, authetication, arguments):
+        '''Handles RELEASE <machine> <allocation> [allocation ...]. Returns the response line
+
+        Hands whole allocations, and every IP reserved in them, back to the pool straight
+        away rather than leaving them to expire. Like renewals, releases only ever free
+        space, so they go ahead of new reservations and are never turned away:
+
+            200 Released 2
+        '''
+        if not authetication:
+            return b'401 Not authenticated\n'
+
+        if len(arguments) < 2 or len(arguments) > MAX_BATCH_RESERVATION + 1:
+            return b'400 Usage: RELEASE <machine> <allocation> [allocation ...]\n'
+
+        machine_name, allocation_cidrs = arguments[0], arguments[1:]
+        if await self.server_state.reads.get_machine(machine_name) is None:
+            return b'404 Unknown machine\n'
+
+        def release_allocations():
+            '''Runs on the executor'''
+            machine = Machine(machine_name, self.mysql_data_store)
+            return self.mysql_data_store.release_allocations(machine, allocation_cidrs)
+
+        try:
+            released = await self.server_state.admission.run(
+                PRIORITY_RENEWAL,
+                lambda: self.loop.run_in_executor(self.server_state.executor,
+                                                  release_allocations))
+        except ValueError:
+            return b'400 Invalid allocation\n'
+
+        return b'200 Released %d\n' % released
+
+    def _stats(self):
+        '''Handles STATS. Reports executor and pool statistics as key=value pairs'''
+        stats = self.server_state.get_stats()
+        pairs = ['%s=%s' % (key, value) for key, value in sorted(stats.items())]
+        return ('200 %s\n' % ' '.join(pairs)).encode()
+
+    async def _push_events(self, subscription):
+        '''Writes events from the bus to the client as they arrive
+
+        Events are sent as EVENT <type> <detail>. Responses to commands always start with
+        a status code, so clients can tell the two apart on the same connection.'''
+        try:
+            while True:
+                event_type, detail = await subscription.get()
+                self.writer.write(('EVENT %s %s\n' % (event_type, detail)).encode())
+                await self.writer.drain()
+        except ConnectionError:
+            # The command loop will notice the connection is gone and clean up
+            return
+
+    def _unsubscribe(self):
+        '''Stops pushing events to this connection'''
+        if self._push_task:
+            self._push_task.cancel()
+            self._push_task = None
 
-            print (authetication)
-            self.writer.write(command_function())
+        if self.subscription:
+            self.server_state.event_bus.unsubscribe(self.subscription)
+            self.subscription = None
@@ -0,0 +1,129 @@
+'''
+DynIPD - In-process event bus for server pushed notifications
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import threading
+
+# Event types pushed to subscribers. These go over the wire as-is
+EVENT_ALLOCATION_ASSIGNED = 'ALLOCATION_ASSIGNED'
+EVENT_ALLOCATION_RELEASED = 'ALLOCATION_RELEASED'
+EVENT_RESERVATION_EXPIRED = 'RESERVATION_EXPIRED'
+EVENT_TOPOLOGY_CHANGED = 'TOPOLOGY_CHANGED'
+
+# Sent in place of the events we had to drop when a subscriber falls too far behind. The client
+# needs to requery to find out what it missed
+EVENT_OVERFLOW = 'OVERFLOW'
+
+class Subscription(object):
+    '''A single subscriber's view of the EventBus
+
+    Subscriptions are created by EventBus.subscribe(), and must be created from the event loop
+    that will consume them. Events are queued on that loop regardless of which thread
+    published them.
+    '''
+
+    def __init__(self, machine_name, location, max_queued_events):
+        self.machine_name = machine_name
+        self.location = location
+        self.loop = asyncio.get_event_loop()
+        self.overflowed = False
+        self._queue = asyncio.Queue(maxsize=max_queued_events)
+
+    async def get(self):
+        '''Waits for the next event, returned as an (event_type, detail) tuple'''
+        event = await self._queue.get()
+        if event is None:
+            # _deliver hit a full queue, tell the client to resync rather than silently
+            # lose events
+            self.overflowed = False
+            return (EVENT_OVERFLOW, self.machine_name)
+
+        return event
+
+    def _deliver(self, event):
+        '''Queues an event. Always called on self.loop'''
+        if self.overflowed:
+            return
+
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Throw away the backlog; the client gets a single OVERFLOW instead
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self.overflowed = True
+            self._queue.put_nowait(None)
+
+class EventBus(object):
+    '''Fans out allocation and topology events to every interested subscriber
+
+    There's one EventBus per process. The datastore publishes to it as state changes (normally
+    from an executor thread), and AsyncServerHandler subscribes on behalf of clients that sent
+    SUBSCRIBE. Subscribers are indexed by machine name and location so publishing an event only
+    touches the connections that care about it, no matter how many are connected.
+    '''
+
+    def __init__(self, max_queued_events=256):
+        self._max_queued_events = max_queued_events
+        self._lock = threading.Lock()
+        self._by_machine = {}
+        self._by_location = {}
+
+    def subscribe(self, machine_name, location=None):
+        '''Subscribes to events for a machine, and optionally topology changes in its location'''
+        subscription = Subscription(machine_name, location, self._max_queued_events)
+
+        with self._lock:
+            self._by_machine.setdefault(machine_name, set()).add(subscription)
+            if location is not None:
+                self._by_location.setdefault(location, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        '''Removes a subscription. Safe to call more than once'''
+        with self._lock:
+            self._discard(self._by_machine, subscription.machine_name, subscription)
+            if subscription.location is not None:
+                self._discard(self._by_location, subscription.location, subscription)
+
+    def publish_machine_event(self, machine_name, event_type, detail):
+        '''Sends an event to everyone subscribed to machine_name'''
+        with self._lock:
+            subscriptions = list(self._by_machine.get(machine_name, ()))
+        self._fan_out(subscriptions, (event_type, detail))
+
+    def publish_location_event(self, location, event_type, detail):
+        '''Sends an event to everyone subscribed to location'''
+        with self._lock:
+            subscriptions = list(self._by_location.get(location, ()))
+        self._fan_out(subscriptions, (event_type, detail))
+
+    def subscriber_count(self):
+        '''Returns the number of active subscriptions'''
+        with self._lock:
+            return sum(len(subs) for subs in self._by_machine.values())
+
+    @staticmethod
+    def _fan_out(subscriptions, event):
+        '''Hands the event to each subscriber's event loop'''
+        for subscription in subscriptions:
+            if subscription.loop.is_closed():
+                continue
+            subscription.loop.call_soon_threadsafe(subscription._deliver, event) # pylint: disable=protected-access
+
+    @staticmethod
+    def _discard(index, key, subscription):
+        '''Removes a subscription from one of our indexes, dropping empty keys'''
+        subscriptions = index.get(key)
+        if subscriptions is None:
+            return
+
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del index[key]
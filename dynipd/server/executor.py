@@ -0,0 +1,77 @@
+'''
+DynIPD - Instrumented executor for blocking datastore calls
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class DatastoreExecutor(ThreadPoolExecutor):
+    '''Thread pool for blocking datastore calls, sized to the database connection pool
+
+    Every thread will want a connection, so there's no point in having more threads than
+    connections; they'd just block in the datastore's checkout. Keeping the two the same size
+    means work queues here instead, where we can see it.
+
+    Use get_stats() to find out how deep the queue is, and how long work waited in it.
+    '''
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers, thread_name_prefix='dynipd-datastore')
+        self.max_workers = max_workers
+        self._stats_lock = threading.Lock()
+        self._stats = {'queued': 0,
+                       'active': 0,
+                       'completed': 0,
+                       'queue_wait_total': 0.0,
+                       'queue_wait_max': 0.0}
+
+    def submit(self, fn, *args, **kwargs):
+        '''Queues fn(*args, **kwargs), recording how long it sits before a thread picks it up'''
+        with self._stats_lock:
+            self._stats['queued'] += 1
+
+        future = super().submit(self._run_instrumented, time.monotonic(), fn, *args, **kwargs)
+        future.add_done_callback(self._check_cancelled)
+        return future
+
+    def get_stats(self):
+        '''Returns a copy of the executor statistics
+
+        Keys:
+            max_workers - size of the thread pool
+            queued - calls waiting for a thread
+            active - calls currently running
+            completed - calls that have finished, successfully or not
+            queue_wait_total, queue_wait_max - seconds calls spent waiting for a thread
+        '''
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['max_workers'] = self.max_workers
+        return stats
+
+    def _run_instrumented(self, submitted, fn, *args, **kwargs):
+        '''Runs on the worker thread; wraps fn with the bookkeeping'''
+        waited = time.monotonic() - submitted
+        with self._stats_lock:
+            self._stats['queued'] -= 1
+            self._stats['active'] += 1
+            self._stats['queue_wait_total'] += waited
+            self._stats['queue_wait_max'] = max(self._stats['queue_wait_max'], waited)
+
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._stats_lock:
+                self._stats['active'] -= 1
+                self._stats['completed'] += 1
+
+    def _check_cancelled(self, future):
+        '''Calls cancelled while queued never reach _run_instrumented, so uncount them here'''
+        if future.cancelled():
+            with self._stats_lock:
+                self._stats['queued'] -= 1
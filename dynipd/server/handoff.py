@@ -0,0 +1,175 @@
+'''
+DynIPD - Listening socket handoff for zero downtime restarts
+
+A restart used to close both listeners, and every client reconnected at the same moment. Instead,
+a running dynipd listens on a Unix control socket, and a new dynipd started with --takeover
+asks it for the listening sockets. They're passed over with SCM_RIGHTS, so both processes share
+the same kernel sockets and connections keep queueing on them the entire time. The exchange is:
+
+    new -> old  HANDOFF
+    old -> new  SOCKETS <n>, with the n listening sockets attached
+    new -> old  READY (sent once the new process is accepting)
+    old -> new  DONE (the control socket has been released for the new process to bind)
+
+After DONE, the old process stops accepting, drains its connections and exits.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import os
+import socket
+
+class HandoffError(Exception):
+    '''The listening sockets could not be handed over'''
+    def __init__(self, value):
+        super(HandoffError, self).__init__(value)
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+def take_over_listening_sockets(path, timeout=30.0):
+    '''Asks the dynipd listening on path for its listening sockets
+
+    Returns a tuple of (list of sockets, control connection). Once the new server is accepting
+    connections, pass the control connection to complete_takeover().
+
+    Raises:
+        HandoffError - the running server refused, or sent something we didn't expect
+    '''
+    control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    control.settimeout(timeout)
+
+    try:
+        control.connect(path)
+        control.sendall(b'HANDOFF\n')
+        message, fds, _, _ = socket.recv_fds(control, 1024, 16)
+    except OSError as error:
+        control.close()
+        raise HandoffError('Unable to get sockets from %s: %s' % (path, error))
+
+    words = message.decode().split()
+    if len(words) != 2 or words[0] != 'SOCKETS' or int(words[1]) != len(fds):
+        for fd in fds:
+            os.close(fd)
+        control.close()
+        raise HandoffError('Unexpected handoff response %r' % (message,))
+
+    # socket.socket works out the family and type from the descriptor itself
+    return ([socket.socket(fileno=fd) for fd in fds], control)
+
+def complete_takeover(control):
+    '''Tells the old server we're accepting, and waits for it to let go of the control socket
+
+    Raises:
+        HandoffError - the old server didn't confirm
+    '''
+    try:
+        control.sendall(b'READY\n')
+        response = _read_line_blocking(control)
+    except OSError as error:
+        raise HandoffError('Handoff did not complete: %s' % (error,))
+    finally:
+        control.close()
+
+    if response != 'DONE':
+        raise HandoffError('Unexpected handoff response %r' % (response,))
+
+class HandoffServer(object):
+    '''Serves our listening sockets to a replacement dynipd over a Unix socket
+
+    on_handoff is called once the replacement has confirmed it is accepting connections; at
+    that point this process should stop accepting and drain.
+    '''
+
+    def __init__(self, path, listening_sockets, on_handoff, timeout=30.0):
+        self.path = path
+        self.listening_sockets = listening_sockets
+        self.on_handoff = on_handoff
+        self.timeout = timeout
+        self._control = None
+
+    async def serve(self):
+        '''Accepts handoff requests until one succeeds'''
+        loop = asyncio.get_event_loop()
+
+        # A stale socket file is left behind if we were killed; nobody else can be using it
+        # because the new process binds it only after we've told it we're done
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self._control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._control.bind(self.path)
+        self._control.listen(1)
+        self._control.setblocking(False)
+
+        try:
+            while True:
+                connection, _ = await loop.sock_accept(self._control)
+                try:
+                    handed_off = await asyncio.wait_for(self._handle(connection), self.timeout)
+                except (asyncio.TimeoutError, OSError):
+                    # The replacement died or wedged halfway; keep serving ourselves
+                    handed_off = False
+                finally:
+                    connection.close()
+
+                if handed_off:
+                    self.on_handoff()
+                    return
+        finally:
+            self.close()
+
+    def close(self):
+        '''Stops listening for handoff requests and removes the socket file'''
+        if self._control is not None:
+            self._control.close()
+            self._control = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _handle(self, connection):
+        '''Runs a single handoff exchange. Returns True if the replacement took over'''
+        loop = asyncio.get_event_loop()
+
+        request = await _read_line(loop, connection)
+        if request != 'HANDOFF':
+            await loop.sock_sendall(connection, b'ERROR\n')
+            return False
+
+        # The message is tiny, so this won't block even on a non-blocking socket
+        message = ('SOCKETS %d\n' % len(self.listening_sockets)).encode()
+        socket.send_fds(connection, [message],
+                        [listener.fileno() for listener in self.listening_sockets])
+
+        if await _read_line(loop, connection) != 'READY':
+            return False
+
+        # Free the path up before saying DONE, the replacement binds it straight away
+        self.close()
+        await loop.sock_sendall(connection, b'DONE\n')
+        return True
+
+async def _read_line(loop, connection):
+    '''Reads a single line from a non-blocking socket'''
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = await loop.sock_recv(connection, 1024)
+        if not chunk:
+            break
+        data += chunk
+
+    return data.decode().strip()
+
+def _read_line_blocking(connection):
+    '''Reads a single line from a blocking socket'''
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = connection.recv(1024)
+        if not chunk:
+            break
+        data += chunk
+
+    return data.decode().strip()
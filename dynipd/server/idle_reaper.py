@@ -0,0 +1,84 @@
+'''
+DynIPD - Idle connection reaper
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import time
+
+class IdleReaper(object):
+    '''Closes connections that have been quiet for longer than idle_timeout
+
+    Wrapping every readline() in asyncio.wait_for() creates and cancels a timer and a task
+    per line, which adds up fast with lots of persistent connections. Instead, each connection
+    just stamps last_activity when it reads something, and a single task sweeps them all every
+    interval seconds. A connection is closed somewhere between idle_timeout and
+    idle_timeout + interval seconds after it went quiet, which is plenty accurate for this.
+
+    A connection in the middle of a command (busy) is never closed, however long the command
+    takes; a RESERVE stuck behind admission control may already have written to the
+    database, and the client needs to hear about it. The clock starts again once the
+    response has gone out.
+
+    Connections are anything with last_activity and busy attributes, an is_idle_exempt()
+    method and a close_idle() method; in practice, AsyncServerHandler.
+    '''
+
+    def __init__(self, idle_timeout=10.0, interval=1.0):
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self.reaped = 0
+        self._connections = set()
+        self._task = None
+
+    def register(self, connection):
+        '''Starts tracking a connection, and starts sweeping if we weren't already'''
+        connection.last_activity = time.monotonic()
+        self._connections.add(connection)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def unregister(self, connection):
+        '''Stops tracking a connection. Sweeping stops with the last one'''
+        self._connections.discard(connection)
+        if not self._connections:
+            self.stop()
+
+    def connections(self):
+        '''Returns a list of the connections being tracked'''
+        return list(self._connections)
+
+    def connection_count(self):
+        '''Returns the number of connections being tracked'''
+        return len(self._connections)
+
+    def stop(self):
+        '''Stops sweeping'''
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def sweep(self):
+        '''Closes every connection that's been idle too long. Returns how many were closed'''
+        deadline = time.monotonic() - self.idle_timeout
+
+        idle = [connection for connection in self._connections
+                if connection.last_activity < deadline and not connection.busy and
+                not connection.is_idle_exempt()]
+
+        for connection in idle:
+            self._connections.discard(connection)
+            connection.close_idle()
+
+        self.reaped += len(idle)
+        return len(idle)
+
+    async def _run(self):
+        '''Sweeps every interval seconds until stopped'''
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sweep()
@@ -33,6 +33,10 @@ class Machine(object):
         # FIXME, make sure we don't add an allocation twice
         self._allocations.append(ip_allocation)
 
+    def _add_allocation_association(self, ip_allocation):
+        '''Associates an allocation without touching the database. The caller persists it'''
+        self._allocations.append(ip_allocation)
+
     def list_allocations(self):
         '''Returns a copy of the allocations with this Machine'''
         return self._allocations.copy()
@@ -0,0 +1,295 @@
+'''
+DynIPD - Prometheus metrics for the server's hot paths
+
+Metrics are served in the Prometheus text format over plain HTTP on their own (local) port,
+so scraping never competes with clients for the protocol port. Everything is kept as running
+counters and histograms; a scrape only formats what's already there.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import bisect
+import threading
+import time
+
+# Upper bounds, in seconds, of histogram buckets. Everything dynipd times is somewhere
+# between a cached read (well under a millisecond) and a checkout timeout (seconds)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+def _format_labels(label_names, label_values, extra=None):
+    '''Returns {name="value",...} for a sample, or an empty string if there are no labels'''
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs)
+
+def _format_value(value):
+    '''Formats a sample value the way Prometheus expects'''
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter(object):
+    '''A count that only goes up, per set of label values'''
+
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, label_names, lock):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = lock
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        '''Adds amount for the given label values'''
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        '''Returns the current count for the given label values'''
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def samples(self):
+        '''Returns [(suffix, label values, extra label, value)] for rendering'''
+        with self._lock:
+            return [('', labels, None, value) for labels, value in sorted(self._values.items())]
+
+class Histogram(object):
+    '''Observations counted into cumulative buckets, per set of label values'''
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names, lock, buckets=DEFAULT_BUCKETS):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = lock
+
+        # label values -> [per-bucket counts (the last one is +Inf), sum]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        '''Records an observation for the given label values'''
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets)+1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def get_count(self, *label_values):
+        '''Returns how many observations there have been for the given label values'''
+        with self._lock:
+            entry = self._values.get(label_values)
+            return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        '''Returns [(suffix, label values, extra label, value)] for rendering'''
+        with self._lock:
+            values = [(labels, list(counts), total)
+                      for labels, (counts, total) in sorted(self._values.items())]
+
+        samples = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', labels, ('le', _format_value(float(bound))),
+                                cumulative))
+            samples.append(('_sum', labels, None, total))
+            samples.append(('_count', labels, None, cumulative))
+        return samples
+
+class Gauge(object):
+    '''A value read when scraped
+
+    The collect function returns {label values: value}. It runs on every scrape, so it
+    must only read values that are already being kept up to date, never go looking for
+    them.'''
+
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, label_names, collect):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._collect = collect
+
+    def samples(self):
+        '''Returns [(suffix, label values, extra label, value)] for rendering'''
+        return [('', labels, None, value) for labels, value in sorted(self._collect().items())]
+
+class MetricsRegistry(object):
+    '''Holds metrics, and renders them in the Prometheus text exposition format
+
+    Counters and histograms are updated from the event loop and the executor threads
+    alike, so they share a lock.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def counter(self, name, documentation, label_names=()):
+        '''Adds and returns a Counter'''
+        return self._register(Counter(name, documentation, label_names, self._lock))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        '''Adds and returns a Histogram'''
+        return self._register(Histogram(name, documentation, label_names, self._lock,
+                                        buckets))
+
+    def gauge(self, name, documentation, collect, label_names=()):
+        '''Adds and returns a Gauge whose values come from collect(); see Gauge'''
+        return self._register(Gauge(name, documentation, label_names, collect))
+
+    def render(self):
+        '''Returns every metric in the text exposition format'''
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.metric_type))
+            for suffix, labels, extra, value in metric.samples():
+                lines.append('%s%s%s %s' % (metric.name, suffix,
+                                            _format_labels(metric.label_names, labels, extra),
+                                            _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        '''Adds a metric, refusing duplicate names'''
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError('%s is already registered' % metric.name)
+        self._metrics.append(metric)
+        return metric
+
+class ServerMetrics(object):
+    '''The metrics dynipd keeps about itself
+
+    AsyncServerHandler times commands into requests and request_duration; MySQLDataStore
+    times statements into query_duration and connection checkouts into checkout_wait;
+    watch_event_loop() measures event loop lag. track_server_state() adds the gauges read
+    from the running server (connections, admission queue, and NetworkBlock allocations,
+    which NetworkBlock counts as it carves and releases them).
+    '''
+
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        registry = self.registry
+
+        self.requests = registry.counter('dynipd_requests_total',
+                                         'Protocol commands handled', ('verb',))
+        self.request_duration = registry.histogram(
+            'dynipd_request_duration_seconds',
+            'Seconds from reading a command to writing its response', ('verb',))
+        self.query_duration = registry.histogram(
+            'dynipd_datastore_query_duration_seconds',
+            'Seconds a datastore statement held its database connection', ('statement',))
+        self.checkout_wait = registry.histogram(
+            'dynipd_pool_checkout_wait_seconds',
+            'Seconds spent waiting for a database connection')
+        self.checkout_timeouts = registry.counter(
+            'dynipd_pool_checkout_timeouts_total',
+            'Connection checkouts that gave up waiting')
+        self.loop_lag = registry.histogram(
+            'dynipd_event_loop_lag_seconds',
+            'Seconds the event loop woke up late by, sampled periodically')
+
+    def record_request(self, verb, seconds):
+        '''Counts and times one protocol command'''
+        self.requests.inc(verb)
+        self.request_duration.observe(seconds, verb)
+
+    def record_query(self, statement, seconds):
+        '''Times one datastore statement. Called from executor threads'''
+        self.query_duration.observe(seconds, statement)
+
+    def record_checkout(self, waited, timed_out=False):
+        '''Records how long a connection checkout waited. Called from executor threads'''
+        self.checkout_wait.observe(waited)
+        if timed_out:
+            self.checkout_timeouts.inc()
+
+    def track_server_state(self, server_state):
+        '''Adds the gauges read from a running server'''
+        registry = self.registry
+        registry.gauge('dynipd_connections', 'Client connections currently open',
+                       lambda: {(): server_state.idle_reaper.connection_count()})
+        registry.gauge('dynipd_admission_waiting',
+                       'Datastore writes waiting for an executor slot',
+                       lambda: {(): server_state.admission.waiting()})
+        registry.gauge('dynipd_executor_queued', 'Datastore calls waiting for a thread',
+                       lambda: {(): server_state.executor.get_stats()['queued']
+                                if server_state.executor is not None else 0})
+
+        def network_gauge(attribute):
+            '''Reads a NetworkBlock counter for every network'''
+            def collect():
+                return {(network.get_name(), network.location): getattr(network, attribute)
+                        for network in server_state.datastore.get_networks()}
+            return collect
+
+        registry.gauge('dynipd_network_allocations_used', 'Allocations handed out of a network',
+                       network_gauge('allocations_used'), ('network', 'location'))
+        registry.gauge('dynipd_network_allocations_free', 'Allocations left in a network',
+                       network_gauge('allocations_free'), ('network', 'location'))
+
+    async def watch_event_loop(self, interval=0.5):
+        '''Measures how late the event loop runs a sleep of interval seconds, until cancelled
+
+        Anything blocking the loop (a slow callback, a datastore call that should have gone
+        to the executor) shows up here as lag'''
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, time.monotonic() - started - interval))
+
+async def start_metrics_server(metrics, host='127.0.0.1', port=9888, reuse_port=False):
+    '''Serves GET /metrics from metrics on host:port. Returns the asyncio server
+
+    This is just enough HTTP/1.0 for a Prometheus scraper or curl; one request per
+    connection. reuse_port lets a new dynipd bind the port while the one it's taking over
+    from still has it'''
+    async def handle_scrape(reader, writer):
+        '''Reads one request, answers it and hangs up'''
+        try:
+            request_line = await reader.readline()
+
+            # Skip the headers; we don't need any of them
+            while True:
+                header = await reader.readline()
+                if not header or header in (b'\r\n', b'\n'):
+                    break
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status = '200 OK'
+                body = metrics.registry.render().encode()
+            else:
+                status = '404 Not Found'
+                body = b'Not found\n'
+
+            writer.write(('HTTP/1.0 %s\r\n'
+                          'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                          'Content-Length: %d\r\n\r\n' % (status, len(body))).encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_scrape, host, port, reuse_port=reuse_port)
@@ -0,0 +1,142 @@
+'''
+DynIPD - Reloading configuration without a restart
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import configparser
+import functools
+from dynipd.config_parser import ConfigurationParser
+
+# Settings only read when dynipd starts; a changed one is reported as needing a restart
+# (or a handoff to a new process), and left as it was until then
+RESTART_REQUIRED = ('metrics_host', 'metrics_port')
+
+class ReloadError(Exception):
+    '''The configuration couldn't be reloaded; the running settings are unchanged'''
+    def __init__(self, value):
+        super(ReloadError, self).__init__(value)
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class ConfigurationReloader(object):
+    '''Re-reads the configuration file and applies whatever changed, in place
+
+    dynipd.py calls reload() on SIGHUP. Nothing here closes a listening socket or a client
+    connection:
+
+        pool_size, database settings - the datastore builds a new connection pool and the
+                                       server state a new executor; work already running
+                                       finishes on the old ones
+        checkout_timeout, read_freshness, idle_timeout, max_queued_requests - just updated
+        listen_backlog - listen() is called again on the listening sockets, which Linux
+                         takes as a new backlog
+        drain_timeout - updated in server_cfg, which the handoff code reads when it's needed
+
+    Where the metrics are served (RESTART_REQUIRED) can't be changed this way.
+    The topology is then refreshed incrementally, so networks added, changed or removed in
+    the database are picked up without forgetting what's carved out of the rest.
+    '''
+
+    def __init__(self, configuration_file, server_state, server_cfg, database_cfg,
+                 listening_sockets=None):
+        # pylint: disable=too-many-arguments
+        self.configuration_file = configuration_file
+        self.server_state = server_state
+        self.listening_sockets = listening_sockets or []
+
+        # These are updated in place, so anyone else holding them sees the new settings
+        self.server_cfg = server_cfg
+        self.database_cfg = database_cfg
+
+        self.reloads = 0
+        self._lock = asyncio.Lock()
+
+    async def reload(self):
+        '''Reloads the configuration file. Returns what changed
+
+        The result has a 'settings' dict of {key: (old value, new value)} for what was
+        applied, a 'restart_required' dict the same for what wasn't (see RESTART_REQUIRED),
+        and a 'topology' dict as returned by refresh_network_topogoly().
+
+        Raises:
+            ReloadError - the file couldn't be read or is invalid, or the datastore couldn't
+                          be switched to the new settings. Nothing has been changed
+        '''
+        # Two SIGHUPs in a row shouldn't apply the same changes over the top of each other
+        async with self._lock:
+            server_cfg, database_cfg = self._read_configuration()
+            settings = diff_settings(self.server_cfg, server_cfg)
+            restart_required = {key: settings.pop(key) for key in RESTART_REQUIRED
+                                if key in settings}
+            settings.update(diff_settings(self.database_cfg, database_cfg, prefix='database.',
+                                          hide=('password',)))
+
+            loop = asyncio.get_event_loop()
+            state = self.server_state
+
+            # The datastore goes first; if it can't reach the new database, we stop here with
+            # nothing changed
+            database_changed = database_cfg != self.database_cfg
+            if database_changed or 'pool_size' in settings or 'checkout_timeout' in settings:
+                reconfigure = functools.partial(
+                    state.datastore.reconfigure,
+                    db_info_dict=database_cfg if database_changed else None,
+                    pool_size=server_cfg['pool_size'] if 'pool_size' in settings else None,
+                    checkout_timeout=server_cfg['checkout_timeout'])
+                try:
+                    await loop.run_in_executor(state.executor, reconfigure)
+                except Exception as error: # pylint: disable=broad-except
+                    raise ReloadError('Could not apply database settings: %s' % error)
+
+            state.apply_server_configuration(server_cfg)
+
+            if 'listen_backlog' in settings:
+                for listening_socket in self.listening_sockets:
+                    listening_socket.listen(server_cfg['listen_backlog'])
+
+            # server_cfg keeps describing what's running, so these are reported again on the
+            # next reload if they still differ
+            for key in restart_required:
+                if key in self.server_cfg:
+                    server_cfg[key] = self.server_cfg[key]
+                else:
+                    del server_cfg[key]
+            self.server_cfg.update(server_cfg)
+
+            # A setting taken out of the file has to go too, or it'd look changed every time
+            self.database_cfg.clear()
+            self.database_cfg.update(database_cfg)
+            self.reloads += 1
+
+            topology = await loop.run_in_executor(
+                state.executor,
+                functools.partial(state.datastore.refresh_network_topogoly, incremental=True))
+
+            return {'settings': settings, 'restart_required': restart_required,
+                    'topology': topology}
+
+    def _read_configuration(self):
+        '''Returns (server settings, database settings) from the configuration file'''
+        try:
+            cfg_file = ConfigurationParser(self.configuration_file)
+            return (cfg_file.get_server_configuration(), cfg_file.get_database_configuration())
+        except (OSError, configparser.Error, ValueError) as error:
+            raise ReloadError('Could not read %s: %s' % (self.configuration_file, error))
+
+def diff_settings(old_settings, new_settings, prefix='', hide=()):
+    '''Returns {prefix+key: (old value, new value)} for every setting that changed
+
+    Values of keys in hide are reported as '*' rather than what they actually are'''
+    changes = {}
+    for key in sorted(set(old_settings) | set(new_settings)):
+        old_value, new_value = old_settings.get(key), new_settings.get(key)
+        if old_value != new_value:
+            if key in hide:
+                old_value, new_value = '*', '*'
+            changes[prefix+key] = (old_value, new_value)
+    return changes
@@ -0,0 +1,106 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import time
+from dynipd.server.admission import AdmissionControl
+from dynipd.server.executor import DatastoreExecutor
+from dynipd.server.idle_reaper import IdleReaper
+from dynipd.server.metrics import ServerMetrics
+from dynipd.server.single_flight import CoalescedDataStoreReader
+
+class ServerState(object):
+    '''Objects shared by every AsyncServerHandler in this process
+
+    See the comment at the top of dynipd.py for why these have to be handed to the connection
+    callback by hand. Bundling them here means adding another shared object doesn't require
+    touching every function between main() and the handler.
+    '''
+
+    def __init__(self, datastore, event_bus, executor=None, read_freshness=0.5,
+                 idle_timeout=10.0, max_queued_requests=256, metrics=None):
+        # pylint: disable=too-many-arguments
+        self.datastore = datastore
+        self.event_bus = event_bus
+        self.idle_reaper = IdleReaper(idle_timeout)
+
+        # Blocking datastore calls run here. None means the loop's default executor, which
+        # isn't sized to the connection pool, so only tests should leave it that way
+        self.executor = executor
+
+        # Reads should go through here rather than the datastore so they get coalesced
+        self.reads = CoalescedDataStoreReader(datastore, read_freshness, executor)
+
+        # Writes go through here, so renewals jump the queue and a flood of new requests
+        # gets told to back off. It hands the executor one write per thread at most
+        slots = executor.max_workers if executor is not None else 4
+        self.admission = AdmissionControl(slots, max_queued_requests)
+
+        # Counters and histograms for the metrics endpoint. Pass the same ServerMetrics the
+        # datastore was given, so its query timings end up alongside ours
+        self.metrics = metrics if metrics is not None else ServerMetrics()
+        self.metrics.track_server_state(self)
+
+        # Set once we've handed our listeners to a new process and are shutting down
+        self.draining = False
+
+    def apply_server_configuration(self, server_cfg):
+        '''Applies reloaded settings from ConfigurationParser.get_server_configuration()
+
+        Everything takes effect without dropping connections. Settings that belong to
+        someone else (the datastore's pool, the listening sockets) are left to the caller;
+        see ConfigurationReloader.'''
+        self.reads.single_flight.freshness = server_cfg['read_freshness']
+        self.idle_reaper.idle_timeout = server_cfg['idle_timeout']
+        self.admission.max_waiting = server_cfg['max_queued_requests']
+
+        # ThreadPoolExecutor can't shrink, so a resize means a new executor. Work already
+        # queued on the old one still runs there, and its threads exit once it has
+        if self.executor is not None and server_cfg['pool_size'] != self.executor.max_workers:
+            old_executor = self.executor
+            self.executor = DatastoreExecutor(server_cfg['pool_size'])
+            self.reads.single_flight.set_executor(self.executor)
+            self.admission.resize(server_cfg['pool_size'])
+            old_executor.shutdown(wait=False)
+
+    def begin_drain(self):
+        '''Starts closing client connections so this process can exit
+
+        Connections in the middle of a command get to finish it first; see
+        AsyncServerHandler._process_commands.'''
+        self.draining = True
+        for connection in self.idle_reaper.connections():
+            if not connection.busy:
+                connection.close_idle()
+
+    async def wait_for_drain(self, timeout):
+        '''Waits up to timeout seconds for every connection to close
+
+        Returns True if everything closed in time'''
+        deadline = time.monotonic() + timeout
+        while self.idle_reaper.connection_count():
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.1)
+
+        return True
+
+    def get_stats(self):
+        '''Returns connection, executor and connection pool statistics in a single dict'''
+        stats = {}
+        stats['connections'] = self.idle_reaper.connection_count()
+        stats['connections_reaped'] = self.idle_reaper.reaped
+        stats['admission_waiting'] = self.admission.waiting()
+        stats['admission_shed'] = self.admission.shed
+
+        if self.executor is not None:
+            for key, value in self.executor.get_stats().items():
+                stats['executor_' + key] = value
+
+        for key, value in self.datastore.get_pool_stats().items():
+            stats['pool_' + key] = value
+
+        return stats
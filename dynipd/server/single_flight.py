@@ -0,0 +1,79 @@
+'''
+DynIPD - Request coalescing for datastore reads
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import functools
+
+class SingleFlight(object):
+    '''Collapses identical concurrent calls into a single executor call
+
+    The first caller for a given key kicks the function off on the executor; everyone else
+    asking for the same key while it's running waits on that same future. Once it finishes, the
+    result is kept for freshness seconds so a burst of clients right behind the first wave
+    doesn't immediately trigger another query. Failures are never kept, the next caller
+    retries.
+
+    Results are shared between every caller, so they must be treated as read-only.
+    '''
+
+    def __init__(self, freshness=0.5, executor=None):
+        self.freshness = freshness
+        self._executor = executor
+        self._futures = {}
+
+        # Counters for figuring out how much we're saving
+        self.calls = 0
+        self.executions = 0
+
+    async def do(self, key, function, *args):
+        '''Runs function(*args) on the executor unless a call for key is in flight or fresh'''
+        self.calls += 1
+
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = loop.run_in_executor(self._executor, function, *args)
+            self._futures[key] = future
+            self.executions += 1
+            future.add_done_callback(functools.partial(self._finished, key))
+
+        # shield() keeps one impatient caller getting cancelled from cancelling it for everyone
+        return await asyncio.shield(future)
+
+    def set_executor(self, executor):
+        '''Runs calls from now on on executor. Calls already in flight finish where they are'''
+        self._executor = executor
+
+    def _finished(self, key, future):
+        '''Decides how long a finished call stays around for'''
+        if future.cancelled() or future.exception() is not None or self.freshness <= 0:
+            self._expire(key, future)
+            return
+
+        asyncio.get_event_loop().call_later(self.freshness, self._expire, key, future)
+
+    def _expire(self, key, future):
+        '''Removes the result, unless it's already been replaced by a newer call'''
+        if self._futures.get(key) is future:
+            del self._futures[key]
+
+class CoalescedDataStoreReader(object):
+    '''Read side of MySQLDataStore, with identical concurrent reads coalesced
+
+    AsyncServerHandler goes through this for anything that doesn't modify state, so a thousand
+    clients connecting at once cost one machine lookup rather than a thousand.
+    '''
+
+    def __init__(self, datastore, freshness=0.5, executor=None):
+        self.datastore = datastore
+        self.single_flight = SingleFlight(freshness, executor)
+
+    async def get_machine(self, name):
+        '''Retrieves a machine row from the database'''
+        return await self.single_flight.do(('get_machine', name),
+                                           self.datastore.get_machine, name)
@@ -0,0 +1,190 @@
+'''
+Socket-based utilization scanner
+
+An IP is actively utilized when some service has a socket open on it. Finding that out by
+reading /proc/net/tcp* means the kernel formatting every socket on the box as text, and us
+parsing all of it, every scan. NETLINK_SOCK_DIAG lets us hand the kernel a small bytecode
+program that matches our addresses, so only sockets on our IPs are ever sent back, and
+they come back as fixed-size binary records.
+
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import errno
+import ipaddress
+import socket
+import struct
+from socket import AF_INET, AF_INET6, IPPROTO_TCP, IPPROTO_UDP
+
+# Not exported by the socket module
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+
+INET_DIAG_REQ_BYTECODE = 1
+INET_DIAG_BC_JMP = 1
+INET_DIAG_BC_S_COND = 7
+
+TCP_ESTABLISHED = 1
+TCP_LISTEN = 10
+
+# TCP sockets count when listening or connected; UDP sockets in any state, since a bound
+# but unconnected UDP socket is TCP_CLOSE as far as sock_diag is concerned
+SCANNED_PROTOCOLS = ((IPPROTO_TCP, (1 << TCP_ESTABLISHED) | (1 << TCP_LISTEN)),
+                     (IPPROTO_UDP, 0xffffffff))
+
+# Bytecode jumps are 16 bits, which caps how many address conditions fit in one program.
+# Longer address lists are split over several dumps
+MAX_FILTER_CONDITIONS = 1024
+
+NLMSGHDR = struct.Struct('=IHHII')
+INET_DIAG_REQ_V2 = struct.Struct('=BBBxI48x')
+INET_DIAG_MSG_SOURCE = struct.Struct('=B3x2x2x16s')
+V4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+class UtilizationScanner(object):
+    '''Counts the sockets open on each of a set of IPs, and reports what changed
+
+    scan() is cheap enough to call every second; the kernel only sends back sockets on
+    the IPs we ask about, however many others there are. The filter is only rebuilt when
+    the IPs asked about change.
+    '''
+
+    def __init__(self):
+        self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+        self._socket.bind((0, 0))
+        self._sequence_number = 0
+
+        self._ip_addresses = None
+        self._requests = []
+
+        # {ip_address: socket count} from the last scan. Only IPs with sockets are in it
+        self.counts = {}
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        '''Closes the sock_diag socket'''
+        if getattr(self, '_socket', None):
+            self._socket.close()
+            self._socket = None
+
+    def scan(self, ip_addresses):
+        '''Counts the sockets on each IP. Returns {ip_address: count} for IPs whose count
+        changed since the last scan; an IP that no longer has any sockets is reported as 0
+
+        Args:
+            ip_addresses - the IPs configured on this node
+        '''
+        ip_addresses = frozenset(ipaddress.ip_address(ip_address) for ip_address in ip_addresses)
+        if ip_addresses != self._ip_addresses:
+            self._ip_addresses = ip_addresses
+            self._requests = _build_requests(ip_addresses)
+
+        counts = {}
+        for family, protocol, states, bytecode in self._requests:
+            for source in self._dump(family, protocol, states, bytecode):
+                ip_address = _source_to_address(*source)
+
+                # Conditions are collapsed into covering networks, so the kernel can send
+                # back sockets on addresses near ours that aren't ours
+                if ip_address in ip_addresses:
+                    ip_address = str(ip_address)
+                    counts[ip_address] = counts.get(ip_address, 0) + 1
+
+        changes = {ip_address: count for ip_address, count in counts.items()
+                   if self.counts.get(ip_address) != count}
+        for ip_address in self.counts.keys() - counts.keys():
+            changes[ip_address] = 0
+
+        self.counts = counts
+        return changes
+
+    def _dump(self, family, protocol, states, bytecode):
+        '''Runs one filtered sock_diag dump. Yields the raw source address of each socket'''
+        self._sequence_number += 1
+        request = INET_DIAG_REQ_V2.pack(family, protocol, 0, states)
+        attribute = struct.pack('=HH', 4 + len(bytecode), INET_DIAG_REQ_BYTECODE) + bytecode
+        payload = request + attribute
+        self._socket.send(NLMSGHDR.pack(NLMSGHDR.size + len(payload), SOCK_DIAG_BY_FAMILY,
+                                        NLM_F_REQUEST | NLM_F_DUMP, self._sequence_number,
+                                        0) + payload)
+
+        while True:
+            data = self._socket.recv(65536)
+            offset = 0
+            while offset < len(data):
+                length, message_type, _, sequence_number, _ = NLMSGHDR.unpack_from(data, offset)
+                if sequence_number == self._sequence_number:
+                    if message_type == NLMSG_DONE:
+                        return
+                    if message_type == NLMSG_ERROR:
+                        error = -struct.unpack_from('=i', data, offset + NLMSGHDR.size)[0]
+                        if error:
+                            raise OSError(error, 'sock_diag: %s' %
+                                          errno.errorcode.get(error, error))
+                        return
+
+                    yield INET_DIAG_MSG_SOURCE.unpack_from(data, offset + NLMSGHDR.size)
+
+                # Messages are padded out to four bytes
+                offset += (length + 3) & ~3
+
+def _build_requests(ip_addresses):
+    '''Works out the dumps to run for a set of IPs. Returns a list of
+    (family, protocol, states, bytecode)
+
+    IPv4 addresses also go in the IPv6 dumps, since the kernel matches them against
+    v4-mapped addresses on dual-stack sockets'''
+    v4_networks = list(ipaddress.collapse_addresses(
+        ip_address for ip_address in ip_addresses if ip_address.version == 4))
+    v6_networks = list(ipaddress.collapse_addresses(
+        ip_address for ip_address in ip_addresses if ip_address.version == 6))
+
+    requests = []
+    for family, networks in ((AF_INET, v4_networks), (AF_INET6, v4_networks + v6_networks)):
+        for offset in range(0, len(networks), MAX_FILTER_CONDITIONS):
+            bytecode = build_source_filter(networks[offset:offset+MAX_FILTER_CONDITIONS])
+            for protocol, states in SCANNED_PROTOCOLS:
+                requests.append((family, protocol, states, bytecode))
+    return requests
+
+def build_source_filter(networks):
+    '''Builds an inet_diag bytecode program matching sockets bound within any of networks
+
+    Each network is a source condition. A match falls through to a jump to the end of the
+    program, which accepts the socket; a miss skips the jump and tries the next network.
+    The last network has no jump; a miss there jumps past the end, which rejects it.'''
+    conditions = []
+    for network in networks:
+        family = AF_INET if network.version == 4 else AF_INET6
+        conditions.append(struct.pack('=BBxxi', family, network.prefixlen, -1) +
+                          network.network_address.packed)
+
+    # Condition ops are 4 bytes plus the condition, then a 4 byte jump, except for the last
+    remaining = sum(4 + len(condition) + 4 for condition in conditions) - 4
+    bytecode = b''
+    for index, condition in enumerate(conditions):
+        op_length = 4 + len(condition)
+        bytecode += struct.pack('=BBH', INET_DIAG_BC_S_COND, op_length, op_length + 4)
+        bytecode += condition
+        remaining -= op_length
+
+        if index != len(conditions) - 1:
+            bytecode += struct.pack('=BBH', INET_DIAG_BC_JMP, 4, remaining)
+            remaining -= 4
+    return bytecode
+
+def _source_to_address(family, raw_address):
+    '''Turns a raw inet_diag source address into an ipaddress object'''
+    if family == AF_INET:
+        return ipaddress.IPv4Address(raw_address[:4])
+    if raw_address[:12] == V4_MAPPED_PREFIX:
+        return ipaddress.IPv4Address(raw_address[12:])
+    return ipaddress.IPv6Address(raw_address)
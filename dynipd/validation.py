@@ -4,8 +4,282 @@ Created on Sep 20, 2015
 @author: mcasadevall
 '''
 
+import bisect
+import functools
 import ipaddress
-from socket import AF_INET, AF_INET6
+from socket import AF_INET, AF_INET6, inet_ntop, inet_pton
+
+# Internally, addresses are (family, integer) pairs and networks are (family, integer,
+# prefix length) triples. Hot paths compare and do offset math on those directly, and
+# only turn them back into strings or ipaddress objects at the edges (the database, the
+# wire, the kernel).
+ADDRESS_BITS = {AF_INET: 32, AF_INET6: 128}
+
+def parse_ip(ip_addr):
+    '''Validates an IP address, and returns it as (family, integer)
+
+    Accepts strings, ipaddress objects and (family, integer) pairs, which are passed
+    through as is. Raises ValueError if it isn't an IP address'''
+    if isinstance(ip_addr, str):
+        # Dotted quads are by far the most common, and inet_pton is as strict about them
+        # as ipaddress is, at a fraction of the cost
+        try:
+            return (AF_INET, int.from_bytes(inet_pton(AF_INET, ip_addr), 'big'))
+        except OSError:
+            pass
+    elif isinstance(ip_addr, tuple):
+        return ip_addr
+
+    ip_addr = ipaddress.ip_address(ip_addr)
+    if ip_addr.version == 4:
+        return (AF_INET, int(ip_addr))
+    return (AF_INET6, int(ip_addr))
+
+def parse_network(ip_network, strict=True):
+    '''Validates a CIDR network, and returns it as (family, integer, prefix length)
+
+    With strict, a network with host bits set raises ValueError, otherwise they're
+    masked off, same as ipaddress.ip_network()'''
+    if isinstance(ip_network, tuple):
+        return ip_network
+
+    if isinstance(ip_network, ipaddress.IPv4Network):
+        return (AF_INET, int(ip_network.network_address), ip_network.prefixlen)
+    if isinstance(ip_network, ipaddress.IPv6Network):
+        return (AF_INET6, int(ip_network.network_address), ip_network.prefixlen)
+
+    if isinstance(ip_network, str):
+        address, _, prefix_length = ip_network.partition('/')
+        if prefix_length.isascii() and prefix_length.isdigit() and '%' not in address:
+            family, value = parse_ip(address)
+            prefix_length = int(prefix_length)
+            if prefix_length > ADDRESS_BITS[family]:
+                raise ValueError('%r does not appear to be a valid network' % ip_network)
+
+            host_mask = (1 << (ADDRESS_BITS[family]-prefix_length)) - 1
+            if value & host_mask:
+                if strict:
+                    raise ValueError('%s has host bits set' % ip_network)
+                value &= ~host_mask
+            return (family, value, prefix_length)
+
+    # Netmasks and bare addresses
+    ip_network = ipaddress.ip_network(ip_network, strict=strict)
+    family = AF_INET if ip_network.version == 4 else AF_INET6
+    return (family, int(ip_network.network_address), ip_network.prefixlen)
+
+def format_ip(family, value):
+    '''Returns the string form of a (family, integer) address'''
+    if family == AF_INET:
+        return inet_ntop(AF_INET, value.to_bytes(4, 'big'))
+
+    # inet_ntop writes IPv4-mapped addresses differently to ipaddress; stick with the latter
+    # so IPs already in the database still match
+    return str(ipaddress.IPv6Address(value))
+
+def format_network(family, value, prefix_length):
+    '''Returns the CIDR string form of a (family, integer, prefix length) network'''
+    return '%s/%d' % (format_ip(family, value), prefix_length)
+
+def to_ip_network(family, value, prefix_length):
+    '''Returns an ipaddress network object, for the checks that need one'''
+    if family == AF_INET:
+        return ipaddress.IPv4Network((value, prefix_length))
+    return ipaddress.IPv6Network((value, prefix_length))
+
+def ip_within_network(address, network):
+    '''Checks a parse_ip() address is within a parse_network() network'''
+    family, value = address
+    network_family, network_value, prefix_length = network
+    if family != network_family:
+        return False
+
+    host_bits = ADDRESS_BITS[family] - prefix_length
+    return value >> host_bits == network_value >> host_bits
+
+def networks_overlap(network1, network2):
+    '''Checks two parse_network() networks overlap'''
+    if network1[0] != network2[0]:
+        return False
+
+    # Two CIDR blocks overlap exactly when the larger one contains the smaller one
+    host_bits = ADDRESS_BITS[network1[0]] - min(network1[2], network2[2])
+    return network1[1] >> host_bits == network2[1] >> host_bits
+
+# Error codes from validate_ip_batch(), one per ValueError validate_and_normalize_ip_dict()
+# can raise
+BATCH_OK = 0
+BATCH_INVALID_ADDRESS = 1
+BATCH_WRONG_FAMILY = 2
+BATCH_INVALID_PREFIX = 3
+BATCH_BROADCAST_ADDRESS = 4
+BATCH_NETWORK_ADDRESS = 5
+BATCH_LOOPBACK = 6
+BATCH_LINK_LOCAL = 7
+BATCH_MULTICAST = 8
+BATCH_RESERVED = 9
+BATCH_UNSPECIFIED = 10
+
+BATCH_ERROR_MESSAGES = {
+    BATCH_OK: None,
+    BATCH_INVALID_ADDRESS: 'Not an IP address',
+    BATCH_WRONG_FAMILY: 'IP address is not of the given family',
+    BATCH_INVALID_PREFIX: 'Invalid prefix length',
+    BATCH_BROADCAST_ADDRESS: 'Refusing to add broadcast address as an IP',
+    BATCH_NETWORK_ADDRESS: 'Refusing to use network address as IP due to prefix length!',
+    BATCH_LOOPBACK: 'Will not allocate loopback address',
+    BATCH_LINK_LOCAL: 'Will not allocate link-local address',
+    BATCH_MULTICAST: 'Will not allocate multicast address',
+    BATCH_RESERVED: 'Will not use reserved address space',
+    BATCH_UNSPECIFIED: 'Will not use unspecified address space',
+}
+
+# The ranges behind ipaddress's is_loopback, is_link_local and so on, in the order
+# confirm_valid_network() checks them
+_UNUSABLE_NETWORKS = {
+    AF_INET: [(BATCH_LOOPBACK, ['127.0.0.0/8']),
+              (BATCH_LINK_LOCAL, ['169.254.0.0/16']),
+              (BATCH_MULTICAST, ['224.0.0.0/4']),
+              (BATCH_RESERVED, ['240.0.0.0/4']),
+              (BATCH_UNSPECIFIED, ['0.0.0.0/32'])],
+    AF_INET6: [(BATCH_LOOPBACK, ['::1/128']),
+               (BATCH_LINK_LOCAL, ['fe80::/10']),
+               (BATCH_MULTICAST, ['ff00::/8']),
+               (BATCH_RESERVED, ['::/8', '100::/8', '200::/7', '400::/6', '800::/5', '1000::/4',
+                                 '4000::/3', '6000::/3', '8000::/3', 'a000::/3', 'c000::/3',
+                                 'e000::/4', 'f000::/5', 'f800::/6', 'fe00::/9']),
+               (BATCH_UNSPECIFIED, ['::/128'])],
+}
+
+class _RangeSet(object):
+    '''Sorted, merged integer ranges, for bisecting an address into'''
+
+    def __init__(self, networks):
+        ranges = []
+        for network in sorted(parse_network(network) for network in networks):
+            family, start, prefix_length = network
+            end = start + (1 << (ADDRESS_BITS[family]-prefix_length)) - 1
+            if ranges and start <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+        self._starts = [start for start, _ in ranges]
+        self._ends = [end for _, end in ranges]
+
+    def __contains__(self, value):
+        index = bisect.bisect_right(self._starts, value) - 1
+        return index >= 0 and value <= self._ends[index]
+
+_UNUSABLE_RANGES = {family: [(code, _RangeSet(networks)) for code, networks in checks]
+                    for family, checks in _UNUSABLE_NETWORKS.items()}
+
+# How many distinct networks and IPs to remember having validated. A topology only has a
+# handful of networks and allocation sizes; there are far more IPs, but the same ones come
+# up again on every reservation, renewal and reconcile
+NETWORK_CACHE_SIZE = 4096
+ADDRESS_CACHE_SIZE = 65536
+
+def _find_unusable(family, network_value, broadcast_value):
+    '''Returns the BATCH_* code for why a network can't be used, or BATCH_OK
+
+    Like ipaddress, a network is loopback (or whichever) only if both its ends are'''
+    for code, ranges in _UNUSABLE_RANGES[family]:
+        if network_value in ranges and broadcast_value in ranges:
+            return code
+    return BATCH_OK
+
+@functools.lru_cache(maxsize=NETWORK_CACHE_SIZE)
+def _unusable_network(family, network_value, prefix_length):
+    '''Memoized _find_unusable() for a parse_network() network'''
+    host_mask = (1 << (ADDRESS_BITS[family]-prefix_length)) - 1
+    return _find_unusable(family, network_value, network_value | host_mask)
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _normalize_ip(ip_addr):
+    '''Memoized string to normalized string. Errors aren't cached'''
+    return format_ip(*parse_ip(ip_addr))
+
+def validate_ip_batch(family, addresses, prefix_lengths, low_addresses=None):
+    '''Validates many IPs of one family at once, as validate_and_normalize_ip_dict() would
+
+    Meant for imports of thousands of IPs. Nothing is built per row beyond the integers
+    themselves, and the range checks are a bisect each rather than a walk through
+    ipaddress's tables.
+
+    Args:
+        family - AF_INET or AF_INET6
+        addresses - sequence of IPs. Integers (an array.array, or a NumPy uint32 array for
+                    v4) are taken as is; anything else goes through parse_ip()
+        prefix_lengths - sequence of prefix lengths, one per IP, or a single prefix length
+                         for all of them
+        low_addresses - for v6 given as paired 64-bit halves (such as two NumPy uint64
+                        arrays), the low halves; addresses then holds the high halves
+
+    Returns (valid, errors, values): a list of booleans, a list of BATCH_* error codes
+    (see BATCH_ERROR_MESSAGES), and the IPs as integers, None where they couldn't be
+    parsed. Format the valid ones with format_ip() at the edge.
+    '''
+    ValidationAndNormlization.is_valid_ip_family(family)
+
+    bits = ADDRESS_BITS[family]
+    if isinstance(prefix_lengths, int):
+        prefix_lengths = [prefix_lengths] * len(addresses)
+    if len(prefix_lengths) != len(addresses):
+        raise ValueError('Need one prefix length per address')
+    if low_addresses is not None and len(low_addresses) != len(addresses):
+        raise ValueError('Need one low half per address')
+
+    host_masks = {}
+    valid = []
+    errors = []
+    values = []
+
+    for row, address in enumerate(addresses):
+        error = BATCH_OK
+        value = None
+
+        # NumPy scalars aren't ints, but __index__() turns them into one
+        try:
+            if low_addresses is not None:
+                value = (int(address) << 64) | int(low_addresses[row])
+            elif isinstance(address, str) or not hasattr(address, '__index__'):
+                address_family, value = parse_ip(address)
+                if address_family != family:
+                    error = BATCH_WRONG_FAMILY
+            else:
+                value = address.__index__()
+        except ValueError:
+            error = BATCH_INVALID_ADDRESS
+
+        if value is not None and not 0 <= value < 1 << bits:
+            value = None
+            error = BATCH_INVALID_ADDRESS
+
+        prefix_length = int(prefix_lengths[row])
+        if not error and not 1 <= prefix_length <= bits:
+            error = BATCH_INVALID_PREFIX
+
+        if not error:
+            host_mask = host_masks.get(prefix_length)
+            if host_mask is None:
+                host_mask = host_masks[prefix_length] = (1 << (bits-prefix_length)) - 1
+            network_value = value & ~host_mask
+            broadcast_value = network_value | host_mask
+
+            # Only v4 gives up its broadcast and network addresses, and a host address (/32)
+            # has neither
+            if family == AF_INET and prefix_length < 32 and broadcast_value == value:
+                error = BATCH_BROADCAST_ADDRESS
+            elif family == AF_INET and prefix_length < 32 and network_value == value:
+                error = BATCH_NETWORK_ADDRESS
+            else:
+                error = _find_unusable(family, network_value, broadcast_value)
+
+        valid.append(not error)
+        errors.append(error)
+        values.append(value)
+
+    return (valid, errors, values)
 
 class ValidationAndNormlization(object):
     '''Catch-all for validationing information'''
@@ -21,28 +295,12 @@ class ValidationAndNormlization(object):
     @staticmethod
     def is_ip_within_block(ip_address, ip_network):
         '''Checks that an IP is within a given CIDR block'''
-
-        # If we got a string, create the right objects
-        if isinstance(ip_address, str):
-            ip_address = ipaddress.ip_address(ip_address)
-        if isinstance(ip_network, str):
-            ip_network = ipaddress.ip_network(ip_network, strict=True)
-
-        # Create an IPvXNetwork from the address
-        ip_network_origin = ipaddress.ip_network(ip_address)
-
-        return ip_network.overlaps(ip_network_origin)
+        return ip_within_network(parse_ip(ip_address), parse_network(ip_network))
 
     @staticmethod
     def do_cidr_blocks_overlap(block1, block2):
         '''Checks if a CIDR block overlaps with one another'''
-        # If we got a string, create the right objects
-        if isinstance(block1, str):
-            block1 = ipaddress.ip_network(block1)
-        if isinstance(block2, str):
-            block2 = ipaddress.ip_network(block2, strict=True)
-
-        return block1.overlaps(block2)
+        return networks_overlap(parse_network(block1, strict=False), parse_network(block2))
 
     @staticmethod
     def validate_ip_network(ip_network):
@@ -57,7 +315,12 @@ class ValidationAndNormlization(object):
     @staticmethod
     def validate_and_normalize_ip(ip_addr):
         '''Validates an IP address using ipaddress'''
-        return str(ipaddress.ip_address(ip_addr))
+        if isinstance(ip_addr, str):
+            # Scope IDs don't survive being turned into an integer
+            if '%' in ip_addr:
+                return str(ipaddress.ip_address(ip_addr))
+            return _normalize_ip(ip_addr)
+        return format_ip(*parse_ip(ip_addr))
 
     @staticmethod
     def is_valid_prefix_size(prefix_length, family):
@@ -73,21 +336,13 @@ class ValidationAndNormlization(object):
 
     @staticmethod
     def confirm_valid_network(ip_network):
-        '''Confirms a network is valid for unicast assignment'''
-        if ip_network.is_loopback:
-            raise ValueError('Will not allocate loopback address')
-
-        if ip_network.is_link_local:
-            raise ValueError('Will not allocate link-local address')
-
-        if ip_network.is_multicast:
-            raise ValueError('Will not allocate multicast address')
+        '''Confirms a network is valid for unicast assignment
 
-        if ip_network.is_reserved:
-            raise ValueError('Will not use reserved address space')
-
-        if ip_network.is_unspecified:
-            raise ValueError('Will not use unspecified address space')
+        The answer is cached, as the same few networks and allocation sizes are checked
+        every time an Allocation is built'''
+        error = _unusable_network(*parse_network(ip_network))
+        if error:
+            raise ValueError(BATCH_ERROR_MESSAGES[error])
         return ip_network
 
     @staticmethod
@@ -95,54 +350,54 @@ class ValidationAndNormlization(object):
         '''Validates and normalize the information given in an ip_dict'''
 
         # Check IP first, and make sure we've got the right family
-        ip_address = ipaddress.ip_address(ip_dict['ip_address'])
+        family, value = parse_ip(ip_dict['ip_address'])
+        prefix_length = ip_dict['prefix_length']
 
         # Validate based on address family
         if ip_dict['family'] == AF_INET:
             # First, make sure we've got a v4 address
-            if not isinstance(ip_address, ipaddress.IPv4Address):
+            if family != AF_INET:
                 raise ValueError('AF_INET specified, but not an IPv4 address.')
 
-            # Glue the prefix length on, and calculate the broadcast address
-            ip_network = ipaddress.ip_network(str(ip_address) + "/%s" % ip_dict['prefix_length'],
-                                              strict=False)
-            ip_dict['ip_address'] = str(ip_address)
-            ip_dict['broadcast'] = str(ip_network.broadcast_address)
+            if prefix_length < 0 or prefix_length > 32:
+                raise ValueError('Invalid prefix length')
 
-            # Make sure we're not using the network address or broadcast as an actual address
-            if ip_network.broadcast_address == ip_address:
+            # Glue the prefix length on, and calculate the broadcast address
+            host_mask = (1 << (32-prefix_length)) - 1
+            network_value = value & ~host_mask
+            broadcast_value = network_value | host_mask
+            ip_dict['ip_address'] = format_ip(AF_INET, value)
+            ip_dict['broadcast'] = format_ip(AF_INET, broadcast_value)
+
+            # Make sure we're not using the network address or broadcast as an actual address.
+            # A host address (/32) has neither
+            if prefix_length < 32 and broadcast_value == value:
                 raise ValueError('Refusing to add broadcast address as an IP')
 
-            if ip_network.network_address == ip_address:
+            if prefix_length < 32 and network_value == value:
                 raise ValueError('Refusing to use network address as IP due to prefix length!')
 
             # Make sure prefix length is sane
-            ValidationAndNormlization.is_valid_prefix_size(ip_dict['prefix_length'],
-                                                           ip_dict['family'])
-
-            # Final checks, make sure we're not using loopback, multicast address or class E address
-            ValidationAndNormlization.confirm_valid_network(ip_network)
+            ValidationAndNormlization.is_valid_prefix_size(prefix_length, ip_dict['family'])
 
         elif ip_dict['family'] == AF_INET6:
             # v6 is slightly similar, we just need to validate the address, and the prefix_length
-            if not isinstance(ip_address, ipaddress.IPv6Address):
+            if family != AF_INET6:
                 raise ValueError('AF_INET6 specified but not an IPv6 adddress')
 
             # Normalizing v6 addresses is important for sanity reasons
-            ip_dict['ip_address'] = str(ip_address)
+            ip_dict['ip_address'] = format_ip(AF_INET6, value)
 
             # I've debated making this check stricter by disallowing < 32 ...
-            ValidationAndNormlization.is_valid_prefix_size(ip_dict['prefix_length'],
-                                                           ip_dict['family'])
-
-            # Generate a IPv6Network object to do final confirmation tests
-            ip_network = ipaddress.ip_network(str(ip_address) + "/%s" % ip_dict['prefix_length'],
-                                              strict=False)
-
-            # Run the battery of IPv6 sanity checks
-            ValidationAndNormlization.confirm_valid_network(ip_network)
+            ValidationAndNormlization.is_valid_prefix_size(prefix_length, ip_dict['family'])
+            network_value = value & ~((1 << (128-prefix_length)) - 1)
 
         else:
             raise ValueError('Unknown protocol family')
 
+        # Final checks, make sure we're not using loopback, multicast address or class E
+        # address. These are the only part that needs an ipaddress object
+        ValidationAndNormlization.confirm_valid_network(
+            to_ip_network(family, network_value, prefix_length))
+
         return ip_dict
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+'''
+DynIPD - Protocol load generator and latency benchmark
+'''
+
+import sys
+import asyncio
+import argparse
+from dynipd.benchmark import StandInDataStore, parse_verb_mix, run_load, \
+    start_in_process_server, format_report
+
+async def benchmark(args, verb_mix):
+    '''Runs the benchmark, starting a server first if asked to'''
+    server = None
+    host, port = args.host, args.port
+
+    if args.in_process:
+        datastore = StandInDataStore(query_latency=args.query_latency / 1000.0)
+        server, port = await start_in_process_server(datastore, args.pool_size)
+        host = '127.0.0.1'
+
+    try:
+        recorder, elapsed = await run_load(host, port, args.sessions, args.requests,
+                                           verb_mix, args.connect_rate)
+    finally:
+        if server:
+            server.close()
+
+    print(format_report(recorder.summarize(elapsed), elapsed))
+    if args.in_process:
+        print('%d stand-in datastore queries' % datastore.queries)
+
+def main():
+    '''Parses arguments and kicks off the benchmark'''
+    parser_description = "Load generator and latency benchmark for dynipd"
+    parser = argparse.ArgumentParser(description=parser_description,
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--host", default="127.0.0.1", help="dynipd server to benchmark")
+    parser.add_argument("--port", type=int, default=8888, help="dynipd server port")
+    parser.add_argument("--in-process", dest='in_process', action='store_true',
+                        help="Benchmark an in-process server backed by a local datastore stand-in")
+    parser.add_argument("--query-latency", dest='query_latency', type=float, default=1.0,
+                        help="Simulated database latency for --in-process, in milliseconds")
+    parser.add_argument("--pool-size", dest='pool_size', type=int, default=20,
+                        help="Datastore threads for --in-process")
+    parser.add_argument("-s", "--sessions", type=int, default=1000,
+                        help="Concurrent client sessions")
+    parser.add_argument("-n", "--requests", type=int, default=100,
+                        help="Requests sent by each session")
+    parser.add_argument("--mix", default="TEST=9,STATS=1",
+                        help="Weighted mix of commands to send, as COMMAND=weight,...")
+    parser.add_argument("--connect-rate", dest='connect_rate', type=float, default=None,
+                        help="New sessions per second; default is everyone at once")
+    args = parser.parse_args()
+
+    try:
+        verb_mix = parse_verb_mix(args.mix)
+    except ValueError as error:
+        sys.stderr.write("%s. Bailing out!\n" % error)
+        sys.exit(-1)
+
+    # Thousands of sessions means thousands of file descriptors on both ends
+    try:
+        asyncio.run(benchmark(args, verb_mix))
+    except OSError as error:
+        sys.stderr.write("%s (check ulimit -n). Bailing out!\n" % error)
+        sys.exit(-1)
+
+main()
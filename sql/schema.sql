@@ -31,6 +31,7 @@ CREATE TABLE `allocated_blocks` (
   `reservation_expires` datetime,
   PRIMARY KEY (`allocation_id`),
   UNIQUE KEY `allocation_id` (`allocation_id`),
+  UNIQUE KEY `allocated_block` (`allocated_block`),
   KEY `network_id` (`network_id`),
   KEY `network_id_idx_fkey` (`network_id`),
   KEY `machine_id` (`machine_id`),
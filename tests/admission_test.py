@@ -0,0 +1,156 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import unittest
+from socket import AF_INET
+
+from dynipd.benchmark import StandInDataStore, start_in_process_server
+from dynipd.datastore_errors import PoolExhausted
+from dynipd.protocol.client import AsyncDynIPClient, DynIPServerError, decorrelated_jitter
+from dynipd.server.admission import AdmissionControl, PRIORITY_NEW, PRIORITY_RENEWAL
+
+class AdmissionControlTest(unittest.TestCase):
+    '''Tests prioritizing and shedding datastore writes'''
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_renewals_go_first(self):
+        '''Once a slot frees up, waiting renewals get it before earlier new requests'''
+        admission = AdmissionControl(slots=1)
+        order = []
+
+        async def write(name, priority, started=None):
+            async def work():
+                if started:
+                    started.set()
+                order.append(name)
+                await asyncio.sleep(0.01)
+            await admission.run(priority, work)
+
+        async def run():
+            started = asyncio.Event()
+            first = asyncio.ensure_future(write('first', PRIORITY_NEW, started))
+            await started.wait()
+
+            waiting = [asyncio.ensure_future(write('new', PRIORITY_NEW)),
+                       asyncio.ensure_future(write('renewal', PRIORITY_RENEWAL))]
+            await asyncio.sleep(0)
+            self.assertEqual(admission.waiting(), 2)
+            await asyncio.gather(first, *waiting)
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(order, ['first', 'renewal', 'new'])
+        self.assertEqual(admission.waiting(), 0)
+
+    def test_shedding(self):
+        '''New requests past max_waiting are shed with a retry hint; renewals never are'''
+        admission = AdmissionControl(slots=1, max_waiting=1)
+        self.assertFalse(admission.should_shed(PRIORITY_NEW))
+
+        async def run():
+            release = asyncio.Event()
+            running = asyncio.ensure_future(admission.run(PRIORITY_NEW, release.wait))
+            waiting = asyncio.ensure_future(admission.run(PRIORITY_NEW, release.wait))
+            await asyncio.sleep(0)
+
+            self.assertTrue(admission.should_shed(PRIORITY_NEW))
+            self.assertFalse(admission.should_shed(PRIORITY_RENEWAL))
+            self.assertGreaterEqual(admission.retry_after(), 1)
+
+            # Cancelled waiters give up their place in line
+            waiting.cancel()
+            await asyncio.sleep(0)
+            self.assertFalse(admission.should_shed(PRIORITY_NEW))
+
+            release.set()
+            await running
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(admission.shed, 1)
+
+    def test_busy_server(self):
+        '''dynipd sheds RESERVEs it can't queue, and the client retries them'''
+        topology = [{'id': 1, 'name': 'LOC', 'location': 'TestNet', 'family': AF_INET,
+                     'network': '10.0.2.0/24', 'allocation_size': 30, 'reserved_blocks': ''}]
+        datastore = StandInDataStore(query_latency=0.02, machines=['TestMachine'],
+                                     topology=topology)
+
+        async def run():
+            server, port = await start_in_process_server(datastore, pool_size=1,
+                                                         max_queued_requests=1)
+            clients = [AsyncDynIPClient('127.0.0.1', port, backoff_start=0.01, busy_retries=20)
+                       for _ in range(6)]
+            try:
+                results = await asyncio.gather(
+                    *[client.reserve('TestMachine', 'TestNet', AF_INET, 1) for client in clients])
+                held = [ip_address for result in results for _, ip_addresses in result
+                        for ip_address in ip_addresses]
+                renewed = await clients[0].renew('TestMachine', held[:2] + ['10.0.2.1'])
+                return (results, sum(client.busy_responses for client in clients), renewed)
+            finally:
+                for client in clients:
+                    await client.close()
+                server.close()
+                await server.wait_closed()
+
+        results, busy_responses, renewed = self.loop.run_until_complete(run())
+        self.assertEqual(len(results), 6)
+        self.assertGreater(busy_responses, 0)
+        self.assertEqual(len(renewed), 2)
+        self.assertNotIn('10.0.2.1', renewed)
+
+    def test_datastore_errors(self):
+        '''Datastore failures are answered with a status line, and the connection carries on'''
+        topology = [{'id': 1, 'name': 'LOC', 'location': 'TestNet', 'family': AF_INET,
+                     'network': '10.0.2.0/24', 'allocation_size': 30, 'reserved_blocks': ''}]
+
+        class FailingDataStore(StandInDataStore):
+            '''Fails the first RESERVEs it's given'''
+            failures = [PoolExhausted('No database connection free'), RuntimeError('Bug')]
+
+            def reserve_ips(self, machine, location, family, count):
+                if self.failures:
+                    raise self.failures.pop(0)
+                return super().reserve_ips(machine, location, family, count)
+
+        datastore = FailingDataStore(query_latency=0, machines=['TestMachine'],
+                                     topology=topology)
+
+        async def run():
+            server, port = await start_in_process_server(datastore, pool_size=1)
+            client = AsyncDynIPClient('127.0.0.1', port, backoff_max=1.0)
+            try:
+                # The pool running dry is worth retrying; the client does that by itself
+                with self.assertRaises(DynIPServerError) as raised:
+                    await client.reserve('TestMachine', 'TestNet', AF_INET, 1)
+                self.assertEqual(raised.exception.status, 500)
+                self.assertEqual(client.busy_responses, 1)
+
+                reserved = await client.reserve('TestMachine', 'TestNet', AF_INET, 1)
+                return (reserved, client.connects)
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+
+        reserved, connects = self.loop.run_until_complete(run())
+        self.assertEqual(reserved, [('10.0.2.4/30', ['10.0.2.5'])])
+        self.assertEqual(connects, 1)
+
+    def test_decorrelated_jitter(self):
+        '''Delays stay between base and the cap'''
+        delay = 0.1
+        for _ in range(100):
+            delay = decorrelated_jitter(delay, 0.1, 5.0)
+            self.assertGreaterEqual(delay, 0.1)
+            self.assertLessEqual(delay, 5.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,289 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from socket import AF_INET
+
+from dynipd.agent import NodeAgent
+from dynipd.benchmark import StandInDataStore, start_in_process_server
+from dynipd.interface import InterfaceConfigurationError
+from dynipd.node_state import NodeState, NodeStateFile
+from dynipd.policy import StandbyPolicy, StandbyPoolManager
+from dynipd.protocol.client import AsyncDynIPClient, DynIPConnectionError
+from dynipd.reconciler import IPReconciler
+
+TOPOLOGY = [{'id': 1, 'name': 'LOC', 'location': 'TestNet', 'family': AF_INET,
+             'network': '10.0.2.0/24', 'allocation_size': 30, 'reserved_blocks': ''}]
+
+class RecordingInterface(object):
+    '''Stands in for NetworkInterfaceConfig, counting dumps and keeping what's applied'''
+    def __init__(self):
+        self.ips = []
+        self.dumps = 0
+
+    def get_ips(self):
+        self.dumps += 1
+        return [dict(ip_dict) for ip_dict in self.ips]
+
+    def apply_ip_changes(self, adds=None, removes=None, configured_ips=None):
+        # pylint: disable=unused-argument
+        self.ips = [ip_dict for ip_dict in self.ips if ip_dict['ip_address'] not in removes]
+        self.ips.extend(adds)
+
+class BrokenInterface(RecordingInterface):
+    '''An interface that can't be configured until fixed is set'''
+    def __init__(self):
+        super().__init__()
+        self.fixed = False
+
+    def apply_ip_changes(self, adds=None, removes=None, configured_ips=None):
+        if not self.fixed:
+            raise InterfaceConfigurationError('Operation not permitted')
+        super().apply_ip_changes(adds, removes, configured_ips)
+
+class FakeScanner(object):
+    '''Stands in for UtilizationScanner; counts are set by the test'''
+    def __init__(self):
+        self.counts = {}
+        self.scanned = None
+
+    def scan(self, ip_addresses):
+        self.scanned = list(ip_addresses)
+        return {}
+
+class FakeProber(object):
+    '''Stands in for ConnectivityProber; only IPs in reachable get through'''
+    def __init__(self, reachable):
+        self.reachable = reachable
+        self.probed = []
+
+    async def probe_many(self, ip_addresses):
+        for ip_address in ip_addresses:
+            self.probed.append(ip_address)
+            reachable = ip_address in self.reachable
+            yield {'ip_address': ip_address, 'reachable': reachable,
+                   'round_trip': 0.0 if reachable else None,
+                   'error': None if reachable else 'timed out'}
+
+class RenewingClient(object):
+    '''A client whose server only renews some IPs'''
+    def __init__(self, renewable):
+        self.renewable = renewable
+
+    async def renew(self, machine_name, ip_addresses):
+        return [ip_address for ip_address in ip_addresses if ip_address in self.renewable]
+
+class UnreachableClient(object):
+    '''A client whose server is never there'''
+    async def renew(self, machine_name, ip_addresses):
+        raise DynIPConnectionError('Connection refused')
+
+class NodeAgentTest(unittest.TestCase):
+    '''Tests renewing, reconciling and saving a node's state'''
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.directory = tempfile.mkdtemp()
+        self.state_file = NodeStateFile(os.path.join(self.directory, 'state.json'))
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.directory)
+
+    def owned_state(self, deadline):
+        '''A NodeState holding two IPs whose reservations run out at deadline'''
+        node_state = NodeState('TestMachine')
+        node_state.set_allocations([('10.0.2.4/30', ['10.0.2.5', '10.0.2.6'])])
+        node_state.set_reservation_deadline('10.0.2.5', deadline)
+        node_state.set_reservation_deadline('10.0.2.6', deadline)
+        return node_state
+
+    def make_agent(self, client, node_state, interface_cfg):
+        '''An agent for interface_cfg, managing 10.0.2.0/24'''
+        return NodeAgent(client, node_state, self.state_file,
+                         IPReconciler(interface_cfg, ['10.0.2.0/24']), 'eth0',
+                         ['10.0.2.0/24'])
+
+    def test_renew_and_reconcile(self):
+        '''Expiring IPs are renewed through the server, configured, and the state saved'''
+        datastore = StandInDataStore(query_latency=0, machines=['TestMachine'],
+                                     topology=TOPOLOGY)
+        interface_cfg = RecordingInterface()
+
+        async def run():
+            server, port = await start_in_process_server(datastore, pool_size=1)
+            client = AsyncDynIPClient('127.0.0.1', port)
+            try:
+                self.assertEqual(await client.reserve('TestMachine', 'TestNet', AF_INET, 2),
+                                 [('10.0.2.4/30', ['10.0.2.5', '10.0.2.6'])])
+                agent = self.make_agent(client, self.owned_state(1060.0), interface_cfg)
+                return agent, await agent.step(now=1000.0)
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+
+        agent, changed = self.loop.run_until_complete(run())
+        self.assertTrue(changed)
+        self.assertEqual(agent.renewals, 2)
+        self.assertEqual(agent.node_state.expiring_reservations(0, now=1299.0), [])
+        self.assertEqual([(ip_dict['ip_address'], ip_dict['prefix_length'])
+                          for ip_dict in interface_cfg.ips],
+                         [('10.0.2.5', 24), ('10.0.2.6', 24)])
+
+        saved = self.state_file.load('TestMachine')
+        self.assertEqual(saved.get_allocations(), agent.node_state.get_allocations())
+        self.assertEqual(len(saved.get_reconciled('eth0')), 2)
+
+    def test_standby_pool(self):
+        '''The standby pool is filled, configured and saved, and refilled as it's used'''
+        datastore = StandInDataStore(query_latency=0, machines=['TestMachine'],
+                                     topology=TOPOLOGY)
+        interface_cfg = RecordingInterface()
+        scanner = FakeScanner()
+        policy = StandbyPolicy(low_watermark=2, high_watermark=8, reserve_batch=2)
+
+        async def run():
+            server, port = await start_in_process_server(datastore, pool_size=1)
+            client = AsyncDynIPClient('127.0.0.1', port)
+            try:
+                node_state = NodeState('TestMachine')
+                agent = NodeAgent(client, node_state, self.state_file,
+                                  IPReconciler(interface_cfg, ['10.0.2.0/24']), 'eth0',
+                                  ['10.0.2.0/24'],
+                                  StandbyPoolManager(policy, client, node_state, 'TestNet',
+                                                     AF_INET), scanner)
+                await agent.step(now=1000.0)
+                filled = [ip_dict['ip_address'] for ip_dict in interface_cfg.ips]
+
+                # Something starts using both of them
+                scanner.counts = {ip_address: 1 for ip_address in filled}
+                await agent.step(now=1001.0)
+                return filled, agent
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+
+        filled, agent = self.loop.run_until_complete(run())
+        self.assertEqual(filled, ['10.0.2.5', '10.0.2.6'])
+        self.assertEqual(sorted(scanner.scanned), filled)
+
+        held = [ip_address for _, ip_addresses in agent.node_state.get_allocations()
+                for ip_address in ip_addresses]
+        self.assertGreaterEqual(len(held), 4)
+        self.assertEqual(len(interface_cfg.ips), len(held))
+        self.assertEqual(self.state_file.load('TestMachine').get_allocations(),
+                         agent.node_state.get_allocations())
+
+    def test_not_renewed_are_dropped(self):
+        '''Only IPs the server renewed are kept; the rest come off the interface'''
+        node_state = self.owned_state(1060.0)
+        interface_cfg = RecordingInterface()
+        agent = self.make_agent(RenewingClient(['10.0.2.6']), node_state, interface_cfg)
+
+        self.assertTrue(self.loop.run_until_complete(agent.step(now=1000.0)))
+        self.assertEqual(agent.renewals, 1)
+        self.assertEqual(node_state.get_allocations(), [('10.0.2.4/30', ['10.0.2.6'])])
+        self.assertEqual(node_state.expiring_reservations(299, now=1000.0), [])
+        self.assertEqual([ip_dict['ip_address'] for ip_dict in interface_cfg.ips],
+                         ['10.0.2.6'])
+
+        # A server that renews nothing takes everything away
+        agent.client = RenewingClient([])
+        self.loop.run_until_complete(agent.step(now=1200.0))
+        self.assertEqual(agent.renewals, 1)
+        self.assertEqual(interface_cfg.ips, [])
+        self.assertEqual(self.state_file.load('TestMachine').get_allocations(),
+                         [('10.0.2.4/30', [])])
+
+    def test_expired_are_dropped(self):
+        '''IPs whose reservations ran out are forgotten and taken off the interface'''
+        node_state = self.owned_state(2000.0)
+        node_state.set_reservation_deadline('10.0.2.6', 900.0)
+        interface_cfg = RecordingInterface()
+        agent = self.make_agent(UnreachableClient(), node_state, interface_cfg)
+
+        self.assertTrue(self.loop.run_until_complete(agent.step(now=1000.0)))
+        self.assertEqual(node_state.get_allocations(), [('10.0.2.4/30', ['10.0.2.5'])])
+        self.assertEqual([ip_dict['ip_address'] for ip_dict in interface_cfg.ips],
+                         ['10.0.2.5'])
+
+    def test_unreachable_server(self):
+        '''A failed renewal leaves the deadlines alone, to be tried again next step'''
+        node_state = self.owned_state(1060.0)
+        agent = self.make_agent(UnreachableClient(), node_state, RecordingInterface())
+
+        self.loop.run_until_complete(agent.step(now=1000.0))
+        self.assertEqual(agent.renewals, 0)
+        self.assertEqual(node_state.expiring_reservations(60, now=1000.0),
+                         ['10.0.2.5', '10.0.2.6'])
+
+    def test_interface_failure(self):
+        '''An interface that can't be configured doesn't lose renewals, and is tried again'''
+        node_state = self.owned_state(1060.0)
+        interface_cfg = BrokenInterface()
+        agent = self.make_agent(RenewingClient(['10.0.2.5', '10.0.2.6']), node_state,
+                                interface_cfg)
+
+        self.assertTrue(self.loop.run_until_complete(agent.step(now=1000.0)))
+        self.assertEqual(agent.renewals, 2)
+        self.assertEqual(agent.reconciles, 0)
+        saved = self.state_file.load('TestMachine')
+        self.assertEqual(saved.expiring_reservations(299, now=1000.0), [])
+        self.assertIsNone(saved.get_reconciled('eth0'))
+
+        # Once it can be configured, the next step does so
+        interface_cfg.fixed = True
+        self.assertTrue(self.loop.run_until_complete(agent.step(now=1010.0)))
+        self.assertEqual(agent.reconciles, 1)
+        self.assertEqual(len(interface_cfg.ips), 2)
+
+    def test_probe(self):
+        '''Newly configured IPs are probed until they get through, and forgotten once gone'''
+        node_state = self.owned_state(2000.0)
+        prober = FakeProber(['10.0.2.5'])
+        agent = NodeAgent(UnreachableClient(), node_state, self.state_file,
+                          IPReconciler(RecordingInterface(), ['10.0.2.0/24']), 'eth0',
+                          ['10.0.2.0/24'], prober=prober)
+
+        self.loop.run_until_complete(agent.step(now=1000.0))
+        self.assertEqual(prober.probed, ['10.0.2.5', '10.0.2.6'])
+        self.assertEqual(agent.untested, {'10.0.2.6'})
+
+        # Only the one that didn't get through is tried again
+        prober.reachable.append('10.0.2.6')
+        self.loop.run_until_complete(agent.step(now=1010.0))
+        self.assertEqual(prober.probed[2:], ['10.0.2.6'])
+        self.assertEqual(agent.untested, set())
+        self.assertEqual(agent.probes, 3)
+
+    def test_resume(self):
+        '''A saved state that's still current is picked up without dumping the interface,
+        until the next full reconcile is due'''
+        interface_cfg = RecordingInterface()
+        agent = self.make_agent(UnreachableClient(), self.owned_state(5000.0), interface_cfg)
+        self.loop.run_until_complete(agent.step(now=1000.0))
+        self.assertEqual(interface_cfg.dumps, 1)
+
+        # A restart, loading what the first run saved
+        agent = self.make_agent(UnreachableClient(), self.state_file.load('TestMachine'),
+                                interface_cfg)
+        self.assertFalse(self.loop.run_until_complete(agent.step(now=1010.0)))
+        self.assertFalse(self.loop.run_until_complete(agent.step(now=1020.0)))
+        self.assertEqual(interface_cfg.dumps, 1)
+
+        # Something removed an IP behind our back; the full reconcile puts it back
+        interface_cfg.ips = interface_cfg.ips[:1]
+        self.assertTrue(self.loop.run_until_complete(agent.step(now=1310.0)))
+        self.assertEqual(interface_cfg.dumps, 2)
+        self.assertEqual(len(interface_cfg.ips), 2)
+
+if __name__ == "__main__":
+    unittest.main()
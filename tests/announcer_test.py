@@ -0,0 +1,83 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import ipaddress
+import os
+import socket
+import struct
+import unittest
+
+from dynipd.announcer import AddressAnnouncer, build_gratuitous_arp, build_unsolicited_na, \
+    _internet_checksum
+
+MAC_ADDRESS = bytes.fromhex('020000a1b2c3')
+
+class AnnouncementFrameTest(unittest.TestCase):
+    '''Checks the frames we build are what neighbours expect'''
+
+    def test_gratuitous_arp(self):
+        '''A broadcast ARP request, with our address as both sender and target'''
+        frame = build_gratuitous_arp(MAC_ADDRESS, '10.0.2.5')
+        self.assertEqual(len(frame), 42)
+        self.assertEqual(frame[0:6], b'\xff' * 6)
+        self.assertEqual(frame[6:12], MAC_ADDRESS)
+        self.assertEqual(frame[12:14], b'\x08\x06')
+
+        operation, sender_mac, sender_ip, target_ip = struct.unpack('!6xH6s4s6x4s', frame[14:])
+        self.assertEqual(operation, 1)
+        self.assertEqual(sender_mac, MAC_ADDRESS)
+        self.assertEqual(sender_ip, ipaddress.ip_address('10.0.2.5').packed)
+        self.assertEqual(target_ip, sender_ip)
+
+    def test_unsolicited_na(self):
+        '''An NA to all nodes, with Override set, hop limit 255 and a valid checksum'''
+        frame = build_unsolicited_na(MAC_ADDRESS, 'fd00::5')
+        self.assertEqual(frame[0:6], b'\x33\x33\x00\x00\x00\x01')
+        self.assertEqual(frame[12:14], b'\x86\xdd')
+
+        ipv6, icmp = frame[14:54], frame[54:]
+        self.assertEqual(ipv6[7], 255)
+        self.assertEqual(ipv6[24:40], ipaddress.ip_address('ff02::1').packed)
+
+        icmp_type, flags, target = struct.unpack('!B3xI16s', icmp[:24])
+        self.assertEqual(icmp_type, 136)
+        self.assertEqual(flags, 0x20000000)
+        self.assertEqual(target, ipaddress.ip_address('fd00::5').packed)
+        self.assertEqual(icmp[-6:], MAC_ADDRESS)
+
+        pseudo_header = ipv6[8:40] + struct.pack('!I3xB', len(icmp), 58)
+        self.assertEqual(_internet_checksum(pseudo_header + icmp), 0)
+
+    @unittest.skipIf(os.getuid() != 0, 'must be run as root')
+    def test_announce_in_bursts(self):
+        '''Every frame goes out repeat times, burst_size at a time'''
+        capture = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(0x0003))
+        capture.bind(('lo', 0))
+        capture.settimeout(0.5)
+        # Room for every frame twice over, plus whatever else is on loopback at the time
+        capture.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+
+        announcer = AddressAnnouncer('lo', repeat=2, interval=0, burst_size=16)
+        try:
+            ip_addresses = [str(ip) for ip in ipaddress.ip_network('10.0.2.0/26').hosts()]
+            announcer.announce(ip_addresses + ['fd00::5'])
+            self.assertEqual(announcer.frames_sent, 126)
+
+            # Loopback hands us each frame twice; once going out and once coming back in
+            arps = 0
+            try:
+                while True:
+                    frame, address = capture.recvfrom(2048)
+                    if address[2] == socket.PACKET_OUTGOING and frame[12:14] == b'\x08\x06':
+                        arps += 1
+            except socket.timeout:
+                pass
+            self.assertEqual(arps, 124)
+        finally:
+            announcer.close()
+            capture.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+
+import asyncio
+import os
+import unittest
+from socket import AF_INET
+from pyroute2.iproute import IPRoute
+
+from dynipd.async_interface import AsyncNetworkInterfaceConfig
+from dynipd.interface import DuplicateIPError, InvalidNetworkDevice, IPNotFound
+
+class AsyncInterfaceConfigTest(unittest.TestCase):
+    '''Tests AsyncNetworkInterfaceConfig against a dummy interface (dummy0), same as
+    InterfaceConfigTest'''
+    def __init__(self, *args, **kwargs):
+        super(AsyncInterfaceConfigTest, self).__init__(*args, **kwargs)
+        self.iproute_api = IPRoute()
+
+    def setUp(self):
+        self.iproute_api.link_create(name='dummy0', kind='dummy')
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        idx = self.iproute_api.link_lookup(ifname='dummy0')[0]
+        self.iproute_api.link_remove(idx)
+        self.iproute_api.close()
+
+    def _run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    @unittest.skipIf(os.getuid() != 0, 'must be run as root')
+    def test_nonexistent_interface(self):
+        '''Tests that InvalidNetworkDevice is raised if an interface is non-existent'''
+        with self.assertRaises(InvalidNetworkDevice):
+            self._run(AsyncNetworkInterfaceConfig('nonexistent0').open())
+
+    @unittest.skipIf(os.getuid() != 0, 'must be run as root')
+    def test_concurrent_adds(self):
+        '''Lots of adds in flight at once on one instance'''
+        async def run():
+            async with AsyncNetworkInterfaceConfig('dummy0') as interface_cfg:
+                await asyncio.gather(*[interface_cfg.add_v4_ip('10.0.241.%d' % i, 24)
+                                       for i in range(1, 51)],
+                                     interface_cfg.add_v6_ip('fd00:a3b1:78a2::1', 64))
+
+                with self.assertRaises(DuplicateIPError):
+                    await interface_cfg.add_v4_ip('10.0.241.1', 24)
+
+                return await interface_cfg.get_ips()
+
+        ips = self._run(run())
+        self.assertEqual(len(ips), 51)
+        self.assertEqual(len([ip for ip in ips if ip['family'] == AF_INET]), 50)
+
+    @unittest.skipIf(os.getuid() != 0, 'must be run as root')
+    def test_batch_and_remove(self):
+        '''apply_ip_changes() and remove_ip() work the same as the blocking versions'''
+        async def run():
+            async with AsyncNetworkInterfaceConfig('dummy0') as interface_cfg:
+                adds = [{'ip_address': '10.0.241.%d' % i, 'family': AF_INET,
+                         'prefix_length': 24} for i in range(1, 101)]
+                await interface_cfg.apply_ip_changes(adds=adds)
+                await interface_cfg.remove_ip('10.0.241.50')
+
+                with self.assertRaises(IPNotFound):
+                    await interface_cfg.get_full_ip_info('10.0.241.50')
+
+                return await interface_cfg.get_ips()
+
+        self.assertEqual(len(self._run(run())), 99)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
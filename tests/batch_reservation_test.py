@@ -0,0 +1,143 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import ipaddress
+import unittest
+from socket import AF_INET, AF_INET6
+
+from dynipd.benchmark import StandInDataStore, start_in_process_server
+from dynipd.network_block import NetworkBlockFull, carve_reservations
+from dynipd.server.machine import Machine
+
+class TestBatchReservation(unittest.TestCase):
+    '''Tests reserving many IPs across NetworkBlocks in one go
+
+    StandInDataStore carves from real NetworkBlocks, it just doesn't persist anything'''
+
+    topology = [{'id': 1, 'name': 'LOC', 'location': 'TestNet', 'family': AF_INET,
+                 'network': '10.0.2.0/28', 'allocation_size': 30, 'reserved_blocks': ''},
+                {'id': 2, 'name': 'LOC2', 'location': 'TestNet', 'family': AF_INET,
+                 'network': '10.0.3.0/24', 'allocation_size': 30, 'reserved_blocks': ''},
+                {'id': 3, 'name': 'LOCv6', 'location': 'TestNet', 'family': AF_INET6,
+                 'network': 'fd00:a3b1:78a2::/48', 'allocation_size': 64,
+                 'reserved_blocks': ''}]
+
+    def setUp(self):
+        self.datastore = StandInDataStore(query_latency=0, machines=['TestMachine'],
+                                          topology=self.topology)
+        self.machine = Machine('TestMachine', self.datastore)
+
+    def test_spans_network_blocks(self):
+        '''A request bigger than one block spills over into the next'''
+        carved = self.datastore.reserve_ips(self.machine, 'TestNet', AF_INET, 10)
+        ips = [ip for _, ip_addresses in carved for ip in ip_addresses]
+
+        self.assertEqual(len(ips), 10)
+        self.assertEqual(len(set(ips)), 10, 'Same IP handed out twice')
+
+        # The first and last /30 of 10.0.2.0/28 are held back, leaving two with two IPs each
+        in_first_block = [ip for ip in ips if ip in ipaddress.ip_network('10.0.2.0/28')]
+        self.assertEqual(len(in_first_block), 4)
+
+        # Network and broadcast addresses of each /30 are never handed out
+        for allocation, ip_addresses in carved:
+            network = ipaddress.ip_network(allocation.get_allocation_cidr())
+            self.assertNotIn(network.network_address, ip_addresses)
+            self.assertNotIn(network.broadcast_address, ip_addresses)
+
+    def test_shortage_leaves_nothing_behind(self):
+        '''If the location can't satisfy the request, nothing stays carved'''
+        networks = self.datastore.get_networks_by_location('TestNet')[:1]
+        with self.assertRaises(NetworkBlockFull):
+            carve_reservations(networks, self.machine, 5)
+
+        # All four IPs are still there to be had
+        carved = carve_reservations(networks, self.machine, 4)
+        self.assertEqual(sum(len(ip_addresses) for _, ip_addresses in carved), 4)
+
+    def test_ipv6(self):
+        '''v6 requests only come from v6 networks'''
+        carved = self.datastore.reserve_ips(self.machine, 'TestNet', AF_INET6, 3)
+        self.assertEqual(len(carved), 1)
+        self.assertEqual(carved[0][0].get_allocation_cidr(), 'fd00:a3b1:78a2:1::/64')
+        self.assertEqual(len(carved[0][1]), 3)
+
+    def test_reserve_verb(self):
+        '''RESERVE returns every allocation and IP on one line'''
+        async def run():
+            server, port = await start_in_process_server(self.datastore, pool_size=2)
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            await reader.readline()
+
+            writer.write(b'RESERVE TestMachine TestNet 4 3\n')
+            unauthenticated = await reader.readline()
+
+            writer.write(b'TEST2\nRESERVE TestMachine TestNet 4 3\n')
+            reserved = await reader.readline()
+
+            writer.write(b'RESERVE TestMachine TestNet 4 5000\n')
+            too_many = await reader.readline()
+
+            # Let the handler see EOF and clean up before the loop goes away
+            writer.write_eof()
+            await reader.read()
+            writer.close()
+            server.close()
+            return (unauthenticated, reserved, too_many)
+
+        loop = asyncio.new_event_loop()
+        try:
+            unauthenticated, reserved, too_many = loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+        self.assertTrue(unauthenticated.startswith(b'401'))
+        self.assertEqual(reserved, b'200 10.0.2.4/30=10.0.2.5,10.0.2.6 10.0.2.8/30=10.0.2.9\n')
+        self.assertTrue(too_many.startswith(b'400'))
+
+    def test_release_verb(self):
+        '''RELEASE frees whole allocations straight away, but only the machine's own'''
+        datastore = StandInDataStore(query_latency=0, machines=['TestMachine', 'OtherMachine'],
+                                     topology=self.topology)
+        network = datastore.get_networks()[0]
+
+        async def run():
+            server, port = await start_in_process_server(datastore, pool_size=2)
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            await reader.readline()
+
+            responses = []
+            for command in (b'TEST2', b'RESERVE TestMachine TestNet 4 3',
+                            b'RELEASE OtherMachine 10.0.2.4/30',
+                            b'RELEASE TestMachine 10.0.2.4/30 10.0.2.8/30 10.0.3.4/30',
+                            b'RELEASE TestMachine 10.0.2.4/33',
+                            b'RESERVE TestMachine TestNet 4 1'):
+                writer.write(command + b'\n')
+                if command != b'TEST2':
+                    responses.append(await reader.readline())
+
+            writer.write_eof()
+            await reader.read()
+            writer.close()
+            server.close()
+            return responses
+
+        loop = asyncio.new_event_loop()
+        try:
+            responses = loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+        self.assertEqual(responses[1:4], [b'200 Released 0\n', b'200 Released 2\n',
+                                          b'400 Invalid allocation\n'])
+
+        # The space is handed out again, from the start
+        self.assertEqual(responses[4], b'200 10.0.2.4/30=10.0.2.5\n')
+        self.assertEqual(network.allocations_used, 1)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
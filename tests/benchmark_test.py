@@ -0,0 +1,74 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import unittest
+
+from dynipd.benchmark import StandInDataStore, LatencyRecorder, percentile, parse_verb_mix, \
+    run_load, start_in_process_server
+
+class TestBenchmark(unittest.TestCase):
+    '''Tests the load generator, and uses it to exercise the protocol handler end to end'''
+
+    def test_percentile(self):
+        '''Nearest-rank percentiles'''
+        values = list(range(1, 1001))
+        self.assertEqual(percentile(values, 50), 500)
+        self.assertEqual(percentile(values, 99), 990)
+        self.assertEqual(percentile(values, 99.9), 999)
+        self.assertEqual(percentile([7], 99.9), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_parse_verb_mix(self):
+        '''Mix strings turn into weights, and bad ones are rejected'''
+        self.assertEqual(parse_verb_mix('TEST=9,STATS=1'), {'TEST': 9.0, 'STATS': 1.0})
+        self.assertEqual(parse_verb_mix('SUBSCRIBE Bench=1'), {'SUBSCRIBE Bench': 1.0})
+
+        with self.assertRaises(ValueError):
+            parse_verb_mix('TEST')
+        with self.assertRaises(ValueError):
+            parse_verb_mix('TEST=0')
+
+    def test_summary(self):
+        '''Errors and latencies are reported per verb'''
+        recorder = LatencyRecorder()
+        recorder.record('TEST', 0.001)
+        recorder.record('TEST', 0.003)
+        recorder.record_error('STATS')
+
+        summary = recorder.summarize(2.0)
+        self.assertEqual(summary['TEST']['count'], 2)
+        self.assertEqual(summary['TEST']['throughput'], 1.0)
+        self.assertEqual(summary['TEST']['p99'], 0.003)
+        self.assertEqual(summary['STATS']['errors'], 1)
+        self.assertIsNone(summary['STATS']['p50'])
+
+    def test_in_process_run(self):
+        '''A small run against an in-process server completes without errors'''
+        datastore = StandInDataStore(query_latency=0)
+
+        async def run():
+            server, port = await start_in_process_server(datastore, pool_size=4)
+            try:
+                return await run_load('127.0.0.1', port, 20, 10, {'TEST': 3, 'STATS': 1})
+            finally:
+                server.close()
+
+        loop = asyncio.new_event_loop()
+        try:
+            recorder, elapsed = loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+        summary = recorder.summarize(elapsed)
+        self.assertEqual(sum(stats['count'] for stats in summary.values()), 200)
+        self.assertEqual(sum(stats['errors'] for stats in summary.values()), 0)
+
+        # Topology reloads are coalesced, so there should be far fewer than one per request
+        self.assertLess(datastore.queries, 200)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,89 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import threading
+import unittest
+
+from dynipd.server.event_bus import EventBus, EVENT_ALLOCATION_ASSIGNED, \
+    EVENT_TOPOLOGY_CHANGED, EVENT_OVERFLOW
+
+class TestEventBus(unittest.TestCase):
+    '''Tests fan out of events through the EventBus'''
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def _get_event(self, subscription):
+        '''Waits for a single event, failing the test rather than hanging'''
+        return self.loop.run_until_complete(asyncio.wait_for(subscription.get(), 1.0))
+
+    def test_machine_event_only_reaches_that_machine(self):
+        '''Events for one machine are not delivered to another'''
+        bus = EventBus()
+        sub1 = bus.subscribe('TestMachine')
+        sub2 = bus.subscribe('TestMachine2')
+
+        bus.publish_machine_event('TestMachine', EVENT_ALLOCATION_ASSIGNED, '10.0.2.1/32')
+        self.assertEqual(self._get_event(sub1), (EVENT_ALLOCATION_ASSIGNED, '10.0.2.1/32'))
+
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(asyncio.wait_for(sub2.get(), 0.05))
+
+    def test_location_event(self):
+        '''Topology events fan out to every subscriber in the location'''
+        bus = EventBus()
+        sub1 = bus.subscribe('TestMachine', 'TestNet')
+        sub2 = bus.subscribe('TestMachine2', 'TestNet')
+
+        bus.publish_location_event('TestNet', EVENT_TOPOLOGY_CHANGED, 'LOC')
+        self.assertEqual(self._get_event(sub1), (EVENT_TOPOLOGY_CHANGED, 'LOC'))
+        self.assertEqual(self._get_event(sub2), (EVENT_TOPOLOGY_CHANGED, 'LOC'))
+
+    def test_publish_from_thread(self):
+        '''The datastore publishes from executor threads, make sure that works'''
+        bus = EventBus()
+        subscription = bus.subscribe('TestMachine')
+
+        thread = threading.Thread(target=bus.publish_machine_event,
+                                  args=('TestMachine', EVENT_ALLOCATION_ASSIGNED, '10.0.2.1/32'))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(self._get_event(subscription),
+                         (EVENT_ALLOCATION_ASSIGNED, '10.0.2.1/32'))
+
+    def test_unsubscribe(self):
+        '''Unsubscribing removes the subscriber from the bus'''
+        bus = EventBus()
+        subscription = bus.subscribe('TestMachine', 'TestNet')
+        self.assertEqual(bus.subscriber_count(), 1)
+
+        bus.unsubscribe(subscription)
+        bus.unsubscribe(subscription)
+        self.assertEqual(bus.subscriber_count(), 0)
+
+    def test_overflow(self):
+        '''A subscriber that falls behind gets a single OVERFLOW event'''
+        bus = EventBus(max_queued_events=2)
+        subscription = bus.subscribe('TestMachine')
+
+        for i in range(5):
+            bus.publish_machine_event('TestMachine', EVENT_ALLOCATION_ASSIGNED, str(i))
+
+        self.assertEqual(self._get_event(subscription), (EVENT_OVERFLOW, 'TestMachine'))
+
+        # And we get events again once we've caught up
+        bus.publish_machine_event('TestMachine', EVENT_ALLOCATION_ASSIGNED, 'after')
+        self.assertEqual(self._get_event(subscription), (EVENT_ALLOCATION_ASSIGNED, 'after'))
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
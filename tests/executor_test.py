@@ -0,0 +1,75 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import threading
+import unittest
+
+from dynipd.server.executor import DatastoreExecutor
+
+class TestDatastoreExecutor(unittest.TestCase):
+    '''Tests the DatastoreExecutor statistics'''
+
+    def test_queue_depth_and_active_threads(self):
+        '''Work beyond max_workers shows up as queued, and running work as active'''
+        executor = DatastoreExecutor(2)
+        release = threading.Event()
+        started = threading.Semaphore(0)
+
+        def blocking_call():
+            started.release()
+            release.wait()
+
+        futures = [executor.submit(blocking_call) for _ in range(5)]
+        started.acquire()
+        started.acquire()
+
+        stats = executor.get_stats()
+        self.assertEqual(stats['max_workers'], 2)
+        self.assertEqual(stats['active'], 2)
+        self.assertEqual(stats['queued'], 3)
+
+        release.set()
+        for future in futures:
+            future.result()
+        executor.shutdown()
+
+        stats = executor.get_stats()
+        self.assertEqual(stats['active'], 0)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['completed'], 5)
+        self.assertGreater(stats['queue_wait_max'], 0)
+
+    def test_cancelled_work_is_uncounted(self):
+        '''Work cancelled before it started doesn't stay counted as queued'''
+        executor = DatastoreExecutor(1)
+        release = threading.Event()
+
+        running = executor.submit(release.wait)
+        queued = executor.submit(release.wait)
+        self.assertTrue(queued.cancel())
+
+        release.set()
+        running.result()
+        executor.shutdown()
+
+        stats = executor.get_stats()
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['completed'], 1)
+
+    def test_exceptions_propagate(self):
+        '''Exceptions from the call come back through the future'''
+        executor = DatastoreExecutor(1)
+
+        def failing_call():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            executor.submit(failing_call).result()
+        executor.shutdown()
+        self.assertEqual(executor.get_stats()['active'], 0)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
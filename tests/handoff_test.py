@@ -0,0 +1,102 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import os
+import socket
+import tempfile
+import unittest
+
+from dynipd.server.handoff import HandoffServer, HandoffError, take_over_listening_sockets, \
+    complete_takeover
+
+class TestHandoff(unittest.TestCase):
+    '''Tests handing listening sockets to a new process over a Unix socket
+
+    Both ends run in this process, which is fine since SCM_RIGHTS doesn't care'''
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'handoff.sock')
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+
+    def tearDown(self):
+        self.listener.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        self.tempdir.cleanup()
+
+    def _start_server(self, on_handoff):
+        '''Starts a HandoffServer and waits until its socket exists'''
+        server = HandoffServer(self.path, [self.listener], on_handoff)
+        task = self.loop.create_task(server.serve())
+        while not os.path.exists(self.path):
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+        return task
+
+    def test_handoff(self):
+        '''The new process gets a working copy of the listening socket'''
+        handed_off = []
+        task = self._start_server(lambda: handed_off.append(True))
+
+        async def take_over():
+            sockets, control = await self.loop.run_in_executor(None, take_over_listening_sockets,
+                                                               self.path)
+            await self.loop.run_in_executor(None, complete_takeover, control)
+            return sockets
+
+        sockets = self.loop.run_until_complete(take_over())
+        self.loop.run_until_complete(task)
+
+        self.assertEqual(handed_off, [True])
+        self.assertFalse(os.path.exists(self.path), 'control socket not released')
+        self.assertEqual(len(sockets), 1)
+        self.assertEqual(sockets[0].getsockname(), self.listener.getsockname())
+
+        # Closing the old copy mustn't affect the new one
+        address = self.listener.getsockname()
+        self.listener.close()
+
+        client = socket.create_connection(address)
+        connection, _ = sockets[0].accept()
+        connection.close()
+        client.close()
+        sockets[0].close()
+
+    def test_bad_request_keeps_serving(self):
+        '''Garbage on the control socket doesn't hand anything over'''
+        handed_off = []
+        task = self._start_server(lambda: handed_off.append(True))
+
+        def send_garbage():
+            control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            control.connect(self.path)
+            control.sendall(b'GIMME\n')
+            response = control.recv(1024)
+            control.close()
+            return response
+
+        response = self.loop.run_until_complete(self.loop.run_in_executor(None, send_garbage))
+        self.assertEqual(response, b'ERROR\n')
+        self.assertEqual(handed_off, [])
+        self.assertTrue(os.path.exists(self.path))
+
+        task.cancel()
+        self.loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_nobody_listening(self):
+        '''Taking over with no server running raises HandoffError'''
+        with self.assertRaises(HandoffError):
+            take_over_listening_sockets(self.path)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,173 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import time
+import unittest
+from socket import AF_INET
+
+from dynipd.benchmark import StandInDataStore
+from dynipd.protocol.client import AsyncDynIPClient
+from dynipd.server.asyncio_handler import AsyncServerHandler
+from dynipd.server.event_bus import EventBus
+from dynipd.server.executor import DatastoreExecutor
+from dynipd.server.idle_reaper import IdleReaper
+from dynipd.server.server_state import ServerState
+
+class FakeConnection(object):
+    '''Just enough of AsyncServerHandler for the reaper'''
+    def __init__(self, exempt=False):
+        self.exempt = exempt
+        self.closed = False
+        self.busy = False
+        self.last_activity = None
+
+    def is_idle_exempt(self):
+        return self.exempt
+
+    def close_idle(self):
+        self.closed = True
+
+class TestIdleReaper(unittest.TestCase):
+    '''Tests idle connection tracking'''
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def _register(self, reaper, connection):
+        '''register() starts the sweep task, so it needs to run on the loop'''
+        async def register():
+            reaper.register(connection)
+        self.loop.run_until_complete(register())
+
+    def test_sweep_closes_only_idle_connections(self):
+        '''Connections past the timeout are closed, active and exempt ones are left alone'''
+        reaper = IdleReaper(idle_timeout=10.0)
+        idle = FakeConnection()
+        active = FakeConnection()
+        subscribed = FakeConnection(exempt=True)
+
+        for connection in (idle, active, subscribed):
+            self._register(reaper, connection)
+
+        idle.last_activity -= 11
+        subscribed.last_activity -= 11
+
+        self.assertEqual(reaper.sweep(), 1)
+        self.assertTrue(idle.closed)
+        self.assertFalse(active.closed)
+        self.assertFalse(subscribed.closed)
+        self.assertEqual(reaper.connection_count(), 2)
+        self.assertEqual(reaper.reaped, 1)
+        reaper.stop()
+
+    def test_periodic_sweep(self):
+        '''The sweep runs on its own once something is registered'''
+        reaper = IdleReaper(idle_timeout=0.05, interval=0.02)
+        connection = FakeConnection()
+        self._register(reaper, connection)
+
+        self.loop.run_until_complete(asyncio.sleep(0.15))
+        self.assertTrue(connection.closed)
+        reaper.stop()
+
+    def test_activity_keeps_connection_open(self):
+        '''Touching last_activity resets the clock'''
+        reaper = IdleReaper(idle_timeout=10.0)
+        connection = FakeConnection()
+        self._register(reaper, connection)
+
+        connection.last_activity -= 11
+        connection.last_activity = time.monotonic()
+        self.assertEqual(reaper.sweep(), 0)
+        reaper.unregister(connection)
+        self.assertEqual(reaper.connection_count(), 0)
+        reaper.stop()
+
+    def test_busy_connection_kept_open(self):
+        '''A connection in the middle of a command isn't closed, however long it takes'''
+        reaper = IdleReaper(idle_timeout=10.0)
+        connection = FakeConnection()
+        self._register(reaper, connection)
+
+        connection.busy = True
+        connection.last_activity -= 11
+        self.assertEqual(reaper.sweep(), 0)
+
+        connection.busy = False
+        self.assertEqual(reaper.sweep(), 1)
+        self.assertTrue(connection.closed)
+        reaper.stop()
+
+    def test_long_running_command(self):
+        '''A RESERVE that outlasts idle_timeout still gets its answer'''
+        topology = [{'id': 1, 'name': 'LOC', 'location': 'TestNet', 'family': AF_INET,
+                     'network': '10.0.2.0/24', 'allocation_size': 30, 'reserved_blocks': ''}]
+        datastore = StandInDataStore(query_latency=0.1, machines=['TestMachine'],
+                                     topology=topology)
+        server_state = ServerState(datastore, EventBus(), DatastoreExecutor(1),
+                                   idle_timeout=0.05)
+        server_state.idle_reaper.interval = 0.01
+
+        async def run():
+            async def begin_async_server(reader, writer):
+                await AsyncServerHandler(reader, writer, server_state).handle_inbound_connection()
+
+            server = await asyncio.start_server(begin_async_server, '127.0.0.1', 0)
+            client = AsyncDynIPClient('127.0.0.1', server.sockets[0].getsockname()[1])
+            try:
+                return await client.reserve('TestMachine', 'TestNet', AF_INET, 1)
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+
+        reserved = self.loop.run_until_complete(run())
+        self.assertEqual(reserved, [('10.0.2.4/30', ['10.0.2.5'])])
+        self.assertEqual(server_state.idle_reaper.reaped, 0)
+        server_state.executor.shutdown()
+
+    def test_client_keepalive(self):
+        '''A quiet client keeps its connection open by sending TEST now and then'''
+        datastore = StandInDataStore(query_latency=0, machines=['TestMachine'], topology=[])
+        server_state = ServerState(datastore, EventBus(), DatastoreExecutor(1),
+                                   idle_timeout=0.1)
+        server_state.idle_reaper.interval = 0.01
+
+        async def run(keepalive_interval):
+            async def begin_async_server(reader, writer):
+                await AsyncServerHandler(reader, writer, server_state).handle_inbound_connection()
+
+            server = await asyncio.start_server(begin_async_server, '127.0.0.1', 0)
+            client = AsyncDynIPClient('127.0.0.1', server.sockets[0].getsockname()[1],
+                                      backoff_start=0.01, keepalive_interval=keepalive_interval)
+            try:
+                await client.test()
+                await asyncio.sleep(0.4)
+                await client.test()
+                return (client.connects, client.keepalives)
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+
+        connects, keepalives = self.loop.run_until_complete(run(0.03))
+        self.assertEqual(connects, 1)
+        self.assertGreater(keepalives, 0)
+        self.assertEqual(server_state.idle_reaper.reaped, 0)
+
+        # Without them, it's hung up on and has to reconnect
+        self.assertEqual(self.loop.run_until_complete(run(0)), (2, 0))
+        self.assertEqual(server_state.idle_reaper.reaped, 1)
+        server_state.executor.shutdown()
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,100 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import unittest
+from socket import AF_INET, AF_INET6
+from pyroute2.netlink.rtnl import RTM_NEWADDR, RTM_DELADDR, RTM_NEWROUTE, RTM_DELROUTE
+from pyroute2.netlink.rtnl.ifaddrmsg import ifaddrmsg
+from pyroute2.netlink.rtnl.rtmsg import rtmsg
+
+from dynipd.interface import parse_address_message
+from dynipd.interface_cache import InterfaceStateCache
+
+def address_message(message_type, ip_address, family=AF_INET, index=5):
+    '''Builds an address notification like the kernel sends'''
+    message = ifaddrmsg()
+    message['header']['type'] = message_type
+    message['family'] = family
+    message['prefixlen'] = 24 if family == AF_INET else 64
+    message['index'] = index
+    message['attrs'] = [['IFA_ADDRESS', ip_address]]
+    return message
+
+def route_message(message_type, destination, oif=5):
+    '''Builds a route notification like the kernel sends'''
+    message = rtmsg()
+    message['header']['type'] = message_type
+    message['family'] = AF_INET
+    message['dst_len'] = 24
+    message['table'] = 254
+    message['attrs'] = [['RTA_DST', destination], ['RTA_OIF', oif]]
+    return message
+
+class TestInterfaceStateCache(unittest.TestCase):
+    '''Tests applying notifications to InterfaceStateCache
+
+    Messages are fed in by hand, so no netlink socket (or root) is needed. The real thing
+    is covered in network_cfg_test'''
+
+    def setUp(self):
+        self.dumps = []
+        self.cache = InterfaceStateCache(5, self._dump_addresses, self._dump_routes,
+                                         parse_address_message, self._parse_route)
+
+    def _dump_addresses(self):
+        self.dumps.append('addresses')
+        return [address_message(RTM_NEWADDR, '10.0.241.1')]
+
+    def _dump_routes(self):
+        self.dumps.append('routes')
+        return []
+
+    @staticmethod
+    def _parse_route(route):
+        '''Keeps routes on interface 5, like NetworkInterfaceConfig would'''
+        if route.get_attr('RTA_OIF') != 5:
+            return None
+        return {'destination': '%s/%d' % (route.get_attr('RTA_DST'), route['dst_len'])}
+
+    def test_initial_load(self):
+        '''The first lookup dumps both tables, and later ones don't'''
+        self.assertEqual([ip['ip_address'] for ip in self.cache.get_ips()], ['10.0.241.1'])
+        self.cache.get_routes()
+        self.assertEqual(self.dumps, ['addresses', 'routes'])
+
+    def test_address_events(self):
+        '''Addresses come and go with RTM_NEWADDR/RTM_DELADDR, for our interface only'''
+        self.cache.get_ips()
+
+        self.cache._apply(address_message(RTM_NEWADDR, 'fd00:a3b1:78a2::1', AF_INET6))
+        self.cache._apply(address_message(RTM_NEWADDR, '10.0.242.1', index=6))
+        self.assertEqual(self.cache.get_ip('fd00:a3b1:78a2::1')['prefix_length'], 64)
+        self.assertIsNone(self.cache.get_ip('10.0.242.1'))
+
+        self.cache._apply(address_message(RTM_DELADDR, 'fd00:a3b1:78a2::1', AF_INET6))
+        self.assertIsNone(self.cache.get_ip('fd00:a3b1:78a2::1'))
+        self.assertEqual(self.dumps, ['addresses', 'routes'])
+
+    def test_route_events(self):
+        '''Routes are keyed the way the kernel deletes them'''
+        self.cache.get_routes()
+
+        self.cache._apply(route_message(RTM_NEWROUTE, '10.0.243.0'))
+        self.cache._apply(route_message(RTM_NEWROUTE, '10.0.244.0', oif=6))
+        self.assertEqual(self.cache.get_routes(), [{'destination': '10.0.243.0/24'}])
+
+        self.cache._apply(route_message(RTM_DELROUTE, '10.0.243.0'))
+        self.assertEqual(self.cache.get_routes(), [])
+
+    def test_v4_address_removal_resyncs_routes(self):
+        '''The kernel flushes routes behind our back when a v4 address goes away'''
+        self.cache.get_routes()
+        self.cache._apply(address_message(RTM_DELADDR, '10.0.241.1'))
+        self.cache.get_routes()
+        self.assertEqual(self.dumps, ['addresses', 'routes', 'routes'])
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,139 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import time
+import unittest
+from socket import AF_INET
+
+from dynipd.benchmark import StandInDataStore, start_in_process_server
+from dynipd.network_block import carve_reservations, release_reservations
+from dynipd.protocol.client import AsyncDynIPClient
+from dynipd.server.machine import Machine
+from dynipd.server.metrics import MetricsRegistry, ServerMetrics, start_metrics_server
+
+TOPOLOGY = [{'id': 1, 'name': 'LOC', 'location': 'TestNet', 'family': AF_INET,
+             'network': '10.0.2.0/24', 'allocation_size': 30, 'reserved_blocks': ''}]
+
+class MetricsTest(unittest.TestCase):
+    '''Tests the metrics registry and the server's metrics endpoint'''
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_render(self):
+        '''Counters and histograms come out in the Prometheus text format'''
+        registry = MetricsRegistry()
+        counter = registry.counter('test_total', 'Things counted', ('verb',))
+        histogram = registry.histogram('test_seconds', 'Things timed', buckets=(0.1, 1.0))
+        registry.gauge('test_gauge', 'A value', lambda: {('a"b',): 3}, ('name',))
+
+        counter.inc('RESERVE')
+        counter.inc('RESERVE', amount=2)
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(5.0)
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE test_total counter', lines)
+        self.assertIn('test_total{verb="RESERVE"} 3', lines)
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{le="1"} 2', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum 5.15', lines)
+        self.assertIn('test_seconds_count 3', lines)
+        self.assertIn('test_gauge{name="a\\"b"} 3', lines)
+
+        self.assertRaises(ValueError, registry.counter, 'test_total', 'Again')
+
+    def test_network_gauges(self):
+        '''NetworkBlocks count allocations as they're carved and released'''
+        datastore = StandInDataStore(query_latency=0, machines=['TestMachine'],
+                                     topology=TOPOLOGY)
+        network = datastore.get_networks()[0]
+        machine = Machine('TestMachine', datastore)
+
+        # A /24 cut into /30s has 64, less the ones holding the network and broadcast address
+        self.assertEqual(network.allocations_total, 62)
+        self.assertEqual((network.allocations_used, network.allocations_free), (0, 62))
+
+        carved = carve_reservations([network], machine, 5)
+        self.assertEqual((network.allocations_used, network.allocations_free), (3, 59))
+
+        network._mark_allocation_in_use('10.0.2.64/30') # pylint: disable=protected-access
+        network._mark_allocation_in_use('10.0.2.64/30') # pylint: disable=protected-access
+        self.assertEqual(network.allocations_used, 4)
+
+        release_reservations(carved)
+        self.assertEqual((network.allocations_used, network.allocations_free), (1, 61))
+
+    def test_scrape(self):
+        '''Commands, datastore state and connections show up on the metrics endpoint'''
+        datastore = StandInDataStore(query_latency=0, machines=['TestMachine'],
+                                     topology=TOPOLOGY)
+        metrics = ServerMetrics()
+
+        async def scrape(port, path='/metrics'):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(('GET %s HTTP/1.0\r\nHost: localhost\r\n\r\n' % path).encode())
+            response = await reader.read()
+            writer.close()
+            return response.decode()
+
+        async def run():
+            server, port = await start_in_process_server(datastore, pool_size=2,
+                                                         metrics=metrics)
+            metrics_server = await start_metrics_server(metrics, '127.0.0.1', 0)
+            metrics_port = metrics_server.sockets[0].getsockname()[1]
+            client = AsyncDynIPClient('127.0.0.1', port)
+            try:
+                await client.reserve('TestMachine', 'TestNet', AF_INET, 3)
+                await client.reserve('TestMachine', 'TestNet', AF_INET, 1)
+                return (await scrape(metrics_port), await scrape(metrics_port, '/'))
+            finally:
+                await client.close()
+                metrics_server.close()
+                await metrics_server.wait_closed()
+                server.close()
+                await server.wait_closed()
+
+        page, not_found = self.loop.run_until_complete(run())
+        self.assertTrue(page.startswith('HTTP/1.0 200 OK\r\n'))
+        self.assertTrue(not_found.startswith('HTTP/1.0 404'))
+
+        lines = page.split('\r\n\r\n', 1)[1].splitlines()
+        self.assertIn('dynipd_requests_total{verb="RESERVE"} 2', lines)
+        self.assertIn('dynipd_request_duration_seconds_count{verb="RESERVE"} 2', lines)
+        self.assertIn('dynipd_connections 1', lines)
+        self.assertIn('dynipd_network_allocations_used{network="LOC",location="TestNet"} 3',
+                      lines)
+        self.assertIn('dynipd_network_allocations_free{network="LOC",location="TestNet"} 59',
+                      lines)
+
+    def test_event_loop_lag(self):
+        '''A blocked event loop shows up as lag'''
+        metrics = ServerMetrics()
+
+        async def run():
+            watcher = asyncio.ensure_future(metrics.watch_event_loop(interval=0.01))
+            await asyncio.sleep(0.02)
+            time.sleep(0.05)
+            await asyncio.sleep(0.02)
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+
+        self.loop.run_until_complete(run())
+        lines = metrics.registry.render().splitlines()
+        count = metrics.loop_lag.get_count()
+        self.assertGreater(count, 0)
+        self.assertIn('dynipd_event_loop_lag_seconds_count %d' % count, lines)
+        self.assertNotIn('dynipd_event_loop_lag_seconds_bucket{le="0.025"} %d' % count, lines)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,12 +5,15 @@ Created on Sep 16, 2015
 '''
 
 import os
+import time
 import unittest
 from socket import AF_INET, AF_INET6
 from pyroute2.iproute import IPRoute
 
 from dynipd.interface import NetworkInterfaceConfig, DuplicateIPError,\
     InvalidNetworkDevice, IPNotFound
+from dynipd.interface_manager import NetworkInterfaceManager
+from dynipd.route_dump import dump_routes
 
 class InterfaceConfigTest(unittest.TestCase):
     '''Tests all aspects of the NetworkInterfaceConfig API
@@ -198,6 +201,113 @@ class InterfaceConfigTest(unittest.TestCase):
         with self.assertRaises(IPNotFound):
             interface_cfg.get_full_ip_info("10.0.21.123")
 
+    @unittest.skipIf(os.getuid() != 0, 'must be run as root')
+    def test_batch_add_and_remove(self):
+        '''Adds and removes a pile of v4 and v6 addresses with apply_ip_changes()'''
+        interface_cfg = NetworkInterfaceConfig('dummy0')
+
+        adds = [{'ip_address': '10.0.241.%d' % i, 'family': AF_INET, 'prefix_length': 24}
+                for i in range(1, 101)]
+        adds += [{'ip_address': 'fd00:a3b1:78a2::%x' % i, 'family': AF_INET6,
+                  'prefix_length': 64} for i in range(1, 101)]
+        interface_cfg.apply_ip_changes(adds=adds)
+
+        ips = interface_cfg.get_ips()
+        self.assertEqual(len(ips), 200)
+        self.assertEqual(interface_cfg.get_full_ip_info('10.0.241.50')['broadcast'],
+                         '10.0.241.255')
+
+        # Swap half of them out, and change the prefix of one we keep
+        interface_cfg.apply_ip_changes(adds=[{'ip_address': '10.0.241.1', 'family': AF_INET,
+                                              'prefix_length': 16}],
+                                       removes=[ip_dict['ip_address'] for ip_dict in adds[:100]])
+
+        ips = interface_cfg.get_ips()
+        self.assertEqual(len(ips), 101)
+        self.assertEqual(interface_cfg.get_full_ip_info('10.0.241.1')['prefix_length'], 16)
+
+    @unittest.skipIf(os.getuid() != 0, 'must be run as root')
+    def test_batch_rejected_before_sending(self):
+        '''A bad entry anywhere in a batch means nothing gets applied'''
+        interface_cfg = NetworkInterfaceConfig('dummy0')
+        interface_cfg.add_v4_ip(ip_address='10.0.241.123',
+                                prefix_length=24)
+
+        adds = [{'ip_address': '10.0.241.1', 'family': AF_INET, 'prefix_length': 24},
+                {'ip_address': '10.0.241.123', 'family': AF_INET, 'prefix_length': 24}]
+        with self.assertRaises(DuplicateIPError):
+            interface_cfg.apply_ip_changes(adds=adds)
+
+        with self.assertRaises(IPNotFound):
+            interface_cfg.apply_ip_changes(adds=adds[:1], removes=['10.0.241.2'])
+
+        self.assertEqual(len(interface_cfg.get_ips()), 1)
+
+    @unittest.skipIf(os.getuid() != 0, 'must be run as root')
+    def test_cached_lookups(self):
+        '''The cached mode follows changes made outside of NetworkInterfaceConfig'''
+        interface_cfg = NetworkInterfaceConfig('dummy0', cached=True)
+        try:
+            interface_cfg.add_v4_ip(ip_address='10.0.241.123',
+                                    prefix_length=24)
+            self.assertEqual(interface_cfg.get_full_ip_info('10.0.241.123')['prefix_length'], 24)
+
+            # Change things behind its back, and give the listening thread a moment
+            idx = self.iproute_api.link_lookup(ifname='dummy0')[0]
+            self.iproute_api.addr('add', index=idx, address='10.0.242.1', prefixlen=24)
+            self.iproute_api.addr('delete', index=idx, address='10.0.241.123', prefixlen=24)
+            time.sleep(0.1)
+
+            ips = interface_cfg.get_ips()
+            self.assertEqual([ip['ip_address'] for ip in ips], ['10.0.242.1'])
+            with self.assertRaises(IPNotFound):
+                interface_cfg.get_full_ip_info('10.0.241.123')
+        finally:
+            interface_cfg.close()
+
+    @unittest.skipIf(os.getuid() != 0, 'must be run as root')
+    def test_get_routes_filtered_by_kernel(self):
+        '''Only routes out of this interface come back, from any table but local'''
+        interface_cfg = NetworkInterfaceConfig('dummy0')
+        idx = self.iproute_api.link_lookup(ifname='dummy0')[0]
+        self.iproute_api.link('set', index=idx, state='up')
+        interface_cfg.add_v4_ip(ip_address='10.0.241.123',
+                                prefix_length=24)
+        self.iproute_api.route('add', dst='10.0.242.0/24', gateway='10.0.241.1', table=100)
+
+        # Routes elsewhere shouldn't show up. This one's in the main table, so it isn't
+        # removed along with dummy0
+        self.iproute_api.route('add', dst='10.0.243.0/24', type='blackhole')
+        self.addCleanup(self.iproute_api.route, 'del', dst='10.0.243.0/24', type='blackhole')
+
+        destinations = sorted(route.get('destination') for route in interface_cfg.get_routes())
+        self.assertEqual(destinations, ['10.0.241.0/24', '10.0.242.0/24'])
+
+        routes = list(dump_routes(AF_INET, oif=idx, table=100))
+        self.assertEqual([route.get_attr('RTA_DST') for route in routes], ['10.0.242.0'])
+
+    @unittest.skipIf(os.getuid() != 0, 'must be run as root')
+    def test_manager_views_share_dumps(self):
+        '''Views from one NetworkInterfaceManager share a socket and a snapshot'''
+        manager = NetworkInterfaceManager()
+        try:
+            interface_cfg = manager.get_interface('dummy0')
+            self.assertIs(interface_cfg, manager.get_interface('dummy0'))
+            self.assertIs(interface_cfg.iproute_api, manager.iproute_api)
+
+            interface_cfg.add_v4_ip(ip_address='10.0.241.123',
+                                    prefix_length=24)
+
+            dumps = manager.dumps
+            interface_cfg.get_full_ip_info('10.0.241.123')
+            manager.get_interface('lo').get_ips()
+            self.assertEqual(manager.dumps, dumps)
+
+            with self.assertRaises(InvalidNetworkDevice):
+                manager.get_interface('nonexistent0')
+        finally:
+            manager.close()
+
     # FIXME: All code beyond this point needs implement
     #def test_add_v4_route(self):
     #    '''Adds an IPv4 route and validates it was added successfully'''
@@ -0,0 +1,71 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import os
+import tempfile
+import unittest
+from socket import AF_INET
+
+from dynipd.node_state import NodeState, NodeStateFile
+
+class NodeStateFileTest(unittest.TestCase):
+    '''Tests saving and loading node agent state'''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'state.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        '''Everything saved comes back, and nothing is left behind but the state file'''
+        state = NodeState('node1')
+        state.set_allocations([('10.0.2.4/30', ['10.0.2.5', '10.0.2.6']),
+                               ('fd00::/126', ['fd00:0::1'])])
+        state.set_reservation_deadline('10.0.2.5', 1000.0)
+        state.record_reconciled('eth0', [{'ip_address': '10.0.2.5', 'family': AF_INET,
+                                          'prefix_length': 30, 'broadcast': '10.0.2.7'}])
+        NodeStateFile(self.path).save(state)
+
+        loaded = NodeStateFile(self.path).load('node1')
+        self.assertEqual(loaded.get_allocations(),
+                         [('10.0.2.4/30', ['10.0.2.5', '10.0.2.6']), ('fd00::/126', ['fd00::1'])])
+        self.assertEqual(loaded.reservation_deadlines, {'10.0.2.5': 1000.0})
+        self.assertEqual(loaded.get_reconciled('eth0'),
+                         [{'ip_address': '10.0.2.5', 'family': AF_INET, 'prefix_length': 30}])
+        self.assertIsNone(loaded.get_reconciled('eth1'))
+        self.assertEqual(os.listdir(self.directory.name), ['state.json'])
+
+    def test_unusable_files(self):
+        '''Missing, corrupt, old and other machines' files all mean starting over'''
+        self.assertIsNone(NodeStateFile(self.path).load())
+
+        with open(self.path, 'w') as state_file:
+            state_file.write('{"version": 1, "machine_na')
+        self.assertIsNone(NodeStateFile(self.path).load())
+
+        with open(self.path, 'w') as state_file:
+            state_file.write('{"version": 0}')
+        self.assertIsNone(NodeStateFile(self.path).load())
+
+        NodeStateFile(self.path).save(NodeState('node1'))
+        self.assertIsNone(NodeStateFile(self.path).load('node2'))
+        self.assertIsNotNone(NodeStateFile(self.path).load('node1'))
+
+    def test_expiring_reservations(self):
+        '''Reservations are renewed soonest first, and dropped along with their allocation'''
+        state = NodeState('node1')
+        state.set_allocations([('10.0.2.4/30', ['10.0.2.5', '10.0.2.6'])])
+        state.set_reservation_deadline('10.0.2.6', 100.0)
+        state.set_reservation_deadline('10.0.2.5', 50.0)
+        self.assertEqual(state.expiring_reservations(60, now=0), ['10.0.2.5'])
+        self.assertEqual(state.expiring_reservations(60, now=200), ['10.0.2.5', '10.0.2.6'])
+
+        state.set_allocations([('10.0.2.4/30', ['10.0.2.6'])])
+        self.assertEqual(state.expiring_reservations(60, now=200), ['10.0.2.6'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import os
+import tempfile
+import unittest
+from socket import AF_INET
+
+from dynipd.allocation_management import AllocationManagement
+from dynipd.benchmark import StandInDataStore, start_in_process_server
+from dynipd.config_parser import ConfigurationParser
+from dynipd.node_state import NodeState
+from dynipd.policy import StandbyPolicy, StandbyPoolManager
+from dynipd.protocol.client import AsyncDynIPClient
+from dynipd.server.executor import DatastoreExecutor
+
+class StandbyPolicyTest(unittest.TestCase):
+    '''Tests forecasting and sizing the standby pool'''
+
+    def test_forecast(self):
+        '''Demand raises the target, then decays away'''
+        policy = StandbyPolicy(low_watermark=2, demand_window=100.0, forecast_horizon=50.0,
+                               reserve_batch=1)
+        self.assertEqual(policy.target(now=0), 2)
+        self.assertEqual(policy.ips_to_reserve(2, now=0), 0)
+
+        # 20 IPs in a burst is 0.2 IPs/s, or 10 over the next 50 seconds
+        policy.record_demand(20, now=0)
+        self.assertAlmostEqual(policy.demand_rate(now=0), 0.2)
+        self.assertEqual(policy.forecast(now=0), 10)
+        self.assertEqual(policy.ips_to_reserve(2, now=0), 10)
+
+        # Ten time constants later, it's as good as forgotten
+        self.assertEqual(policy.forecast(now=1000), 0)
+        self.assertEqual(policy.ips_to_reserve(2, now=1000), 0)
+
+    def test_reserve_batch(self):
+        '''Small shortfalls are rounded up to a whole batch'''
+        policy = StandbyPolicy(low_watermark=4, reserve_batch=8)
+        self.assertEqual(policy.ips_to_reserve(3, now=0), 8)
+
+    def test_select_surplus(self):
+        '''Only unused allocations above the high watermark go back, on schedule'''
+        policy = StandbyPolicy(low_watermark=1, high_watermark=4, release_interval=60.0)
+        allocations = [('10.0.2.0/30', ['10.0.2.1', '10.0.2.2']),
+                       ('10.0.2.4/30', ['10.0.2.5', '10.0.2.6']),
+                       ('10.0.2.8/30', ['10.0.2.9', '10.0.2.10']),
+                       ('10.0.2.12/30', ['10.0.2.13', '10.0.2.14'])]
+
+        # Six standby against a high watermark of four; the busy allocation stays
+        released = policy.select_surplus(allocations, {'10.0.2.1'}, now=0)
+        self.assertEqual(len(released), 1)
+        self.assertNotEqual(released, ['10.0.2.0/30'])
+
+        # Not due again until the interval's passed
+        self.assertEqual(policy.select_surplus(allocations, set(), now=30), [])
+        self.assertEqual(len(policy.select_surplus(allocations, set(), now=60)), 2)
+
+    def test_invalid(self):
+        '''Watermarks the wrong way round are refused'''
+        with self.assertRaises(ValueError):
+            StandbyPolicy(low_watermark=8, high_watermark=4)
+
+    def test_node_configuration(self):
+        '''Node settings are read, with defaults for the rest'''
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dynipd.ini')
+            with open(path, 'w') as cfg_file:
+                cfg_file.write('[dynipd-node]\nmachine_name=node1\nlocation=TestNet\n'
+                               'low_watermark=2\n')
+            node_cfg = ConfigurationParser(path).get_node_configuration()
+
+        self.assertEqual(node_cfg['machine_name'], 'node1')
+        self.assertEqual(node_cfg['low_watermark'], 2)
+        self.assertEqual(node_cfg['high_watermark'], 16)
+
+        management = AllocationManagement(node_cfg['location'], StandbyPolicy(2))
+        self.assertEqual(management.get_policy_information()['target'], 2)
+        self.assertIsNone(AllocationManagement('TestNet').get_policy_information())
+
+class ReservingClient(object):
+    '''A client whose server has nothing left to reserve'''
+    def __init__(self):
+        self.requested = []
+
+    async def reserve(self, machine_name, location, family, count):
+        self.requested.append(count)
+        return []
+
+class StandbyPoolManagerTest(unittest.TestCase):
+    '''Tests keeping a NodeState's standby pool topped up against an in-process dynipd'''
+
+    topology = [{'id': 1, 'name': 'LOC', 'location': 'TestNet', 'family': AF_INET,
+                 'network': '10.0.2.0/24', 'allocation_size': 30, 'reserved_blocks': ''}]
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.executor = DatastoreExecutor(2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.loop.close()
+
+    def test_step(self):
+        '''The pool is filled, refilled as it's used, and trimmed once it's quiet'''
+        datastore = StandInDataStore(query_latency=0, machines=['TestMachine'],
+                                     topology=self.topology)
+        policy = StandbyPolicy(low_watermark=2, high_watermark=4, demand_window=100.0,
+                               forecast_horizon=50.0, reserve_batch=2, release_interval=60.0)
+        node_state = NodeState('TestMachine')
+
+        async def run():
+            server, port = await start_in_process_server(datastore, executor=self.executor)
+            try:
+                async with AsyncDynIPClient('127.0.0.1', port) as client:
+                    manager = StandbyPoolManager(policy, client, node_state, 'TestNet', AF_INET)
+                    steps = [await manager.step(set(), now=0)]
+
+                    # Something grabs both standby IPs
+                    utilized = set(manager.standby_ips())
+                    steps.append(await manager.step(utilized, now=1))
+                    standby = len(manager.standby_ips())
+
+                    # Long after, with everything let go
+                    steps.append(await manager.step(set(), now=10000))
+                    return (steps, standby, len(manager.standby_ips()))
+            finally:
+                server.close()
+                await server.wait_closed()
+
+                # Give the handler a turn to see the client's gone and stop the idle reaper
+                await asyncio.sleep(0.1)
+
+        steps, standby, final_standby = self.loop.run_until_complete(run())
+        self.assertEqual(sum(len(ips) for _, ips in steps[0]['reserved']), 2)
+        self.assertEqual(steps[0]['released'], [])
+
+        # Two used up is a forecast of one more over the horizon, on top of the low watermark
+        self.assertEqual(sum(len(ips) for _, ips in steps[1]['reserved']), 3)
+        self.assertEqual(standby, 3)
+
+        # Five standby against a high watermark of four; the allocation only partly filled
+        # by the last RESERVE is just the right size to give back
+        self.assertEqual(steps[2]['reserved'], [])
+        self.assertEqual(len(steps[2]['released']), 1)
+        self.assertEqual(final_standby, 4)
+        self.assertEqual(len(node_state.reservation_deadlines), 4)
+
+        # The server got the allocation back, rather than waiting for it to expire
+        self.assertEqual(datastore.get_networks()[0].allocations_used, 2)
+
+    def test_restart(self):
+        '''IPs already in use when we start aren't mistaken for new demand'''
+        datastore = StandInDataStore(query_latency=0, machines=['TestMachine'],
+                                     topology=self.topology)
+        policy = StandbyPolicy(low_watermark=2, high_watermark=4, demand_window=100.0,
+                               forecast_horizon=50.0, reserve_batch=2)
+
+        # What the last run left behind: four IPs, all of them in use
+        node_state = NodeState('TestMachine')
+        node_state.set_allocations([('10.0.2.0/30', ['10.0.2.1', '10.0.2.2']),
+                                    ('10.0.2.4/30', ['10.0.2.5', '10.0.2.6'])])
+        utilized = {'10.0.2.1', '10.0.2.2', '10.0.2.5', '10.0.2.6'}
+
+        async def run():
+            server, port = await start_in_process_server(datastore, executor=self.executor)
+            try:
+                async with AsyncDynIPClient('127.0.0.1', port) as client:
+                    manager = StandbyPoolManager(policy, client, node_state, 'TestNet', AF_INET)
+                    return await manager.step(utilized, now=0)
+            finally:
+                server.close()
+                await server.wait_closed()
+                await asyncio.sleep(0.1)
+
+        step = self.loop.run_until_complete(run())
+        self.assertEqual(policy.demand_total, 0)
+        self.assertEqual(sum(len(ips) for _, ips in step['reserved']), 2)
+
+    def test_untested(self):
+        '''IPs that haven't passed a probe yet don't count as standby'''
+        client = ReservingClient()
+        node_state = NodeState('TestMachine')
+        node_state.set_allocations([('10.0.2.4/30', ['10.0.2.5', '10.0.2.6'])])
+        manager = StandbyPoolManager(StandbyPolicy(low_watermark=2, reserve_batch=1), client,
+                                     node_state, 'TestNet', AF_INET)
+
+        self.loop.run_until_complete(manager.step(set(), now=0, untested_ips={'10.0.2.6'}))
+        self.loop.run_until_complete(manager.step(set(), now=1))
+        self.assertEqual(client.requested, [1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import unittest
+from unittest import mock
+
+from dynipd.benchmark import start_in_process_server
+from dynipd.datastore_errors import PoolExhausted
+from dynipd.mysql_datastore import MySQLDataStore
+from dynipd.protocol.client import AsyncDynIPClient, DynIPServerError
+from dynipd.server.executor import DatastoreExecutor
+
+class FakeCursor(object):
+    '''Answers every query with the same machine row'''
+    def execute(self, query, arguments=None):
+        pass
+
+    def fetchone(self):
+        return {'id': 1, 'name': 'TestMachine', 'token': 'sometoken'}
+
+class FakeConnection(object):
+    '''A pooled connection; closing it hands it back to its pool'''
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self, dictionary=False):
+        # pylint: disable=unused-argument
+        return FakeCursor()
+
+    def close(self):
+        self.pool.checked_out -= 1
+
+class FakePool(object):
+    '''Stands in for MySQLConnectionPool, which raises PoolError the moment it runs dry'''
+    def __init__(self, pool_name, pool_size, **db_info):
+        # pylint: disable=unused-argument
+        self.pool_size = pool_size
+        self.checked_out = 0
+
+    def get_connection(self):
+        if self.checked_out == self.pool_size:
+            raise AssertionError('pool ran dry past the semaphore')
+        self.checked_out += 1
+        return FakeConnection(self)
+
+class PoolCheckoutTest(unittest.TestCase):
+    '''Tests waiting for, timing out on and swapping MySQLDataStore's connection pool'''
+
+    def setUp(self):
+        patcher = mock.patch('mysql.connector.pooling.MySQLConnectionPool', FakePool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.datastore = MySQLDataStore({'host': 'db1'}, pool_size=1, checkout_timeout=0.05)
+
+    def test_checkout_timeout(self):
+        '''Checkouts beyond the pool size wait, then raise PoolExhausted'''
+        with self.datastore._connection(): # pylint: disable=protected-access
+            with self.assertRaises(PoolExhausted):
+                self.datastore.get_machine('TestMachine')
+            self.assertEqual(self.datastore.get_pool_stats()['checked_out'], 1)
+
+        stats = self.datastore.get_pool_stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual(self.datastore.get_machine('TestMachine')['name'], 'TestMachine')
+
+    def test_reconfigure(self):
+        '''A checkout in progress keeps the old pool; new ones get the new pool in full'''
+        # pylint: disable=protected-access
+        old_pool, _ = self.datastore._pool
+        with self.datastore._connection():
+            self.assertTrue(self.datastore.reconfigure(pool_size=2))
+            new_pool, _ = self.datastore._pool
+            with self.datastore._connection(), self.datastore._connection():
+                self.assertEqual(new_pool.checked_out, 2)
+
+        self.assertEqual(old_pool.checked_out, 0)
+        self.assertEqual(new_pool.checked_out, 0)
+        self.assertFalse(self.datastore.reconfigure(db_info_dict={'host': 'db1'}))
+
+    def test_busy_response(self):
+        '''A request that can't get a connection is answered with 503'''
+        loop = asyncio.new_event_loop()
+        executor = DatastoreExecutor(1)
+
+        async def run():
+            server, port = await start_in_process_server(self.datastore, executor=executor)
+            try:
+                async with AsyncDynIPClient('127.0.0.1', port, busy_retries=0) as client:
+                    with self.datastore._connection(): # pylint: disable=protected-access
+                        with self.assertRaises(DynIPServerError) as raised:
+                            await client.renew('TestMachine', ['10.0.2.5'])
+                    return raised.exception
+            finally:
+                server.close()
+                await server.wait_closed()
+                await asyncio.sleep(0.1)
+
+        try:
+            error = loop.run_until_complete(run())
+        finally:
+            executor.shutdown()
+            loop.close()
+
+        self.assertEqual(error.status, 503)
+        self.assertIsNotNone(error.retry_after)
+        self.assertEqual(self.datastore.get_pool_stats()['timeouts'], 1)
+
+if __name__ == "__main__":
+    unittest.main()
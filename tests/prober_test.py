@@ -0,0 +1,74 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import unittest
+
+from dynipd.prober import ConnectivityProber
+
+class EchoServer(object):
+    '''Echoes lines back, keeping track of how many clients it has at once'''
+    def __init__(self, echo=True):
+        self.echo = echo
+        self.clients = 0
+        self.most_clients = 0
+        self.sources = []
+
+    async def handle(self, reader, writer):
+        self.clients += 1
+        self.most_clients = max(self.most_clients, self.clients)
+        self.sources.append(writer.get_extra_info('peername')[0])
+        try:
+            line = await reader.readline()
+            await asyncio.sleep(0.01)
+            if self.echo:
+                writer.write(line)
+                await writer.drain()
+            else:
+                await reader.read()
+        finally:
+            self.clients -= 1
+            writer.close()
+
+class ConnectivityProberTest(unittest.TestCase):
+    '''Tests probing against a local echo server'''
+
+    def run_probes(self, echo_server, ip_addresses, **kwargs):
+        '''Starts the echo server, and probes ip_addresses against it'''
+        async def probe():
+            server = await asyncio.start_server(echo_server.handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            prober = ConnectivityProber(v4_endpoint=('127.0.0.1', port), **kwargs)
+            try:
+                return [result async for result in prober.probe_many(ip_addresses)]
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        return asyncio.run(probe())
+
+    def test_concurrent_probes(self):
+        '''Every source is probed from its own address, with bounded concurrency'''
+        echo_server = EchoServer()
+        ip_addresses = ['127.0.86.%d' % host for host in range(1, 101)]
+        results = self.run_probes(echo_server, ip_addresses, concurrency=10)
+
+        self.assertEqual(sorted(result['ip_address'] for result in results),
+                         sorted(ip_addresses))
+        self.assertTrue(all(result['reachable'] for result in results))
+        self.assertEqual(sorted(echo_server.sources), sorted(ip_addresses))
+        self.assertLessEqual(echo_server.most_clients, 10)
+        self.assertGreater(echo_server.most_clients, 1)
+
+    def test_failures(self):
+        '''Silence times out, and sources without an endpoint fail straight away'''
+        results = self.run_probes(EchoServer(echo=False), ['127.0.86.1', 'fd00::1'],
+                                  timeout=0.2)
+        errors = {result['ip_address']: result['error'] for result in results}
+        self.assertEqual(errors, {'127.0.86.1': 'timed out', 'fd00::1': 'no endpoint for IPv6'})
+        self.assertFalse(any(result['reachable'] for result in results))
+
+if __name__ == "__main__":
+    unittest.main()
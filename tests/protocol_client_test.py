@@ -0,0 +1,108 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import unittest
+from socket import AF_INET
+
+from dynipd.benchmark import StandInDataStore, start_in_process_server
+from dynipd.protocol.client import AsyncDynIPClient, DynIPClient, DynIPServerError, \
+    DynIPConnectionError, parse_reservations
+
+class AsyncDynIPClientTest(unittest.TestCase):
+    '''Tests the client against an in-process dynipd'''
+
+    topology = [{'id': 1, 'name': 'LOC', 'location': 'TestNet', 'family': AF_INET,
+                 'network': '10.0.2.0/24', 'allocation_size': 30, 'reserved_blocks': ''}]
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.datastore = StandInDataStore(query_latency=0, machines=['TestMachine'],
+                                          topology=self.topology)
+        self.server, self.port = self.loop.run_until_complete(
+            start_in_process_server(self.datastore, pool_size=2))
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def test_pipelined_requests(self):
+        '''Many requests share one connection, and responses match up with requests'''
+        async def run():
+            async with AsyncDynIPClient('127.0.0.1', self.port) as client:
+                responses = await client.request_many(['TEST', 'STATS', 'TEST'])
+                reservations = await asyncio.gather(
+                    *[client.reserve('TestMachine', 'TestNet', AF_INET, 2) for _ in range(5)])
+                with self.assertRaises(DynIPServerError) as error:
+                    await client.request('BOGUS')
+                self.assertEqual(error.exception.status, 400)
+                self.assertEqual(await client.test(), 'test')
+                return (client.connects, responses, reservations)
+
+        connects, responses, reservations = self.loop.run_until_complete(run())
+        self.assertEqual(connects, 1)
+        self.assertEqual(responses[0], 'test')
+        self.assertTrue(responses[1].startswith('200 '))
+        self.assertEqual(responses[2], 'test')
+
+        ips = [ip for reservation in reservations for _, ip_addresses in reservation
+               for ip in ip_addresses]
+        self.assertEqual(len(ips), 10)
+        self.assertEqual(len(set(ips)), 10)
+
+    def test_reconnect(self):
+        '''A lost connection fails what was in flight, and the next request reconnects'''
+        async def run():
+            client = AsyncDynIPClient('127.0.0.1', self.port, backoff_start=0.01)
+            await client.connect()
+
+            # Yank the connection out from under the client
+            client._writer.transport.abort() # pylint: disable=protected-access
+            await asyncio.sleep(0.05)
+
+            response = await client.test()
+            await client.close()
+            with self.assertRaises(DynIPConnectionError):
+                await client.test()
+            return (client.connects, response)
+
+        self.assertEqual(self.loop.run_until_complete(run()), (2, 'test'))
+
+    def test_connect_gives_up(self):
+        '''Connecting somewhere nothing is listening eventually raises'''
+        async def run():
+            client = AsyncDynIPClient('127.0.0.1', 1, backoff_start=0.01, connect_attempts=3)
+            with self.assertRaises(DynIPConnectionError):
+                await client.test()
+
+        self.loop.run_until_complete(run())
+
+    def test_blocking_client(self):
+        '''The blocking client drives the same connection from a background loop'''
+        # The server needs its loop running while the blocking client waits on it
+        server_loop = self.loop
+
+        async def run():
+            def blocking_calls():
+                with DynIPClient('127.0.0.1', self.port, timeout=5) as client:
+                    return (client.test(), client.reserve('TestMachine', 'TestNet', AF_INET, 1),
+                            client.request_many(['TEST', 'TEST']))
+            return await server_loop.run_in_executor(None, blocking_calls)
+
+        test, reservation, responses = server_loop.run_until_complete(run())
+        self.assertEqual(test, 'test')
+        self.assertEqual(len(reservation[0][1]), 1)
+        self.assertEqual(responses, ['test', 'test'])
+
+    def test_parse_reservations(self):
+        '''RESERVE responses come back as (CIDR, [IPs])'''
+        self.assertEqual(parse_reservations('200 10.0.2.4/30=10.0.2.5,10.0.2.6 '
+                                            '10.0.2.8/30=10.0.2.9'),
+                         [('10.0.2.4/30', ['10.0.2.5', '10.0.2.6']),
+                          ('10.0.2.8/30', ['10.0.2.9'])])
+
+if __name__ == "__main__":
+    unittest.main()
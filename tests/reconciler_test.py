@@ -0,0 +1,132 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import unittest
+from socket import AF_INET, AF_INET6
+
+from dynipd.benchmark import StandInDataStore, start_in_process_server
+from dynipd.protocol.client import AsyncDynIPClient, parse_reservations
+from dynipd.reconciler import IPReconciler, desired_ips_from_allocations
+
+class RecordingInterface(object):
+    '''Stands in for NetworkInterfaceConfig, recording what the reconciler does with it'''
+    def __init__(self, ips):
+        self.ips = ips
+        self.dumps = 0
+        self.applied = []
+
+    def get_ips(self):
+        self.dumps += 1
+        return [dict(ip_dict) for ip_dict in self.ips]
+
+    def apply_ip_changes(self, adds=None, removes=None, configured_ips=None):
+        self.applied.append((adds, removes, configured_ips))
+
+def ip_dict(ip_address, prefix_length, family=AF_INET):
+    '''Shorthand for an ip_dict'''
+    return {'ip_address': ip_address, 'family': family, 'prefix_length': prefix_length}
+
+class IPReconcilerTest(unittest.TestCase):
+    '''Tests the diffing and applying of desired IP state'''
+
+    def test_converged_is_one_dump(self):
+        '''Nothing is sent when the interface already matches'''
+        interface_cfg = RecordingInterface([ip_dict('10.0.2.5', 24),
+                                            ip_dict('fe80::1', 64, AF_INET6)])
+        reconciler = IPReconciler(interface_cfg)
+
+        self.assertEqual(reconciler.reconcile([ip_dict('10.0.2.5', 24)]), ([], []))
+        self.assertEqual(interface_cfg.dumps, 1)
+        self.assertEqual(interface_cfg.applied, [])
+
+    def test_minimal_diff(self):
+        '''Only missing IPs are added, and only stale managed IPs are removed'''
+        interface_cfg = RecordingInterface([ip_dict('10.0.2.5', 24),
+                                            ip_dict('10.0.2.6', 24),
+                                            ip_dict('192.168.1.1', 24),
+                                            ip_dict('fe80::1', 64, AF_INET6)])
+        reconciler = IPReconciler(interface_cfg, managed_networks=['10.0.0.0/16',
+                                                                   'fd00::/48'])
+
+        adds, removes = reconciler.reconcile([ip_dict('10.0.2.5', 24),
+                                              ip_dict('fd00::0:5', 64, AF_INET6)])
+        self.assertEqual([add['ip_address'] for add in adds], ['fd00::5'])
+        self.assertEqual(removes, ['10.0.2.6'])
+
+        # The dump we planned against is handed over, rather than dumping again
+        self.assertEqual(interface_cfg.dumps, 1)
+        self.assertEqual(len(interface_cfg.applied), 1)
+        self.assertEqual(len(interface_cfg.applied[0][2]), 4)
+
+    def test_prefix_change_is_reconfigured(self):
+        '''An IP with the wrong prefix length is removed and added back'''
+        interface_cfg = RecordingInterface([ip_dict('10.0.2.5', 24)])
+        adds, removes = IPReconciler(interface_cfg).reconcile([ip_dict('10.0.2.5', 30)])
+        self.assertEqual([(add['ip_address'], add['prefix_length']) for add in adds],
+                         [('10.0.2.5', 30)])
+        self.assertEqual(removes, ['10.0.2.5'])
+
+    def test_duplicate_desired_ip(self):
+        '''The same IP listed twice, however it's written, is rejected'''
+        reconciler = IPReconciler(RecordingInterface([]))
+        with self.assertRaises(ValueError):
+            reconciler.plan([ip_dict('fd00::5', 64, AF_INET6),
+                             ip_dict('fd00:0::0:5', 64, AF_INET6)], [])
+
+    def test_desired_ips_from_allocations(self):
+        '''RESERVE results become ip_dicts with the prefix length of their network'''
+        allocations = parse_reservations('200 10.0.2.4/30=10.0.2.5,10.0.2.6 '
+                                         'fd00::/64=fd00::1')
+        desired_ips = desired_ips_from_allocations(allocations, ['10.0.0.0/16', '10.0.2.0/24',
+                                                                 'fd00::/48'])
+        self.assertEqual(desired_ips, [ip_dict('10.0.2.5', 24), ip_dict('10.0.2.6', 24),
+                                       ip_dict('fd00::1', 48, AF_INET6)])
+
+        # Without the network, we don't know what's on-link
+        desired_ips = desired_ips_from_allocations(allocations)
+        self.assertEqual(desired_ips, [ip_dict('10.0.2.5', 32), ip_dict('10.0.2.6', 32),
+                                       ip_dict('fd00::1', 128, AF_INET6)])
+
+        with self.assertRaises(ValueError):
+            desired_ips_from_allocations([('10.0.2.4/30', ['10.0.2.9'])])
+
+    def test_reserved_host_allocations(self):
+        '''Single IP allocations from a real RESERVE can be configured'''
+        topology = [{'id': 1, 'name': 'LOC', 'location': 'TestNet', 'family': AF_INET,
+                     'network': '10.0.2.0/24', 'allocation_size': 32, 'reserved_blocks': ''}]
+        datastore = StandInDataStore(query_latency=0, machines=['TestMachine'],
+                                     topology=topology)
+
+        async def run():
+            server, port = await start_in_process_server(datastore, pool_size=1)
+            client = AsyncDynIPClient('127.0.0.1', port)
+            try:
+                return await client.reserve('TestMachine', 'TestNet', AF_INET, 2)
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+
+        loop = asyncio.new_event_loop()
+        try:
+            allocations = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual(allocations, [('10.0.2.1/32', ['10.0.2.1']),
+                                       ('10.0.2.2/32', ['10.0.2.2'])])
+
+        adds, _ = IPReconciler(RecordingInterface([]), ['10.0.2.0/24']).reconcile(
+            desired_ips_from_allocations(allocations, ['10.0.2.0/24']))
+        self.assertEqual([(add['ip_address'], add['prefix_length']) for add in adds],
+                         [('10.0.2.1', 24), ('10.0.2.2', 24)])
+
+        adds, _ = IPReconciler(RecordingInterface([])).reconcile(
+            desired_ips_from_allocations(allocations))
+        self.assertEqual([(add['ip_address'], add['prefix_length']) for add in adds],
+                         [('10.0.2.1', 32), ('10.0.2.2', 32)])
+
+if __name__ == "__main__":
+    unittest.main()
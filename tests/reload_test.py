@@ -0,0 +1,164 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import os
+import socket
+import tempfile
+import unittest
+from socket import AF_INET
+from unittest import mock
+
+from dynipd.benchmark import StandInDataStore
+from dynipd.network_block import NetworkBlock
+from dynipd.server.admission import AdmissionControl, PRIORITY_NEW
+from dynipd.server.event_bus import EventBus
+from dynipd.server.executor import DatastoreExecutor
+from dynipd.server.reload import ConfigurationReloader, ReloadError, diff_settings
+from dynipd.server.server_state import ServerState
+
+CONFIGURATION = '''
+[dynipd-database]
+host=127.0.0.1
+user=dynipd
+password=%(password)s
+database=dynipd
+
+[dynipd-server]
+pool_size=%(pool_size)s
+idle_timeout=%(idle_timeout)s
+listen_backlog=64
+metrics_port=%(metrics_port)s
+'''
+
+class ConfigurationReloaderTest(unittest.TestCase):
+    '''Tests applying a changed configuration file to a running server'''
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'dynipd.ini')
+        self.server_state = ServerState(StandInDataStore(query_latency=0), EventBus(),
+                                        DatastoreExecutor(2))
+        self.listening_socket = socket.socket()
+        self.listening_socket.bind(('127.0.0.1', 0))
+        self.listening_socket.listen(16)
+
+    def tearDown(self):
+        self.listening_socket.close()
+        self.server_state.executor.shutdown()
+        self.directory.cleanup()
+        self.loop.close()
+
+    def write_configuration(self, **settings):
+        '''Writes the configuration file with settings filled in'''
+        values = {'password': 'secret', 'pool_size': 2, 'idle_timeout': 10.0,
+                  'metrics_port': 9888}
+        values.update(settings)
+        with open(self.path, 'w') as cfg_file:
+            cfg_file.write(CONFIGURATION % values)
+
+    def test_reload(self):
+        '''Changed settings are applied to the running objects, and only those are reported'''
+        self.write_configuration()
+        server_cfg = {'pool_size': 2, 'checkout_timeout': 5.0, 'read_freshness': 0.5,
+                      'idle_timeout': 10.0, 'drain_timeout': 30.0, 'max_queued_requests': 256,
+                      'listen_backlog': 64, 'metrics_host': '127.0.0.1', 'metrics_port': 9888}
+        database_cfg = {'host': '127.0.0.1', 'user': 'dynipd', 'password': 'secret',
+                        'database': 'dynipd'}
+        reloader = ConfigurationReloader(self.path, self.server_state, server_cfg,
+                                         database_cfg, [self.listening_socket])
+        old_executor = self.server_state.executor
+
+        self.write_configuration(pool_size=4, idle_timeout=2.5, password='hunter2',
+                                 metrics_port=9889)
+        changes = self.loop.run_until_complete(reloader.reload())
+
+        self.assertEqual(changes['settings'], {'pool_size': (2, 4),
+                                               'idle_timeout': (10.0, 2.5),
+                                               'database.password': ('*', '*')})
+        self.assertEqual(changes['restart_required'], {'metrics_port': (9888, 9889)})
+        self.assertEqual(self.server_state.executor.max_workers, 4)
+        self.assertIsNot(self.server_state.executor, old_executor)
+        self.assertEqual(self.server_state.admission.slots, 4)
+        self.assertEqual(self.server_state.idle_reaper.idle_timeout, 2.5)
+        self.assertEqual(server_cfg['pool_size'], 4)
+        self.assertEqual(database_cfg['password'], 'hunter2')
+
+        self.assertEqual(server_cfg['metrics_port'], 9888)
+
+        # Reloading the same file again changes nothing, but still needs a restart
+        changes = self.loop.run_until_complete(reloader.reload())
+        self.assertEqual(changes['settings'], {})
+        self.assertEqual(changes['restart_required'], {'metrics_port': (9888, 9889)})
+        self.assertEqual(reloader.reloads, 2)
+
+    def test_removed_database_setting(self):
+        '''A database setting taken out of the file is dropped, not reported again'''
+        self.write_configuration()
+        server_cfg = {'pool_size': 2}
+        database_cfg = {'host': '127.0.0.1', 'port': 3306, 'user': 'dynipd',
+                        'password': 'secret', 'database': 'dynipd'}
+        reloader = ConfigurationReloader(self.path, self.server_state, server_cfg, database_cfg)
+
+        changes = self.loop.run_until_complete(reloader.reload())
+        self.assertEqual(changes['settings']['database.port'], (3306, None))
+        self.assertNotIn('port', database_cfg)
+
+        # The pool isn't rebuilt again for a setting that's already gone
+        with mock.patch.object(self.server_state.datastore, 'reconfigure') as reconfigure:
+            changes = self.loop.run_until_complete(reloader.reload())
+        self.assertEqual(changes['settings'], {})
+        reconfigure.assert_not_called()
+
+    def test_bad_configuration(self):
+        '''An invalid file leaves everything as it was'''
+        self.write_configuration(pool_size=99)
+        server_cfg = {'pool_size': 2}
+        reloader = ConfigurationReloader(self.path, self.server_state, server_cfg, {})
+        with self.assertRaises(ReloadError):
+            self.loop.run_until_complete(reloader.reload())
+        self.assertEqual(self.server_state.executor.max_workers, 2)
+        self.assertEqual(server_cfg, {'pool_size': 2})
+
+    def test_admission_resize(self):
+        '''Growing admission control lets waiting writes straight in'''
+        admission = AdmissionControl(slots=1)
+
+        async def run():
+            release = asyncio.Event()
+            tasks = [asyncio.ensure_future(admission.run(PRIORITY_NEW, release.wait))
+                     for _ in range(3)]
+            await asyncio.sleep(0)
+            self.assertEqual(admission.waiting(), 2)
+
+            admission.resize(3)
+            await asyncio.sleep(0)
+            self.assertEqual(admission.waiting(), 0)
+
+            # Shrinking lets running writes finish
+            admission.resize(1)
+            release.set()
+            await asyncio.gather(*tasks)
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(admission.admitted, 3)
+
+    def test_network_block_definition(self):
+        '''NetworkBlocks know whether a topology row still describes them'''
+        row = {'id': 1, 'name': 'LOC', 'location': 'TestNet', 'family': AF_INET,
+               'network': '10.0.2.0/24', 'allocation_size': 30, 'reserved_blocks': ''}
+        network_block = NetworkBlock(row, None)
+        self.assertTrue(network_block.is_defined_by(dict(row)))
+        self.assertFalse(network_block.is_defined_by(dict(row, allocation_size=29)))
+        self.assertFalse(network_block.is_defined_by(dict(row, network='10.0.3.0/24')))
+
+    def test_diff_settings(self):
+        '''Added, removed and changed keys are all reported'''
+        self.assertEqual(diff_settings({'a': 1, 'b': 2}, {'b': 3, 'c': 4}, prefix='x.'),
+                         {'x.a': (1, None), 'x.b': (2, 3), 'x.c': (None, 4)})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import asyncio
+import threading
+import time
+import unittest
+
+from dynipd.server.single_flight import SingleFlight
+
+class CountingQuery(object):
+    '''Stands in for a slow datastore query and counts how often it actually runs'''
+    def __init__(self, delay=0.05, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, value):
+        with self._lock:
+            self.count += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ValueError('query failed')
+        return value
+
+class TestSingleFlight(unittest.TestCase):
+    '''Tests that SingleFlight coalesces identical calls'''
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def _run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_concurrent_calls_share_one_query(self):
+        '''A burst of identical requests only runs the query once'''
+        single_flight = SingleFlight()
+        query = CountingQuery()
+
+        results = self._run(asyncio.gather(*[single_flight.do('topology', query, 'result')
+                                             for _ in range(1000)]))
+
+        self.assertEqual(query.count, 1)
+        self.assertEqual(results, ['result'] * 1000)
+        self.assertEqual(single_flight.calls, 1000)
+        self.assertEqual(single_flight.executions, 1)
+
+    def test_different_keys_are_not_coalesced(self):
+        '''Reads for different keys each get their own query'''
+        single_flight = SingleFlight()
+        query = CountingQuery()
+
+        results = self._run(asyncio.gather(single_flight.do(('machine', 'a'), query, 'a'),
+                                           single_flight.do(('machine', 'b'), query, 'b')))
+        self.assertEqual(results, ['a', 'b'])
+        self.assertEqual(query.count, 2)
+
+    def test_freshness_window(self):
+        '''Results are reused inside the freshness window, and requeried after it'''
+        single_flight = SingleFlight(freshness=0.1)
+        query = CountingQuery(delay=0)
+
+        self._run(single_flight.do('topology', query, 'result'))
+        self._run(single_flight.do('topology', query, 'result'))
+        self.assertEqual(query.count, 1)
+
+        self._run(asyncio.sleep(0.15))
+        self._run(single_flight.do('topology', query, 'result'))
+        self.assertEqual(query.count, 2)
+
+    def test_failures_are_not_cached(self):
+        '''Every waiter sees the error, and the next call retries'''
+        single_flight = SingleFlight(freshness=10)
+        query = CountingQuery(fail=True)
+
+        results = self._run(asyncio.gather(single_flight.do('topology', query, 'result'),
+                                           single_flight.do('topology', query, 'result'),
+                                           return_exceptions=True))
+        self.assertEqual(query.count, 1)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+
+        query.fail = False
+        self.assertEqual(self._run(single_flight.do('topology', query, 'result')), 'result')
+        self.assertEqual(query.count, 2)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,73 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import socket
+import unittest
+
+from dynipd.utilization import UtilizationScanner
+
+class UtilizationScannerTest(unittest.TestCase):
+    '''Tests socket counting through sock_diag, using addresses in 127/8'''
+
+    def setUp(self):
+        self.scanner = UtilizationScanner()
+        self.sockets = []
+
+    def tearDown(self):
+        self.scanner.close()
+        for open_socket in self.sockets:
+            open_socket.close()
+
+    def listen(self, ip_address, family=socket.AF_INET):
+        '''Opens a listening TCP socket on an address'''
+        listener = socket.socket(family)
+        listener.bind((ip_address, 0))
+        listener.listen()
+        self.sockets.append(listener)
+        return listener
+
+    def test_only_changes_are_reported(self):
+        '''Counts are reported when they change, and drop to 0 when sockets go away'''
+        ip_addresses = ['127.0.83.1', '127.0.83.2']
+        self.assertEqual(self.scanner.scan(ip_addresses), {})
+
+        listener = self.listen('127.0.83.1')
+        client = socket.create_connection(listener.getsockname())
+        self.sockets.append(client)
+        server, _ = listener.accept()
+        self.sockets.append(server)
+
+        # The listener and the accepted connection; the client's source is 127.0.0.1
+        self.assertEqual(self.scanner.scan(ip_addresses), {'127.0.83.1': 2})
+        self.assertEqual(self.scanner.scan(ip_addresses), {})
+
+        server.close()
+        client.close()
+        listener.close()
+        self.assertEqual(self.scanner.scan(ip_addresses), {'127.0.83.1': 0})
+
+    def test_other_addresses_ignored(self):
+        '''Sockets on neighbouring addresses and wildcard listeners aren't counted'''
+        self.listen('127.0.84.2')
+        self.listen('127.0.84.3')
+        self.listen('0.0.0.0')
+        self.assertEqual(self.scanner.scan(['127.0.84.2']), {'127.0.84.2': 1})
+
+    def test_udp_and_v4_mapped(self):
+        '''Bound UDP sockets count, as do dual-stack sockets on a v4-mapped address'''
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind(('127.0.85.1', 0))
+        self.sockets.append(udp)
+
+        try:
+            self.listen('::ffff:127.0.85.2', socket.AF_INET6)
+        except OSError:
+            self.skipTest('no IPv6 support')
+
+        self.assertEqual(self.scanner.scan(['127.0.85.1', '127.0.85.2']),
+                         {'127.0.85.1': 1, '127.0.85.2': 1})
+
+if __name__ == "__main__":
+    unittest.main()
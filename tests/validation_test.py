@@ -0,0 +1,148 @@
+'''
+Created on Oct 19, 2026
+
+@author: mcasadevall
+'''
+import array
+import ipaddress
+import unittest
+from socket import AF_INET, AF_INET6
+
+from dynipd import validation
+from dynipd.allocation import Allocation
+from dynipd.validation import ValidationAndNormlization as check
+from dynipd.validation import format_ip, format_network, parse_ip, parse_network, \
+    validate_ip_batch, BATCH_OK, BATCH_BROADCAST_ADDRESS, BATCH_INVALID_ADDRESS, \
+    BATCH_INVALID_PREFIX, BATCH_LINK_LOCAL, BATCH_LOOPBACK, BATCH_MULTICAST, \
+    BATCH_NETWORK_ADDRESS, BATCH_RESERVED, BATCH_WRONG_FAMILY
+
+class IntegerIPTest(unittest.TestCase):
+    '''Tests the (family, integer) representation of IPs and networks'''
+
+    def test_round_trip(self):
+        '''Addresses and networks come back out normalized'''
+        self.assertEqual(parse_ip('192.0.2.1'), (AF_INET, 0xc0000201))
+        self.assertEqual(format_ip(*parse_ip('2001:db8::0001')), '2001:db8::1')
+        self.assertEqual(format_ip(*parse_ip('::ffff:1.2.3.4')), '::ffff:102:304')
+        self.assertEqual(parse_network('2001:db8::/32'), (AF_INET6, 0x20010db8 << 96, 32))
+        self.assertEqual(format_network(*parse_network('192.0.2.5/24', strict=False)),
+                         '192.0.2.0/24')
+        self.assertEqual(check.validate_and_normalize_ip('fe80::01%eth0'), 'fe80::1%eth0')
+
+    def test_invalid(self):
+        '''Anything ipaddress would refuse is refused'''
+        for ip_address in ['010.0.0.1', '1.2.3', '300.1.1.1', ' 1.1.1.1', '']:
+            with self.assertRaises(ValueError):
+                parse_ip(ip_address)
+
+        for ip_network in ['192.0.2.1/24', '192.0.2.0/33', '::/129', '192.0.2.0/-1']:
+            with self.assertRaises(ValueError):
+                parse_network(ip_network)
+
+    def test_containment(self):
+        '''IPs and CIDR blocks are compared without building network objects'''
+        self.assertTrue(check.is_ip_within_block('192.0.2.255', '192.0.2.0/24'))
+        self.assertFalse(check.is_ip_within_block('192.0.3.0', '192.0.2.0/24'))
+        self.assertFalse(check.is_ip_within_block('::1', '0.0.0.0/0'))
+        self.assertTrue(check.do_cidr_blocks_overlap('192.0.2.64/26', '192.0.0.0/16'))
+        self.assertFalse(check.do_cidr_blocks_overlap('192.0.2.64/26', '192.0.2.128/26'))
+
+    def test_ip_dict(self):
+        '''ip_dicts are normalized and get their broadcast address'''
+        ip_dict = check.validate_and_normalize_ip_dict({'ip_address': '192.0.2.5',
+                                                        'family': AF_INET,
+                                                        'prefix_length': 30})
+        self.assertEqual(ip_dict['broadcast'], '192.0.2.7')
+
+        for ip_address in ['192.0.2.4', '192.0.2.7']:
+            with self.assertRaises(ValueError):
+                check.validate_and_normalize_ip_dict({'ip_address': ip_address,
+                                                      'family': AF_INET,
+                                                      'prefix_length': 30})
+
+        with self.assertRaises(ValueError):
+            check.validate_and_normalize_ip_dict({'ip_address': '::1', 'family': AF_INET6,
+                                                  'prefix_length': 128})
+
+        # A host address has no network or broadcast address to trip over
+        ip_dict = check.validate_and_normalize_ip_dict({'ip_address': '192.0.2.7',
+                                                        'family': AF_INET,
+                                                        'prefix_length': 32})
+        self.assertEqual(ip_dict['ip_address'], '192.0.2.7')
+        self.assertEqual(validate_ip_batch(AF_INET, ['192.0.2.7'], 32)[1], [BATCH_OK])
+
+    def test_reserve_whole_allocation(self):
+        '''Reserving every IP in an allocation skips the network and broadcast addresses'''
+        allocation = Allocation('192.0.2.0/29')
+        reserved = allocation.reserve_unused_ips(10)
+        self.assertEqual([str(ip_address) for ip_address in reserved],
+                         ['192.0.2.%d' % host for host in range(1, 7)])
+
+        with self.assertRaises(ValueError):
+            allocation.mark_ip_as_reserved('192.0.2.3')
+
+    def test_memoized_checks(self):
+        '''Repeat checks of a network or IP are answered from the cache'''
+        # pylint: disable=protected-access
+        network = ipaddress.ip_network('198.51.100.0/30')
+        check.confirm_valid_network(network)
+        hits = validation._unusable_network.cache_info().hits
+        for _ in range(3):
+            self.assertIs(check.confirm_valid_network(network), network)
+        self.assertEqual(validation._unusable_network.cache_info().hits, hits+3)
+
+        # Errors are the same whether cached or not
+        for _ in range(2):
+            with self.assertRaisesRegex(ValueError, 'loopback'):
+                check.confirm_valid_network(ipaddress.ip_network('127.0.0.0/8'))
+            with self.assertRaisesRegex(ValueError, 'link-local'):
+                check.confirm_valid_network(ipaddress.ip_network('fe80::/64'))
+            with self.assertRaises(ValueError):
+                check.validate_and_normalize_ip('2001:db8::g')
+            self.assertEqual(check.validate_and_normalize_ip('2001:DB8:0::5'), '2001:db8::5')
+
+class BatchValidationTest(unittest.TestCase):
+    '''Tests validating many IPs at once'''
+
+    def test_v4_batch(self):
+        '''Each row gets the error validate_and_normalize_ip_dict() would have raised'''
+        addresses = array.array('I', [parse_ip(ip_address)[1] for ip_address in
+                                      ['192.0.2.5', '192.0.2.7', '192.0.2.4', '127.0.0.5',
+                                       '169.254.1.1', '224.0.0.1', '250.0.0.1']])
+        valid, errors, values = validate_ip_batch(AF_INET, addresses, 30)
+        self.assertEqual(valid, [True] + [False]*6)
+        self.assertEqual(errors, [BATCH_OK, BATCH_BROADCAST_ADDRESS, BATCH_NETWORK_ADDRESS,
+                                  BATCH_LOOPBACK, BATCH_LINK_LOCAL, BATCH_MULTICAST,
+                                  BATCH_RESERVED])
+        self.assertEqual(format_ip(AF_INET, values[0]), '192.0.2.5')
+
+        _, errors, values = validate_ip_batch(AF_INET, ['192.0.2.1', 'bogus', '::1', 1 << 32],
+                                              [24, 24, 24, 24])
+        self.assertEqual(errors, [BATCH_OK, BATCH_INVALID_ADDRESS, BATCH_WRONG_FAMILY,
+                                  BATCH_INVALID_ADDRESS])
+        self.assertIsNone(values[1])
+
+    def test_v6_halves(self):
+        '''v6 IPs can be given as high and low 64-bit halves'''
+        high = [0x20010db800000000, 0xfe80000000000000, 0x20010db800000000]
+        low = [1, 1, 1]
+        valid, errors, values = validate_ip_batch(AF_INET6, high, [64, 64, 129], low)
+        self.assertEqual(valid, [True, False, False])
+        self.assertEqual(errors, [BATCH_OK, BATCH_LINK_LOCAL, BATCH_INVALID_PREFIX])
+        self.assertEqual(format_ip(AF_INET6, values[0]), '2001:db8::1')
+
+    def test_matches_single_validation(self):
+        '''Batch and single validation agree on whether IPs are usable'''
+        ip_addresses = ['10.0.0.1', '0.0.0.1', '127.255.255.254', '240.0.0.1', '100.64.0.1']
+        prefix_lengths = [8, 8, 8, 4, 10]
+        valid, _, _ = validate_ip_batch(AF_INET, ip_addresses, prefix_lengths)
+        for ip_address, prefix_length, usable in zip(ip_addresses, prefix_lengths, valid):
+            ip_dict = {'ip_address': ip_address, 'family': AF_INET,
+                       'prefix_length': prefix_length}
+            if usable:
+                check.validate_and_normalize_ip_dict(ip_dict)
+            else:
+                self.assertRaises(ValueError, check.validate_and_normalize_ip_dict, ip_dict)
+
+if __name__ == "__main__":
+    unittest.main()